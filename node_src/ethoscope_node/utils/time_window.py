@@ -141,9 +141,9 @@ class TimeWindow(TrackingUnit):
 
     def open(self, cam):
         logging.info("Moving video to %d ms", self.start_fragment)
-        cam.capture.set(cv2.CAP_PROP_POS_MSEC, self.start_fragment)
-        frame_index = cam.capture.get(cv2.CAP_PROP_POS_FRAMES)
-        pos_msec = cam.capture.get(cv2.CAP_PROP_POS_MSEC)
+        # frame accurate, and only decodes forward from the closest keyframe
+        frame_index = cam.seek_time(self.start_fragment)
+        pos_msec = cam.index.camera_time_stamp(frame_index)
         logging.info("Opening window starting in frame %d at %d ms", frame_index, pos_msec)
         self._cam = cam
 
@@ -329,12 +329,13 @@ class TimeWindow(TrackingUnit):
                     self.positions.append(point)
                     abs_pos = self.get_last_positions(absolute=True)
                     self._last_positions[self.roi.idx] = abs_pos
-                    out = self.drawer.draw(
+                    self.drawer.draw(
                         img,
                         tracking_units=[self],
                         positions=self._last_positions,
                         roi=True
                     )
+                    out = self.drawer.last_drawn_frame
 
                 else:
                     out = img
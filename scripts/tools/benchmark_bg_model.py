@@ -0,0 +1,84 @@
+"""
+Time the update of the background model of the trackers, per ROI and per frame,
+with the former array-based update and with the current one.
+
+python benchmark_bg_model.py --sizes 60x200 120x400 --n-frames 500
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from ethoscope.trackers.adaptive_bg_tracker import BackgroundModel
+
+
+class LegacyBackgroundModel(BackgroundModel):
+    """
+    The update as it was, with a float matrix of learning rates, three passes over the ROI,
+    and a uint8 copy of the background made by the tracker
+    """
+    def __init__(self, *args, **kwargs):
+        super(LegacyBackgroundModel, self).__init__(*args, **kwargs)
+        self._buff_alpha_matrix = None
+        self._buff_invert_alpha_mat = None
+
+    def update(self, img_t, t, fg_mask=None):
+        dt = float(t - self.last_t)
+        if dt < 0:
+            raise Exception("Negative time interval between two consecutive frames")
+        self._current_half_life = min(self._current_half_life * self._increment, self._max_half_life)
+        if self._bg_mean is None:
+            self._bg_mean = img_t.astype(np.float32)
+        if self._buff_alpha_matrix is None:
+            self._buff_alpha_matrix = np.ones_like(img_t, dtype=np.float32)
+        alpha = 1 - np.exp(-np.log(2) / self._current_half_life * dt)
+        self._buff_alpha_matrix.fill(alpha)
+        if fg_mask is not None:
+            cv2.dilate(fg_mask, None, fg_mask)
+            cv2.subtract(self._buff_alpha_matrix, self._buff_alpha_matrix, self._buff_alpha_matrix, mask=fg_mask)
+        if self._buff_invert_alpha_mat is None:
+            self._buff_invert_alpha_mat = 1 - self._buff_alpha_matrix
+        else:
+            np.subtract(1, self._buff_alpha_matrix, self._buff_invert_alpha_mat)
+        np.multiply(self._buff_alpha_matrix, img_t, self._buff_alpha_matrix)
+        np.multiply(self._buff_invert_alpha_mat, self._bg_mean, self._buff_invert_alpha_mat)
+        np.add(self._buff_alpha_matrix, self._buff_invert_alpha_mat, self._bg_mean)
+        self.last_t = t
+
+    @property
+    def bg_img_u8(self):
+        return self._bg_mean.astype(np.uint8)
+
+
+def run(model, frames, masks):
+    t0 = time.perf_counter()
+    for i, (frame, mask) in enumerate(zip(frames, masks)):
+        model.update(frame, (i + 1) * 500, mask)
+        # what a tracker does with the background, once per frame
+        model.bg_img_u8
+    return (time.perf_counter() - t0) / len(frames)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", nargs="+", default=["40x160", "80x320", "160x640"],
+                        help="sizes of the ROIs, as HEIGHTxWIDTH")
+    parser.add_argument("--n-frames", type=int, default=500)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    print("%-10s %12s %12s %8s" % ("roi", "legacy (us)", "fused (us)", "speedup"))
+    for size in args.sizes:
+        h, w = [int(s) for s in size.split("x")]
+        frames = [rng.randint(0, 256, (h, w)).astype(np.uint8) for _ in range(args.n_frames)]
+        masks = []
+        for _ in range(args.n_frames):
+            mask = np.zeros((h, w), np.uint8)
+            x = rng.randint(0, max(w - h // 4, 1))
+            mask[h // 3: 2 * h // 3, x: x + h // 4] = 255
+            masks.append(mask)
+
+        legacy_t = run(LegacyBackgroundModel(), frames, [m.copy() for m in masks])
+        fused_t = run(BackgroundModel(), frames, [m.copy() for m in masks])
+        print("%-10s %12.1f %12.1f %7.2fx" % (size, legacy_t * 1e6, fused_t * 1e6, legacy_t / fused_t))
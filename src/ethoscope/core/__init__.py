@@ -5,6 +5,9 @@ It defines the building bricks at the basis of the package.
 Overview:
 
 * :class:`~ethoscope.core.monitor.Monitor` is the most important class. It glues together all the other elements of the package in order to perform (video tracking, interacting , data writing and drawing).
+* :class:`~ethoscope.core.parallel_monitor.ParallelMonitor` is a monitor that tracks ROIs in several processes.
+* :class:`~ethoscope.core.pipelined_monitor.PipelinedMonitor` is a monitor that acquires, tracks, saves and draws frames concurrently.
+* :mod:`~ethoscope.core.segmented_tracking` tracks long recordings offline, as segments tracked in parallel.
 * :class:`~ethoscope.core.tracking_unit.TrackingUnit` are internally used by monitor. They forces to conceptually treat each ROI independently.
 * :class:`~ethoscope.core.roi.ROI` formalise and facilitates the use of Region Of Interests.
 * :mod:`~ethoscope.core.variables` are custom types of variables that result from tracking and interacting.
@@ -17,6 +20,9 @@ __author__ = 'quentin'
 
 
 from . import monitor
+from . import parallel_monitor
+from . import pipelined_monitor
+from . import segmented_tracking
 from . import tracking_unit
 from . import variables
 from . import roi
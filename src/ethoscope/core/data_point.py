@@ -39,6 +39,10 @@ class DataPoint(collections.OrderedDict):
         """
         return DataPoint(copy.deepcopy(list(self.values())))
 
+    def __reduce__(self):
+        # allows data points to be sent between processes (e.g. through a :class:`~multiprocessing.Queue`)
+        return DataPoint, (list(self.values()),)
+
     def append(self, item):
         """
         Add a new variable in the `DataPoint` The order is preserved.
@@ -0,0 +1,236 @@
+__author__ = 'quentin'
+
+import logging
+import math
+from collections import deque
+
+from ethoscope.stimulators.stimulators import DefaultStimulator
+
+
+class LoadShedder(object):
+    _policies = ("uniform", "round_robin", "stimulated")
+    _table_name = "DROPPED_FRAMES"
+    # smoothing of the processing time and frame interval estimates
+    _alpha = 0.1
+    # the fraction of the time budget that tracking is allowed to use
+    _headroom = 0.9
+    # how fast the kept fraction grows back when the load decreases (per frame)
+    _recovery_step = 0.02
+
+    def __init__(self, policy="uniform", max_latency=0, max_backlog=2, min_keep=0.1):
+        """
+        Decides, frame by frame, what the monitor can afford to track, so that tracking keeps up with the camera.
+        The cost of tracking a whole frame is estimated from the processing time of the last frames.
+        When it is above the time budget (``max_latency``, or the interval between frames),
+        or when frames accumulate in the camera (``max_backlog``), only a fraction of the work is kept, according to the policy:
+
+        * ``"uniform"``: whole frames are skipped, evenly.
+        * ``"round_robin"``: all frames are used, but only a subset of the ROIs is tracked in each frame, in turns.
+        * ``"stimulated"``: as ``"round_robin"``, but ROIs with a stimulator are always tracked.
+
+        Every skipped frame (or ROI) is recorded in the ``DROPPED_FRAMES`` table, as well as the frames that the camera
+        acquired but never delivered (see :attr:`~ethoscope.hardware.input.cameras.FSLPiCameraAsync.frame_buffer_stats`),
+        so that the actual sampling times are known downstream.
+
+        :param policy: one of ``"uniform"``, ``"round_robin"`` or ``"stimulated"``
+        :type policy: str
+        :param max_latency: the time, in ms, that processing a frame may take. ``0`` means the interval between frames.
+        :type max_latency: float
+        :param max_backlog: the number of frames that may wait in the camera before shedding
+        :type max_backlog: int
+        :param min_keep: the minimal fraction of frames (or ROIs) to keep
+        :type min_keep: float
+        """
+        if policy not in self._policies:
+            raise ValueError("Unknown load shedding policy '%s'. Use one of %s" % (policy, str(self._policies)))
+        self._policy = policy
+        self._max_latency = float(max_latency) if max_latency else None
+        self._max_backlog = int(max_backlog)
+        self._min_keep = float(min_keep)
+
+        self._recording = False
+        self._records = deque()
+        self._n_units = 0
+        self._priority = []
+        self._reset()
+
+    def _reset(self):
+        self._keep = 1.0
+        self._credit = 0.0
+        self._next_unit = 0
+        self._cost = None
+        self._interval = None
+        self._last_t = None
+        self._camera_lost = 0
+        self._n_dropped_frames = 0
+        self._n_dropped_rois = 0
+        self._n_camera_lost = 0
+
+    @property
+    def policy(self):
+        return self._policy
+
+    @property
+    def stats(self):
+        """
+        :return: The fraction of the work currently kept, the estimated cost of a whole frame and the time budget (in ms),
+            and the number of frames and ROIs skipped so far (``camera_lost`` counts the frames lost by the camera itself).
+        :rtype: dict
+        """
+        budget = self._budget()
+        return {"keep": round(self._keep, 3),
+                "cost": None if self._cost is None else round(self._cost * 1e3, 3),
+                "budget": None if budget is None else round(budget * 1e3, 3),
+                "dropped_frames": self._n_dropped_frames,
+                "dropped_rois": self._n_dropped_rois,
+                "camera_lost": self._n_camera_lost}
+
+    def bind(self, tracking_units, result_writer=None):
+        """
+        Prepare a run: find the ROIs that have a stimulator, and create the ``DROPPED_FRAMES`` table.
+
+        :param tracking_units: the tracking units of the monitor
+        :type tracking_units: list(:class:`~ethoscope.core.tracking_unit.TrackingUnit`)
+        :param result_writer: the result writer of the run, if any
+        :type result_writer: :class:`~ethoscope.utils.io.ResultWriter`
+        """
+        self._reset()
+        self._n_units = len(tracking_units)
+        self._roi_indices = [track_u.roi.idx for track_u in tracking_units]
+        self._priority = [not isinstance(track_u.stimulator, DefaultStimulator) for track_u in tracking_units]
+        self._records.clear()
+        self._recording = result_writer is not None
+        if result_writer is not None:
+            result_writer._create_table(self._table_name, "t INT, frame_idx INT, roi_idx SMALLINT, n SMALLINT, reason CHAR(16)")
+
+    def _budget(self):
+        if self._max_latency is not None:
+            return self._max_latency / 1e3
+        return self._interval
+
+    def _smooth(self, old, new):
+        if old is None:
+            return new
+        return old + self._alpha * (new - old)
+
+    def select(self, frame_idx, t, backlog=0, camera_lost=0):
+        """
+        Decide what to track in a new frame.
+
+        :param frame_idx: the index of the frame
+        :type frame_idx: int
+        :param t: the time stamp of the frame, in ms
+        :type t: int
+        :param backlog: the number of frames waiting to be processed
+        :type backlog: int
+        :param camera_lost: the total number of frames lost by the camera since it started
+        :type camera_lost: int
+        :return: ``None`` if the frame is skipped, otherwise, for each tracking unit, whether it should be tracked
+        :rtype: list(bool)
+        """
+        if self._last_t is not None and t > self._last_t:
+            self._interval = self._smooth(self._interval, (t - self._last_t) / 1e3)
+        self._last_t = t
+
+        if camera_lost > self._camera_lost:
+            self._record(t, frame_idx, 0, camera_lost - self._camera_lost, "camera")
+            self._n_camera_lost += camera_lost - self._camera_lost
+        self._camera_lost = camera_lost
+
+        self._adapt(backlog)
+
+        if self._policy == "uniform":
+            self._credit += self._keep
+            if self._credit < 1.0:
+                self._n_dropped_frames += 1
+                self._record(t, frame_idx, 0, 1, "load")
+                return None
+            self._credit -= 1.0
+            return [True] * self._n_units
+
+        active = self._select_units()
+        for i, a in enumerate(active):
+            if not a:
+                self._n_dropped_rois += 1
+                self._record(t, frame_idx, self._roi_indices[i], 1, "load")
+        return active
+
+    def _adapt(self, backlog):
+        budget = self._budget()
+        if self._cost is None or budget is None:
+            return
+
+        if self._max_backlog > 0 and backlog > self._max_backlog:
+            # frames are piling up: shed more until they are consumed
+            target = self._keep / 2.0
+        else:
+            target = self._headroom * budget / self._cost
+
+        if target < self._keep:
+            self._keep = max(self._min_keep, target)
+        else:
+            self._keep = min(1.0, target, self._keep + self._recovery_step)
+
+    def _select_units(self):
+        n = self._n_units
+        if self._keep >= 1.0 or n == 0:
+            return [True] * n
+
+        budget = max(1, int(math.ceil(self._keep * n)))
+        if self._policy == "stimulated":
+            active = list(self._priority)
+            budget -= sum(active)
+        else:
+            active = [False] * n
+
+        # the other ROIs are tracked in turns
+        i = self._next_unit
+        for _ in range(n):
+            if budget <= 0:
+                break
+            if not active[i]:
+                active[i] = True
+                budget -= 1
+            i = (i + 1) % n
+        self._next_unit = i
+        return active
+
+    def update(self, processing_time, active=None):
+        """
+        Feed back the time it took to process a frame.
+
+        :param processing_time: the wall time spent on the frame, in seconds
+        :type processing_time: float
+        :param active: the tracked units, as returned by :meth:`select`
+        :type active: list(bool)
+        """
+        fraction = 1.0
+        if active is not None and len(active) > 0:
+            fraction = max(sum(active), 1) / float(len(active))
+        self._cost = self._smooth(self._cost, processing_time / fraction)
+
+    def _record(self, t, frame_idx, roi_idx, n, reason):
+        if self._recording:
+            self._records.append((int(t), int(frame_idx), int(roi_idx), int(n), reason))
+
+    def write(self, result_writer):
+        """
+        Hand the records of the skipped frames over to the result writer.
+        This may be called from another thread than :meth:`select` (e.g. the writing stage of a pipeline).
+
+        :param result_writer: the result writer of the run
+        :type result_writer: :class:`~ethoscope.utils.io.ResultWriter`
+        """
+        insert_dict = result_writer._insert_dict
+        while True:
+            try:
+                tp = self._records.popleft()
+            except IndexError:
+                break
+            if self._table_name not in insert_dict or insert_dict[self._table_name] == "":
+                insert_dict[self._table_name] = "INSERT INTO %s VALUES %s" % (self._table_name, str(tp))
+            else:
+                insert_dict[self._table_name] += ("," + str(tp))
+
+    def log_summary(self):
+        logging.info("Load shedding (%s): %s" % (self._policy, str(self.stats)))
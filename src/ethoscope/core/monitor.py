@@ -1,15 +1,45 @@
 import logging
 logging.basicConfig(level=logging.INFO)
 import traceback
+import time
 import cv2
 import os
+import numpy as np
 
 from .tracking_unit import TrackingUnit
 from ethoscope.core.variables import FrameCountVariable
+from ethoscope.core.profiler import Profiler, NullProfiler
+from ethoscope.core.load_shedding import LoadShedder
+from ethoscope.hardware.input.camera_telemetry import TelemetryRecorder
+from ethoscope.utils.debug import EthoscopeException
+from ethoscope.utils.description import DescribedObject
+from ethoscope.utils.img_proc import AffineRemapper, full_frame
 
 __author__ = 'quentin'
 
-class Monitor(object):
+class Monitor(DescribedObject):
+    _description = {"overview": "The default monitor. All ROIs are tracked one after the other, in the main process.",
+                    "arguments": [
+                        {"type": "str", "name": "interpolation",
+                         "description": "When frames are rotated, the interpolation: cubic (most accurate), linear or nearest (fastest)", "default": "cubic"},
+                        {"type": "str", "name": "profile",
+                         "description": "If TRUE, record how long each step of the tracking takes, and save it in the PROFILE table of the database", "default": "FALSE"},
+                        {"type": "str", "name": "load_shedding",
+                         "description": "When tracking cannot keep up with the camera: none, uniform (skip whole frames), round_robin (track ROIs in turns) or stimulated (as round_robin, but always track ROIs with a stimulator). Skipped frames are saved in the DROPPED_FRAMES table", "default": "none"},
+                        {"type": "number", "min": 0, "max": 10000, "step": 1, "name": "max_latency",
+                         "description": "With load shedding, the time (in ms) processing a frame may take. 0 means the interval between frames", "default": 0},
+                        {"type": "number", "min": 0, "max": 50, "step": 1, "name": "seed_frames",
+                         "description": "The number of frames whose median initialises the background of every ROI, so positions are found from the start. 0 means the background is learnt from scratch", "default": 0},
+                        {"type": "str", "name": "shared_background",
+                         "description": "If TRUE, the background of all the ROIs is kept in a single model of the arena, updated once per frame rather than ROI by ROI", "default": "FALSE"}
+                    ]}
+
+    # whether frames holding only the pixels of the ROIs can be tracked (see BaseCamera.set_tracker)
+    _roi_frames_capable = True
+    # keyword arguments used by the monitor itself, rather than passed to the trackers
+    _monitor_kwargs = ("verbose", "interpolation", "profile", "load_shedding", "max_latency", "max_backlog", "seed_frames", "shared_background")
+    # when frames are rotated, the interval (in ms) between frames rotated entirely, rather than only where the ROIs are
+    _full_frame_period = 60 * 1000
 
     def __init__(self, camera, tracker_class,
                  rois=None, stimulators=None,
@@ -26,6 +56,7 @@ class Monitor(object):
          * Using computed variables to interact physically (i.e. feed-back) with the animals (delegated to :class:`~ethoscope.stimulators.stimulators.BaseStimulator`).
          * Drawing results on a frame, optionally saving video (delegated to :class:`~ethoscope.drawers.drawers.BaseDrawer`).
          * Saving the result of tracking in a database (delegated to :class:`~ethoscope.utils.io.ResultWriter`).
+         * Optionally, timing all the above (delegated to :class:`~ethoscope.core.profiler.Profiler`).
 
         :param camera: a camera object responsible of acquiring frames and associated time stamps
         :type camera: :class:`~ethoscope.hardware.input.cameras.BaseCamera`
@@ -35,6 +66,25 @@ class Monitor(object):
         :type rois: list(:class:`~ethoscope.core.roi.ROI`)
         :param stimulators: The class that will be used to analyse the position of the object and interact with the system/hardware.
         :type stimulators: list(:class:`~ethoscope.stimulators.stimulators.BaseInteractor`
+        :param interpolation: when frames are rotated (see :meth:`run`), the interpolation method: ``"cubic"`` (the default), ``"linear"`` or ``"nearest"``
+        :type interpolation: str
+        :param profile: if ``True`` (or ``"TRUE"``), the duration of each stage of the tracking (in each ROI) is recorded.
+            See :class:`~ethoscope.core.profiler.Profiler`.
+        :type profile: bool
+        :param load_shedding: the policy applied when tracking falls behind the camera (see :class:`~ethoscope.core.load_shedding.LoadShedder`),
+            or ``"none"`` (the default) to track all frames regardless
+        :type load_shedding: str
+        :param max_latency: with load shedding, the time (in ms) processing a frame may take (``0`` for the interval between frames)
+        :type max_latency: float
+        :param max_backlog: with load shedding, the number of frames that may wait in the camera
+        :type max_backlog: int
+        :param seed_frames: the number of frames whose median initialises the background model of the trackers,
+            before these frames are tracked (see :meth:`seed_background`). ``0`` (the default) means trackers learn the background from scratch.
+            Trackers that already have a background (e.g. restored from a checkpoint) are not seeded.
+        :type seed_frames: int
+        :param shared_background: if ``True`` (or ``"TRUE"``), and the trackers support it, the background of all the ROIs
+            is modelled in a single image, updated once per frame (see :meth:`~ethoscope.trackers.trackers.BaseTracker.share_background`)
+        :type shared_background: bool
         :param args: additional arguments passed to the tracking algorithm
         :param kwargs: additional keyword arguments passed to the tracking algorithm
         """
@@ -51,6 +101,28 @@ class Monitor(object):
         except KeyError:
             self._verbose = False
 
+        self._interpolation = kwargs.pop("interpolation", "cubic")
+        self._remapper = None
+        self._remapper_M = None
+        self._last_full_frame_t = None
+
+        profile = kwargs.pop("profile", False)
+        if profile is True or str(profile).upper() == "TRUE":
+            self._profiler = Profiler()
+        else:
+            self._profiler = NullProfiler()
+
+        load_shedding = kwargs.pop("load_shedding", "none")
+        max_latency = kwargs.pop("max_latency", 0)
+        max_backlog = kwargs.pop("max_backlog", 2)
+        if load_shedding is None or str(load_shedding).lower() == "none":
+            self._shedder = None
+        else:
+            self._shedder = LoadShedder(load_shedding, max_latency, max_backlog)
+        self._telemetry = TelemetryRecorder()
+        self._seed_frames = int(kwargs.pop("seed_frames", 0))
+        shared_background = kwargs.pop("shared_background", False)
+
         if rois is None:
             raise NotImplementedError("rois must exist (cannot be None)")
 
@@ -66,6 +138,24 @@ class Monitor(object):
         else:
             raise ValueError("You should have one interactor per ROI")
 
+        self._shared_background = None
+        if shared_background is True or str(shared_background).upper() == "TRUE":
+            self._shared_background = self._share_background([track_u.tracker for track_u in self._unit_trackers], rois)
+
+        self._checkpointer = None
+
+        if self._profiler.enabled:
+            for track_u in self._unit_trackers:
+                track_u.set_profiler(self._profiler)
+
+    @property
+    def time_to_first_position(self):
+        """
+        :return: For each ROI, the time, in ms, tracking took to find a first position, or ``None`` if it found none yet
+        :rtype: dict
+        """
+        return {track_u.roi.idx: track_u.tracker.time_to_first_position for track_u in self._unit_trackers}
+
     @property
     def last_positions(self):
         """
@@ -91,6 +181,101 @@ class Monitor(object):
         """
         return self._last_frame_idx
 
+    @property
+    def info(self):
+        """
+        :return: Extra information about the running monitor, meant to be displayed alongside the fps and time stamp.
+        :rtype: dict
+        """
+        out = {}
+        if self._profiler.enabled:
+            out["profile"] = self._profiler.summary()
+        if self._shedder is not None:
+            out["load_shedding"] = self._shedder.stats
+        try:
+            # video files decoded in the background report their own throughput
+            decoder_stats = self._camera.decoder_stats
+        except AttributeError:
+            decoder_stats = None
+        if decoder_stats is not None:
+            out["decoding"] = decoder_stats
+        try:
+            # the last sampled settings of the camera (gains, shutter speed, ...)
+            telemetry = self._camera.telemetry
+        except AttributeError:
+            telemetry = None
+        if telemetry is not None:
+            out["camera"] = telemetry
+        delays = [d for d in self.time_to_first_position.values() if d is not None]
+        out["time_to_first_position"] = {"n_waiting": len(self._unit_trackers) - len(delays),
+                                         "median": None if len(delays) == 0 else float(np.median(delays)),
+                                         "max": None if len(delays) == 0 else max(delays)}
+        return out
+
+    @property
+    def profiler(self):
+        """
+        :return: The profiler recording the duration of each stage (it records nothing unless profiling is enabled)
+        :rtype: :class:`~ethoscope.core.profiler.NullProfiler`
+        """
+        return self._profiler
+
+    def get_state(self):
+        """
+        :return: The state of all the trackers, with keys prefixed by the ROI, e.g. ``"roi_1.bg_mean"``
+            (see :meth:`~ethoscope.trackers.trackers.BaseTracker.get_state`), and the state they share,
+            saved once, with keys prefixed by ``"shared."`` (see :meth:`~ethoscope.trackers.trackers.BaseTracker.get_shared_state`)
+        :rtype: dict
+        """
+        out = {}
+        for track_u in self._unit_trackers:
+            prefix = "roi_%i." % track_u.roi.idx
+            for k, v in track_u.tracker.get_state().items():
+                out[prefix + k] = v
+        if len(self._unit_trackers) > 0:
+            for k, v in type(self._unit_trackers[0].tracker).get_shared_state().items():
+                out["shared." + k] = v
+        return out
+
+    def set_state(self, state):
+        """
+        Restore the state of the trackers, as returned by :meth:`get_state`. ROIs missing from ``state`` are left untouched.
+
+        :param state: the state
+        :type state: dict
+        :return: the number of trackers restored
+        :rtype: int
+        """
+        n = 0
+        for track_u in self._unit_trackers:
+            prefix = "roi_%i." % track_u.roi.idx
+            sub_state = {k[len(prefix):]: v for k, v in state.items() if k.startswith(prefix)}
+            if len(sub_state) == 0:
+                continue
+            track_u.tracker.set_state(sub_state)
+            n += 1
+        shared_state = {k[len("shared."):]: v for k, v in state.items() if k.startswith("shared.")}
+        if len(shared_state) > 0 and len(self._unit_trackers) > 0:
+            type(self._unit_trackers[0].tracker).set_shared_state(shared_state)
+        return n
+
+    def set_checkpointer(self, checkpointer):
+        """
+        Periodically save the state of the trackers (and of the result writer) whilst running.
+
+        :param checkpointer: the object saving the states
+        :type checkpointer: :class:`~ethoscope.utils.checkpoint.StateCheckpointer`
+        """
+        self._checkpointer = checkpointer
+
+    def _checkpoint(self, t, result_writer=None):
+        if self._checkpointer is None or not self._checkpointer.is_due(t):
+            return
+        state = self.get_state()
+        if result_writer is not None:
+            state.update(result_writer.get_state())
+        self._checkpointer.save(t, state)
+
     def stop(self):
         """
         Interrupts the `run` method. This is meant to be called by another thread to stop monitoring externally.
@@ -109,6 +294,256 @@ class Monitor(object):
         return 0
 
 
+    def _track_frame(self, t, frame, active=None):
+        """
+        Track all the ROIs of one frame.
+
+        :param t: the time stamp associated to the frame (in ms).
+        :type t: int
+        :param frame: the entire frame to analyse
+        :type frame: :class:`~numpy.ndarray`
+        :param active: for each tracking unit, whether it should be tracked. ``None`` means all of them.
+        :type active: list(bool)
+        :return: the data rows of each tracking unit, in the same order as the tracking units (``None`` for the units not tracked)
+        :rtype: list(list(:class:`~ethoscope.core.data_point.DataPoint`))
+        """
+        if active is None:
+            out = [track_u.track(t, frame) for track_u in self._unit_trackers]
+        else:
+            out = [track_u.track(t, frame) if a else None for track_u, a in zip(self._unit_trackers, active)]
+
+        if self._shared_background is not None:
+            t0 = self._profiler.now()
+            self._shared_background.update()
+            self._profiler.lap("background", t0)
+        return out
+
+    @staticmethod
+    def _share_background(trackers, rois):
+        """
+        Make the trackers keep their background in a single model of the whole arena.
+
+        :return: the shared model, or ``None`` if the trackers cannot share one
+        :rtype: :class:`~ethoscope.trackers.adaptive_bg_tracker.ArenaBackgroundModel`
+        """
+        if len(trackers) == 0 or trackers[0].shared_background_class is None:
+            logging.warning("These trackers cannot share a background. It is modelled ROI by ROI")
+            return None
+        try:
+            shared_background = trackers[0].shared_background_class(rois)
+        except EthoscopeException as e:
+            logging.warning("Cannot share the background of the ROIs: %s. It is modelled ROI by ROI" % e)
+            return None
+
+        n_shared = sum([tracker.share_background(shared_background) for tracker in trackers])
+        logging.info("%i ROIs share a background of %s pixels" % (n_shared, "x".join([str(s) for s in shared_background.shape])))
+        if n_shared == 0:
+            return None
+        return shared_background
+
+    def _prepare_frame(self, frame, M=None, t=None):
+        """
+        Transform a raw frame before tracking. At the moment, it only rotates the frame when a rotation matrix is given.
+        The rotation is only computed on the union of the ROIs (see :class:`~ethoscope.utils.img_proc.AffineRemapper`),
+        except every ``_full_frame_period``, when the entire frame is rotated. Outside the ROIs, the quality control,
+        the drawer and the snapshots therefore see the last entirely rotated frame, as with cameras delivering only the ROIs.
+        Note that the returned frame is then overwritten by the next call.
+        """
+        if M is None:
+            return frame
+
+        if self._remapper is None or self._remapper_M is not M or self._remapper.shape != frame.shape:
+            logging.info("Precomputing the rotation of the ROIs (%s interpolation)" % self._interpolation)
+            rectangles = [track_u.roi.rectangle for track_u in self._unit_trackers]
+            self._remapper = AffineRemapper(M, frame.shape, rectangles, self._interpolation)
+            self._remapper_M = M
+            self._last_full_frame_t = None
+
+        full = t is None or self._last_full_frame_t is None or t - self._last_full_frame_t >= self._full_frame_period
+        if full and t is not None:
+            self._last_full_frame_t = t
+        return self._remapper.apply(frame, full)
+
+    def _start(self, drawer=None, M=None):
+        """
+        Save an annotated frame showing the ROIs, and switch the camera to tracking mode.
+        Unless frames are transformed (``M``), the camera is told which ROIs are tracked, so it may only deliver their pixels.
+        """
+        for x in self._camera:
+            i, (t, frame) = x
+            drawer.draw(frame, tracking_units=self._unit_trackers, positions=None, t=t)
+            img = drawer.last_drawn_frame
+            roi_builder_output_path = os.path.join('/root', "roi_builder_output.png")
+            logging.info(f"Saving roi builder result to {roi_builder_output_path}")
+            cv2.imwrite(roi_builder_output_path, img)
+            break
+
+        self._is_running = True
+
+        if M is None and self._roi_frames_capable:
+            self._camera.set_tracker(rois=[track_u.roi for track_u in self._unit_trackers])
+        else:
+            self._camera.set_tracker()
+        if self._grey_frames_possible():
+            logging.info("Camera and trackers support grey frames. Tracking without colour conversion")
+            self._camera.set_grey(True)
+
+    def seed_background(self, frame, t):
+        """
+        Initialise the background model of every tracker from a reference frame (e.g. the median of a few frames),
+        so that positions are found from the first tracked frame, rather than once the background is learnt.
+        Trackers that already have a background, e.g. restored with :meth:`set_state`, keep it.
+
+        :param frame: the reference frame, in the coordinates of the ROIs (i.e. transformed as tracked frames are)
+        :type frame: :class:`~numpy.ndarray`
+        :param t: the time of the reference, in ms
+        :type t: int
+        :return: the number of trackers that used the reference
+        :rtype: int
+        """
+        return sum([track_u.seed_background(frame, t) for track_u in self._unit_trackers])
+
+    def _frames(self, M=None):
+        """
+        Iterate over the frames of the camera. With ``seed_frames``, the first frames are held back until the background
+        of the trackers is seeded from their median, and are then delivered as usual.
+        """
+        frames = iter(self._camera)
+        burst = []
+        if self._seed_frames > 0:
+            for i, (t, frame) in frames:
+                # frames are only valid until the next one is read
+                burst.append((i, (t, np.copy(full_frame(frame)))))
+                if len(burst) == self._seed_frames:
+                    break
+
+        if len(burst) > 0:
+            t0 = time.perf_counter()
+            median = np.median(np.stack([frame for _, (_, frame) in burst]), axis=0).astype(np.uint8)
+            n_seeded = self.seed_background(self._prepare_frame(median, M), burst[0][1][0])
+            logging.info("Seeded the background of %i ROIs from the median of %i frames in %.2fs" %
+                         (n_seeded, len(burst), time.perf_counter() - t0))
+
+        for x in burst:
+            yield x
+        for x in frames:
+            yield x
+
+    def _grey_frames_possible(self):
+        """
+        :return: Whether the camera can deliver grey frames and all the trackers accept them
+        :rtype: bool
+        """
+        if not getattr(self._camera, "grey_capable", False):
+            return False
+        return all([track_u.tracker.grey_capable for track_u in self._unit_trackers])
+
+    def _track(self, i, t, frame, active=None):
+        """
+        Track all the ROIs of a frame (or only the ``active`` ones), and update the last positions.
+
+        :return: the ROIs where something was found, with the corresponding data rows (including the frame count)
+        :rtype: list((:class:`~ethoscope.core.roi.ROI`, list(:class:`~ethoscope.core.data_point.DataPoint`)))
+        """
+        self._last_frame_idx = i
+        self._last_time_stamp = t
+        self._frame_buffer = frame
+
+        t0 = self._profiler.now()
+        all_data_rows = self._track_frame(t, frame, active)
+        self._profiler.lap("tracking", t0)
+
+        out = []
+        for track_u, data_rows in zip(self._unit_trackers, all_data_rows):
+            if data_rows is None:
+                # skipped by load shedding: the last position is kept
+                continue
+            if len(data_rows) == 0:
+                self._last_positions[track_u.roi.idx] = []
+                continue
+
+            abs_pos = track_u.get_last_positions(absolute=True)
+
+            # if abs_pos is not None:
+            self._last_positions[track_u.roi.idx] = abs_pos
+
+            frame_count = FrameCountVariable(i)
+            data_rows[0].append(frame_count)
+            out.append((track_u.roi, data_rows))
+
+        return out
+
+    def _write(self, i, t, frame, tracked, result_writer=None, quality_controller=None):
+        """
+        Save the quality control of a frame and the data rows found in it.
+        """
+        t0 = self._profiler.now()
+        if quality_controller is not None:
+            qc = quality_controller.qc(full_frame(frame))
+            quality_controller.write(t, qc)
+            t0 = self._profiler.lap("quality_control", t0)
+
+        if result_writer is not None:
+            for roi, data_rows in tracked:
+                result_writer.write(t, roi, data_rows)
+            if self._shedder is not None:
+                self._shedder.write(result_writer)
+            self._telemetry.write(result_writer, self._camera_telemetry())
+
+        self.flush(t, frame, frame_idx=i, result_writer=result_writer, tracking_units=self._unit_trackers)
+        self._profiler.lap("result_writer", t0)
+
+    def _draw(self, frame, drawer, positions, t=None):
+        if drawer is not None:
+            t0 = self._profiler.now()
+            drawer.draw(frame, tracking_units=self._unit_trackers, positions=positions, t=t)
+            self._profiler.lap("drawing", t0)
+
+    def _camera_backlog(self):
+        """
+        :return: the number of frames waiting in the camera, and the number of frames it lost, when the camera reports them
+        :rtype: (int, int)
+        """
+        try:
+            stats = self._camera.frame_buffer_stats
+        except AttributeError:
+            return 0, 0
+        return stats["pending"], stats["overwritten"] + stats["dropped"] + stats["skipped"]
+
+    def _camera_telemetry(self):
+        """
+        :return: the settings sampled by the camera since the last call, when the camera reports them
+        :rtype: list((int, dict))
+        """
+        try:
+            return self._camera.pop_telemetry()
+        except AttributeError:
+            return []
+
+    def _shed(self, i, t, extra_backlog=0):
+        """
+        :return: ``None`` if the frame should be skipped, otherwise, for each tracking unit, whether it should be tracked
+        """
+        backlog, lost = self._camera_backlog()
+        return self._shedder.select(i, t, backlog + extra_backlog, lost)
+
+    def _end_run(self, result_writer):
+        """
+        Save what was recorded about the run itself: the latency histograms, when profiling is enabled,
+        and the last skipped frames, when load shedding is enabled.
+        """
+        if self._shedder is not None:
+            self._shedder.log_summary()
+            if result_writer is not None:
+                self._shedder.write(result_writer)
+
+        if not self._profiler.enabled or result_writer is None:
+            return
+        try:
+            self._profiler.write(result_writer)
+        except Exception as e:
+            logging.error("Could not save the profile of the run: '%s'" % traceback.format_exc())
+
     def run(self, result_writer = None, drawer = None, quality_controller=None, M=None):
         """
         Runs the monitor indefinitely.
@@ -117,68 +552,58 @@ class Monitor(object):
         :type result_writer: :class:`~ethoscope.utils.io.ResultWriter`
         :param drawer: A drawer to plot the data on frames, display frames and/or save videos. `None` means none of the aforementioned actions will performed.
         :type drawer: :class:`~ethoscope.drawers.drawers.BaseDrawer`
+        :param quality_controller: An optional object computing and saving statistics about each frame
+        :type quality_controller: :class:`~ethoscope.core.qc.QualityControl`
+        :param M: An optional affine transformation matrix (e.g. a rotation) to apply to frames before tracking.
+            The ROIs are defined in the coordinates of the transformed frame. Outside the ROIs, the transformed frame is only
+            refreshed every minute (see :meth:`_prepare_frame`).
+        :type M: :class:`~numpy.ndarray`
         """
 
         try:
             logging.info("Monitor starting a run")
-            for x in self._camera:
-                i, (t, frame) = x
-                img = drawer.draw(frame, tracking_units=self._unit_trackers, positions=None)
-                roi_builder_output_path = os.path.join('/root', "roi_builder_output.png")
-                logging.info(f"Saving roi builder result to {roi_builder_output_path}")
-                cv2.imwrite(roi_builder_output_path, img)
-                break
-
-            self._is_running = True
-
-            self._camera.set_tracker()
+            self._start(drawer, M)
+            if self._shedder is not None:
+                self._shedder.bind(self._unit_trackers, result_writer)
+            self._telemetry.bind(result_writer)
 
-            for x in self._camera:
+            t_frame = self._profiler.now()
+            for x in self._frames(M):
+                t0 = self._profiler.lap("camera", t_frame)
 
                 i, (t, frame) = x
 
-                if M is not None:
-                    logging.debug('Rotating input frame')
-                    frame = cv2.warpAffine(frame, M, frame.shape[:2][::-1], flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
-
                 if self._force_stop:
                     logging.info("Monitor object stopped from external request")
                     break
 
-                self._last_frame_idx = i
-                self._last_time_stamp = t
-                self._frame_buffer = frame
-
-                if quality_controller is not None:
-                    qc = quality_controller.qc(frame)
-                    quality_controller.write(t, qc)
-
-                for j, track_u in enumerate(self._unit_trackers):
-                    data_rows = track_u.track(t, frame)
-                    if len(data_rows) == 0:
-                        self._last_positions[track_u.roi.idx] = []
+                start = time.perf_counter()
+                active = None
+                if self._shedder is not None:
+                    active = self._shed(i, t)
+                    if active is None:
+                        t_frame = self._profiler.now()
                         continue
 
-                    abs_pos = track_u.get_last_positions(absolute=True)
-
-                    # if abs_pos is not None:
-                    self._last_positions[track_u.roi.idx] = abs_pos
-
-                    if result_writer is not None:
-                        frame_count = FrameCountVariable(i)
-                        data_rows[0].append(frame_count)
-                        result_writer.write(t, track_u.roi, data_rows)
-
-                self.flush(t, frame, frame_idx=i, result_writer=result_writer, tracking_units=self._unit_trackers)
+                t0 = self._profiler.now()
+                frame = self._prepare_frame(frame, M, t)
+                self._profiler.lap("prepare", t0)
 
-                if drawer is not None:
-                    drawer.draw(frame, tracking_units=self._unit_trackers, positions=self._last_positions)
+                tracked = self._track(i, t, frame, active)
+                self._write(i, t, frame, tracked, result_writer, quality_controller)
+                self._draw(frame, drawer, self._last_positions, t)
+                self._checkpoint(t, result_writer)
                 self._last_t = t
+                if self._shedder is not None:
+                    self._shedder.update(time.perf_counter() - start, active)
+                # the whole period of a frame, including waiting for the camera
+                t_frame = self._profiler.lap("frame", t_frame)
 
         except Exception as e:
             logging.error("Monitor closing with an exception: '%s'" % traceback.format_exc())
             raise e
 
         finally:
+            self._end_run(result_writer)
             self._is_running = False
             logging.info("Monitor closing")
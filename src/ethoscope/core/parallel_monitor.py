@@ -0,0 +1,348 @@
+__author__ = 'quentin'
+
+import logging
+import multiprocessing
+import time
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from ethoscope.core.monitor import Monitor
+from ethoscope.core.profiler import DurationRecorder
+from ethoscope.utils.debug import EthoscopeException
+
+
+class TrackingWorker(multiprocessing.Process):
+    def __init__(self, worker_id, rois, tracker_class, shm_name, shape, dtype, task_queue, result_queue, *args,
+                 shared_background=False, profile=False, **kwargs):
+        """
+        A process that owns the trackers of a subset of the ROIs.
+        Designed to be used within :class:`~ethoscope.core.parallel_monitor.ParallelMonitor`.
+        Frames are not sent through the task queue. Instead, they are read from a shared memory block
+        that the parent process updates before each task.
+
+        :param worker_id: the index of this worker
+        :type worker_id: int
+        :param rois: the ROIs tracked by this worker
+        :type rois: list(:class:`~ethoscope.core.roi.ROI`)
+        :param tracker_class: The algorithm that will be used for tracking.
+        :type tracker_class: class
+        :param shm_name: the name of the shared memory block holding the current frame
+        :type shm_name: str
+        :param shape: the shape of the frame
+        :param dtype: the data type of the frame
+        :param task_queue: a queue receiving time stamps and which ROIs to track (or ``None`` to stop the worker).
+            A task can also be a command: ``("seed", t)`` seeds the background of the trackers from the shared frame,
+            ``("get_state",)`` sends back the state of the trackers, and ``("set_state", states, shared_state)`` restores it
+            (see :meth:`~ethoscope.core.monitor.Monitor.get_state`).
+        :type task_queue: :class:`~multiprocessing.Queue`
+        :param result_queue: a queue, shared by all workers, where the data rows are sent back,
+            with the durations of the stages of each tracker (when ``profile`` is set)
+        :type result_queue: :class:`~multiprocessing.Queue`
+        :param shared_background: whether the trackers of this worker share a single model of the background
+            (see :meth:`~ethoscope.core.monitor.Monitor._share_background`)
+        :type shared_background: bool
+        :param profile: whether to time the cropping and tracking in each ROI (see :class:`~ethoscope.core.profiler.DurationRecorder`)
+        :type profile: bool
+        :param args: additional arguments passed to the tracking algorithm
+        :param kwargs: additional keyword arguments passed to the tracking algorithm
+        """
+        self._worker_id = worker_id
+        self._rois = rois
+        self._tracker_class = tracker_class
+        self._shm_name = shm_name
+        self._shape = shape
+        self._dtype = dtype
+        self._task_queue = task_queue
+        self._result_queue = result_queue
+        self._shared_background = shared_background
+        self._profile = profile
+        self._args = args
+        self._kwargs = kwargs
+        super(TrackingWorker, self).__init__()
+
+    def _command(self, trackers, frame, task):
+        if task[0] == "seed":
+            return [tracker.seed_background(frame, task[1]) for tracker in trackers]
+        if task[0] == "get_state":
+            return [tracker.get_state() for tracker in trackers], self._tracker_class.get_shared_state()
+        if task[0] == "set_state":
+            _, states, shared_state = task
+            for tracker, state in zip(trackers, states):
+                if state is not None:
+                    tracker.set_state(state)
+            if len(shared_state) > 0:
+                self._tracker_class.set_shared_state(shared_state)
+            return [state is not None for state in states]
+        raise EthoscopeException("Unknown command '%s'" % str(task[0]))
+
+    def run(self):
+        shm = shared_memory.SharedMemory(name=self._shm_name)
+        try:
+            frame = np.ndarray(self._shape, dtype=self._dtype, buffer=shm.buf)
+            trackers = [self._tracker_class(r, *self._args, **self._kwargs) for r in self._rois]
+            shared_background = None
+            if self._shared_background:
+                shared_background = Monitor._share_background(trackers, self._rois)
+            recorder = None
+            if self._profile:
+                recorder = DurationRecorder()
+                for tracker in trackers:
+                    tracker.set_profiler(recorder)
+
+            while True:
+                task = self._task_queue.get()
+                if task is None:
+                    break
+
+                start = time.perf_counter()
+                if isinstance(task[0], str):
+                    try:
+                        out = self._command(trackers, frame, task)
+                    except Exception:
+                        self._result_queue.put((self._worker_id, None, traceback.format_exc()))
+                        break
+                    self._result_queue.put((self._worker_id, out, time.perf_counter() - start))
+                    continue
+
+                t, active = task
+                try:
+                    if active is None:
+                        out = [tracker.track(t, frame) for tracker in trackers]
+                    else:
+                        out = [tracker.track(t, frame) if a else None for tracker, a in zip(trackers, active)]
+                except Exception:
+                    self._result_queue.put((self._worker_id, None, traceback.format_exc()))
+                    break
+                if shared_background is not None:
+                    shared_background.update()
+
+                durations = recorder.pop() if recorder is not None else []
+                self._result_queue.put((self._worker_id, (out, durations), time.perf_counter() - start))
+
+        except KeyboardInterrupt:
+            pass
+        finally:
+            shm.close()
+
+
+class ParallelMonitor(Monitor):
+    _description = {"overview": "A monitor that shares the ROIs between several tracking processes. "
+                                "Use it when a single core cannot keep up with the frame rate.",
+                    "arguments": Monitor._description["arguments"] + [
+                        {"type": "number", "min": 0, "max": 8, "step": 1, "name": "n_workers",
+                         "description": "The number of tracking processes. 0 means one per core, minus one.", "default": 0}
+                    ]}
+
+    _worker_timeout = 30 # in seconds
+    # frames are copied whole to other processes or stages
+    _roi_frames_capable = False
+
+    def __init__(self, camera, tracker_class, rois=None, stimulators=None, *args, **kwargs):
+        """
+        A monitor that tracks the ROIs in a pool of worker processes (:class:`~ethoscope.core.parallel_monitor.TrackingWorker`).
+        Each worker owns the trackers of a fixed subset of the ROIs, so the state of the trackers stays in the workers.
+        Every frame is copied once in a shared memory block, and the resulting data rows are sent back to
+        the main process, where the stimulators, result writer and drawer are used exactly like in :class:`~ethoscope.core.monitor.Monitor`.
+
+        :param n_workers: the number of worker processes. ``0`` (the default) means one per core, minus one.
+        :type n_workers: int
+
+        Other arguments are the same as in :class:`~ethoscope.core.monitor.Monitor`.
+        """
+        n_workers = int(kwargs.pop("n_workers", 0))
+        if n_workers < 1:
+            n_workers = max(1, multiprocessing.cpu_count() - 1)
+
+        self._tracker_class = tracker_class
+        self._tracker_args = args
+        self._tracker_kwargs = {k: v for k, v in kwargs.items() if k not in self._monitor_kwargs}
+        # the background is shared by the trackers of each worker, rather than by the copies of the trackers in this process
+        shared_background = kwargs.pop("shared_background", False)
+        self._worker_shared_background = shared_background is True or str(shared_background).upper() == "TRUE"
+
+        super(ParallelMonitor, self).__init__(camera, tracker_class, rois, stimulators, *args, **kwargs)
+
+        self._n_workers = min(n_workers, len(self._unit_trackers))
+        self._workers = []
+        self._task_queues = []
+        self._result_queue = None
+        self._shm = None
+        self._shared_frame = None
+        # the indices of the tracking units handled by each worker
+        self._worker_units = [list(range(len(self._unit_trackers)))[i::self._n_workers] for i in range(self._n_workers)]
+        self._busy_time = [0.0] * self._n_workers
+        self._pool_start_time = None
+        # the state to restore in the workers, once they are started
+        self._pending_state = None
+
+    @property
+    def worker_utilisation(self):
+        """
+        :return: For each worker, the proportion of time spent tracking since the pool was started.
+        :rtype: list(float)
+        """
+        if self._pool_start_time is None:
+            return []
+        elapsed = time.perf_counter() - self._pool_start_time
+        if elapsed <= 0:
+            return [0.0] * self._n_workers
+        return [round(b / elapsed, 3) for b in self._busy_time]
+
+    @property
+    def info(self):
+        out = super(ParallelMonitor, self).info
+        out["worker_utilisation"] = self.worker_utilisation
+        return out
+
+    def _start_workers(self, frame):
+        self._shm = shared_memory.SharedMemory(create=True, size=frame.nbytes)
+        self._shared_frame = np.ndarray(frame.shape, dtype=frame.dtype, buffer=self._shm.buf)
+        self._result_queue = multiprocessing.Queue()
+
+        for i, unit_indices in enumerate(self._worker_units):
+            task_queue = multiprocessing.Queue()
+            rois = [self._unit_trackers[j].roi for j in unit_indices]
+            w = TrackingWorker(i, rois, self._tracker_class, self._shm.name, frame.shape, frame.dtype,
+                               task_queue, self._result_queue, *self._tracker_args,
+                               shared_background=self._worker_shared_background, profile=self._profiler.enabled,
+                               **self._tracker_kwargs)
+            w.daemon = True
+            w.start()
+            self._task_queues.append(task_queue)
+            self._workers.append(w)
+
+        logging.info("Started %i tracking workers for %i ROIs" % (self._n_workers, len(self._unit_trackers)))
+        self._pool_start_time = time.perf_counter()
+        if self._pending_state is not None:
+            self._send_state(self._pending_state)
+            self._pending_state = None
+
+    def _command(self, task):
+        """
+        Send a command to all the workers (see :class:`~ethoscope.core.parallel_monitor.TrackingWorker`).
+
+        :return: the result of each worker, in the order of the workers
+        :rtype: list
+        """
+        for q in self._task_queues:
+            q.put(task)
+        out = [None] * self._n_workers
+        for _ in range(self._n_workers):
+            worker_id, result, error = self._result_queue.get(timeout=self._worker_timeout)
+            if result is None:
+                raise Exception("Tracking worker %i failed:\n%s" % (worker_id, error))
+            out[worker_id] = result
+        return out
+
+    def _send_state(self, state):
+        shared_state = {k[len("shared."):]: v for k, v in state.items() if k.startswith("shared.") and not k.startswith("shared.worker_")}
+        for worker_id, (q, unit_indices) in enumerate(zip(self._task_queues, self._worker_units)):
+            states = []
+            for j in unit_indices:
+                prefix = "roi_%i." % self._unit_trackers[j].roi.idx
+                sub_state = {k[len(prefix):]: v for k, v in state.items() if k.startswith(prefix)}
+                states.append(sub_state if len(sub_state) > 0 else None)
+            # each worker has its own foreground model. A monitor tracking in a single process saves only one
+            prefix = "shared.worker_%i." % worker_id
+            worker_shared_state = {k[len(prefix):]: v for k, v in state.items() if k.startswith(prefix)}
+            if len(worker_shared_state) == 0:
+                worker_shared_state = shared_state
+            q.put(("set_state", states, worker_shared_state))
+        for _ in range(self._n_workers):
+            worker_id, restored, error = self._result_queue.get(timeout=self._worker_timeout)
+            if restored is None:
+                raise Exception("Tracking worker %i failed:\n%s" % (worker_id, error))
+
+    def get_state(self):
+        """
+        The state of the trackers, which live in the workers. See :meth:`~ethoscope.core.monitor.Monitor.get_state`.
+        The foreground model of each worker is saved with keys prefixed by ``"shared.worker_<i>."``.
+        When the workers are not running, this is the state waiting to be restored, if any.
+        """
+        if self._shm is None:
+            return dict(self._pending_state) if self._pending_state is not None else {}
+
+        out = {}
+        for worker_id, (states, shared_state) in enumerate(self._command(("get_state",))):
+            for j, state in zip(self._worker_units[worker_id], states):
+                prefix = "roi_%i." % self._unit_trackers[j].roi.idx
+                for k, v in state.items():
+                    out[prefix + k] = v
+            for k, v in shared_state.items():
+                out["shared.worker_%i.%s" % (worker_id, k)] = v
+        return out
+
+    def set_state(self, state):
+        """
+        Restore the state of the trackers in the workers, as soon as they are started.
+        See :meth:`~ethoscope.core.monitor.Monitor.set_state`.
+        """
+        if self._shm is None:
+            self._pending_state = state
+        else:
+            self._send_state(state)
+        prefixes = ["roi_%i." % track_u.roi.idx for track_u in self._unit_trackers]
+        return len([p for p in prefixes if any([k.startswith(p) for k in state.keys()])])
+
+    def seed_background(self, frame, t):
+        """
+        Seed the background of the trackers, which live in the workers.
+        See :meth:`~ethoscope.core.monitor.Monitor.seed_background`.
+        """
+        if self._shm is None:
+            self._start_workers(frame)
+        np.copyto(self._shared_frame, frame)
+        return sum([sum(seeded) for seeded in self._command(("seed", t))])
+
+    def _stop_workers(self):
+        for q in self._task_queues:
+            q.put(None)
+        for w in self._workers:
+            w.join(5)
+            if w.is_alive():
+                logging.warning("Tracking worker %s did not stop. Terminating it" % w.name)
+                w.terminate()
+
+        self._workers = []
+        self._task_queues = []
+        self._shared_frame = None
+
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def _track_frame(self, t, frame, active=None):
+        if self._shm is None:
+            self._start_workers(frame)
+
+        if frame.shape != self._shared_frame.shape or frame.dtype != self._shared_frame.dtype:
+            raise EthoscopeException("Frame shape changed whilst tracking in parallel", frame)
+
+        # all the workers are idle at this point, so the frame can be safely overwritten
+        np.copyto(self._shared_frame, frame)
+        for q, unit_indices in zip(self._task_queues, self._worker_units):
+            q.put((t, None if active is None else [active[j] for j in unit_indices]))
+
+        remote_rows = [None] * len(self._unit_trackers)
+        for _ in range(self._n_workers):
+            worker_id, result, busy = self._result_queue.get(timeout=self._worker_timeout)
+            if result is None:
+                raise Exception("Tracking worker %i failed:\n%s" % (worker_id, busy))
+            self._busy_time[worker_id] += busy
+            rows, durations = result
+            # the trackers were timed in the worker, in each ROI
+            for stage, roi_idx, dt in durations:
+                self._profiler.add(stage, dt, roi_idx)
+            for j, r in zip(self._worker_units[worker_id], rows):
+                remote_rows[j] = r
+
+        return [None if rows is None else track_u.replay(t, rows) for track_u, rows in zip(self._unit_trackers, remote_rows)]
+
+    def run(self, *args, **kwargs):
+        try:
+            super(ParallelMonitor, self).run(*args, **kwargs)
+        finally:
+            self._stop_workers()
@@ -0,0 +1,316 @@
+__author__ = 'quentin'
+
+import logging
+import queue
+import threading
+import time
+import traceback
+
+import numpy as np
+
+from ethoscope.core.monitor import Monitor
+
+
+class StageQueue(queue.Queue):
+    _policies = ("block", "drop_newest", "drop_oldest")
+    _poll_interval = 0.5 # in seconds
+
+    def __init__(self, name, maxsize=2, policy="block"):
+        """
+        A bounded queue feeding one stage of a :class:`~ethoscope.core.pipelined_monitor.PipelinedMonitor`.
+        When the queue is full, the policy defines what happens to a new item:
+
+        * ``"block"``: the producer waits for the consumer (i.e. backpressure). No item is ever lost.
+        * ``"drop_newest"``: the new item is discarded.
+        * ``"drop_oldest"``: the oldest item in the queue is discarded, so the consumer always gets the most recent data.
+
+        :param name: the name of the stage, for logging
+        :type name: str
+        :param maxsize: the maximal number of items waiting in the queue
+        :type maxsize: int
+        :param policy: one of ``"block"``, ``"drop_newest"`` or ``"drop_oldest"``
+        :type policy: str
+        """
+        if policy not in self._policies:
+            raise ValueError("Unknown drop policy '%s' for stage %s. Use one of %s" % (policy, name, str(self._policies)))
+        self._name = name
+        self._policy = policy
+        self._dropped = 0
+        super(StageQueue, self).__init__(maxsize=maxsize)
+
+    @property
+    def dropped(self):
+        """
+        :return: The number of items discarded so far
+        :rtype: int
+        """
+        return self._dropped
+
+    def push(self, item, stop_event):
+        """
+        Add an item according to the drop policy of this queue.
+
+        :param item: the item to add
+        :param stop_event: when set, a blocked producer gives up
+        :type stop_event: :class:`~threading.Event`
+        """
+        if self._policy == "block":
+            while not stop_event.is_set():
+                try:
+                    self.put(item, timeout=self._poll_interval)
+                    return
+                except queue.Full:
+                    pass
+            return
+
+        try:
+            self.put_nowait(item)
+            return
+        except queue.Full:
+            pass
+
+        self._dropped += 1
+        if self._policy == "drop_newest":
+            return
+        try:
+            self.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            self.put_nowait(item)
+        except queue.Full:
+            pass
+
+    def close(self, stop_event):
+        """
+        Signal the end of the stream to the consumer. This never drops the end signal.
+        """
+        while True:
+            try:
+                self.put(None, timeout=self._poll_interval)
+                return
+            except queue.Full:
+                if stop_event.is_set():
+                    # the consumer may be gone. Make room for the end signal
+                    try:
+                        self.get_nowait()
+                    except queue.Empty:
+                        pass
+
+    def pull(self, stop_event):
+        """
+        :return: the next item, or ``None`` when the stream is over (or the pipeline is stopped)
+        """
+        while not stop_event.is_set():
+            try:
+                return self.get(timeout=self._poll_interval)
+            except queue.Empty:
+                pass
+        return None
+
+
+class PipelinedMonitor(Monitor):
+    _description = {"overview": "A monitor that acquires, tracks, saves and draws frames concurrently. "
+                                "Frames are acquired whilst the previous ones are tracked and saved.",
+                    "arguments": Monitor._description["arguments"] + [
+                        {"type": "number", "min": 1, "max": 32, "step": 1, "name": "queue_size",
+                         "description": "The number of frames that can wait in between two stages", "default": 2},
+                        {"type": "str", "name": "policies",
+                         "description": "What a stage does when its queue is full: block, drop_newest or drop_oldest, as stage:policy pairs separated by commas (tracking, writing and drawing)",
+                         "default": "tracking:block,writing:block,drawing:drop_oldest"},
+                        {"type": "str", "name": "sequential",
+                         "description": "If TRUE, run the stages one after the other, like the default monitor (for debugging)", "default": "FALSE"}
+                    ]}
+
+    _default_policies = {"tracking": "block", "writing": "block", "drawing": "drop_oldest"}
+    # frames are copied whole to other processes or stages
+    _roi_frames_capable = False
+
+    def __init__(self, camera, tracker_class, rois=None, stimulators=None, *args, **kwargs):
+        """
+        A monitor that runs its work in four stages, connected by bounded queues (:class:`~ethoscope.core.pipelined_monitor.StageQueue`):
+
+         * acquisition: iterating through the camera (and rotating the frames)
+         * tracking: tracking all the ROIs and applying the stimulators (in the thread calling :meth:`run`)
+         * writing: quality control and result serialisation
+         * drawing: annotating frames
+
+        This way, frame N+1 can be acquired whilst frame N is tracked and frame N-1 is saved.
+
+        :param queue_size: the maximal number of frames waiting in between two stages
+        :type queue_size: int
+        :param policies: the drop policy of the input queue of the "tracking", "writing" and "drawing" stages,
+            as a dictionary or as a string of ``stage:policy`` pairs separated by commas (e.g. ``"drawing:drop_newest"``).
+            By default, tracking and writing apply backpressure and never drop data, whilst drawing drops its oldest frames.
+        :type policies: dict or str
+        :param sequential: if ``True``, stages are run one after the other in a single thread, like :class:`~ethoscope.core.monitor.Monitor`
+        :type sequential: bool
+
+        Other arguments are the same as in :class:`~ethoscope.core.monitor.Monitor`.
+        """
+        self._queue_size = int(kwargs.pop("queue_size", 2))
+        self._policies = dict(self._default_policies)
+        self._policies.update(self._parse_policies(kwargs.pop("policies", {})))
+        sequential = kwargs.pop("sequential", False)
+        self._sequential = sequential is True or str(sequential).upper() == "TRUE"
+
+        self._queues = {}
+        self._stop_event = threading.Event()
+        self._stage_errors = []
+        super(PipelinedMonitor, self).__init__(camera, tracker_class, rois, stimulators, *args, **kwargs)
+
+    @property
+    def info(self):
+        out = super(PipelinedMonitor, self).info
+        out["dropped_in_stages"] = {k: q.dropped for k, q in self._queues.items()}
+        out["queued_in_stages"] = {k: q.qsize() for k, q in self._queues.items()}
+        return out
+
+    @classmethod
+    def _parse_policies(cls, policies):
+        if isinstance(policies, dict):
+            return policies
+        out = {}
+        for pair in str(policies).split(","):
+            if pair.strip() == "":
+                continue
+            try:
+                stage, policy = [s.strip() for s in pair.split(":")]
+            except ValueError:
+                raise ValueError("Cannot parse the drop policy '%s'. Use stage:policy" % pair)
+            if stage not in cls._default_policies:
+                raise ValueError("Unknown stage '%s'. Use one of %s" % (stage, str(list(cls._default_policies.keys()))))
+            out[stage] = policy
+        return out
+
+    def stop(self):
+        """
+        Interrupts the `run` method. Frames already tracked are still saved (and drawn, unless the drawing stage drops them)
+        before `run` returns.
+        """
+        # the stop event is kept for failures, as it makes all the stages give up, whatever is still queued
+        super(PipelinedMonitor, self).stop()
+
+    def _stage_thread(self, name, target, *args):
+        def wrapped():
+            try:
+                target(*args)
+            except Exception as e:
+                logging.error("Pipeline stage '%s' failed: '%s'" % (name, traceback.format_exc()))
+                self._stage_errors.append(e)
+                self._stop_event.set()
+
+        th = threading.Thread(target=wrapped, name="ethoscope_%s_stage" % name)
+        th.daemon = True
+        return th
+
+    def _acquire(self, M):
+        out = self._queues["tracking"]
+        try:
+            t0 = self._profiler.now()
+            for i, (t, frame) in self._frames(M):
+                t0 = self._profiler.lap("camera", t0)
+                if self._stop_event.is_set() or self._force_stop:
+                    break
+                # cameras (and the rotation) reuse their frame buffer, so the frame is copied before it is handed over
+                frame = np.copy(self._prepare_frame(frame, M, t))
+                self._profiler.lap("prepare", t0)
+                out.push((i, t, frame), self._stop_event)
+                t0 = self._profiler.now()
+        finally:
+            out.close(self._stop_event)
+
+    def _save(self, result_writer, quality_controller):
+        q = self._queues["writing"]
+        while True:
+            item = q.pull(self._stop_event)
+            if item is None:
+                break
+            i, t, frame, tracked = item
+            self._write(i, t, frame, tracked, result_writer, quality_controller)
+
+    def _annotate(self, drawer):
+        q = self._queues["drawing"]
+        while True:
+            item = q.pull(self._stop_event)
+            if item is None:
+                break
+            t, frame, positions = item
+            self._draw(frame, drawer, positions, t)
+
+    def run(self, result_writer=None, drawer=None, quality_controller=None, M=None):
+        if self._sequential:
+            logging.info("Pipelined monitor running sequentially")
+            return super(PipelinedMonitor, self).run(result_writer, drawer, quality_controller, M)
+
+        self._stop_event.clear()
+        self._stage_errors = []
+        self._queues = {k: StageQueue(k, self._queue_size, self._policies[k]) for k in ("tracking", "writing", "drawing")}
+
+        threads = []
+        try:
+            logging.info("Pipelined monitor starting a run")
+            self._start(drawer, M)
+            if self._shedder is not None:
+                self._shedder.bind(self._unit_trackers, result_writer)
+            self._telemetry.bind(result_writer)
+
+            threads = [self._stage_thread("acquisition", self._acquire, M),
+                       self._stage_thread("writing", self._save, result_writer, quality_controller)]
+            if drawer is not None:
+                threads.append(self._stage_thread("drawing", self._annotate, drawer))
+            for th in threads:
+                th.start()
+
+            in_queue = self._queues["tracking"]
+            while True:
+                item = in_queue.pull(self._stop_event)
+                if item is None:
+                    break
+
+                if self._force_stop:
+                    logging.info("Monitor object stopped from external request")
+                    break
+
+                i, t, frame = item
+                start = time.perf_counter()
+                active = None
+                if self._shedder is not None:
+                    # frames waiting for tracking are part of the backlog
+                    active = self._shed(i, t, in_queue.qsize())
+                    if active is None:
+                        continue
+
+                tracked = self._track(i, t, frame, active)
+                if self._shedder is not None:
+                    self._shedder.update(time.perf_counter() - start, active)
+                # trackers may modify their last data points later (e.g. when inferring a position),
+                # whilst the writing stage may not have saved them yet
+                tracked = [(roi, [dr.copy() for dr in data_rows]) for roi, data_rows in tracked]
+                self._checkpoint(t, result_writer)
+                self._queues["writing"].push((i, t, frame, tracked), self._stop_event)
+                if drawer is not None:
+                    self._queues["drawing"].push((t, frame, dict(self._last_positions)), self._stop_event)
+                self._last_t = t
+
+            # let the downstream stages finish their work
+            self._queues["writing"].close(self._stop_event)
+            self._queues["drawing"].close(self._stop_event)
+            for th in threads[1:]:
+                th.join()
+            # the acquisition stage may still be blocked on a full queue
+            self._stop_event.set()
+            threads[0].join()
+
+            if len(self._stage_errors) > 0:
+                raise self._stage_errors[0]
+
+        except Exception as e:
+            logging.error("Monitor closing with an exception: '%s'" % traceback.format_exc())
+            raise e
+
+        finally:
+            self._stop_event.set()
+            self._end_run(result_writer)
+            self._is_running = False
+            logging.info("Monitor closing")
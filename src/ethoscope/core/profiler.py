@@ -0,0 +1,256 @@
+__author__ = 'quentin'
+
+import bisect
+import logging
+import time
+
+import numpy as np
+
+
+class LatencyHistogram(object):
+    #: Upper edges of the bins, in seconds: logarithmically spaced, 8 bins per decade, from 1us to 10s.
+    #: An extra bin holds the durations above the last edge.
+    bin_edges = [float(e) for e in np.logspace(-6, 1, 7 * 8 + 1)]
+
+    def __init__(self):
+        """
+        A fixed-size histogram of durations. Adding a duration is a binary search and an increment,
+        so it can be used on every frame (and every ROI) without allocating memory.
+        Quantiles are estimated from the bins, so they are given with a precision of about 30%.
+        """
+        self._counts = [0] * (len(self.bin_edges) + 1)
+        self._n = 0
+        self._total = 0.0
+        self._max = 0.0
+
+    @property
+    def n(self):
+        return self._n
+
+    @property
+    def counts(self):
+        """
+        :return: The number of durations in each bin (see :attr:`bin_edges`)
+        :rtype: list(int)
+        """
+        return list(self._counts)
+
+    def add(self, dt):
+        """
+        :param dt: a duration, in seconds
+        :type dt: float
+        """
+        self._counts[bisect.bisect_left(self.bin_edges, dt)] += 1
+        self._n += 1
+        self._total += dt
+        if dt > self._max:
+            self._max = dt
+
+    def merge(self, other):
+        """
+        Add all the durations of another histogram to this one.
+
+        :type other: :class:`~ethoscope.core.profiler.LatencyHistogram`
+        """
+        for i, c in enumerate(other._counts):
+            self._counts[i] += c
+        self._n += other._n
+        self._total += other._total
+        self._max = max(self._max, other._max)
+
+    def quantile(self, q):
+        """
+        :param q: a quantile, between 0 and 1
+        :type q: float
+        :return: The upper edge of the bin containing the quantile ``q``, in seconds (the maximum for the last bin)
+        :rtype: float
+        """
+        if self._n == 0:
+            return 0.0
+        target = q * self._n
+        cumul = 0
+        for i, c in enumerate(self._counts):
+            cumul += c
+            if c > 0 and cumul >= target:
+                if i >= len(self.bin_edges):
+                    return self._max
+                return min(self.bin_edges[i], self._max)
+        return self._max
+
+    def summary(self):
+        """
+        :return: The number of durations, and their mean, median, 95th and 99th percentiles and maximum, in ms
+        :rtype: dict
+        """
+        mean = self._total / self._n if self._n > 0 else 0.0
+        return {"n": self._n,
+                "mean": round(mean * 1e3, 3),
+                "p50": round(self.quantile(0.50) * 1e3, 3),
+                "p95": round(self.quantile(0.95) * 1e3, 3),
+                "p99": round(self.quantile(0.99) * 1e3, 3),
+                "max": round(self._max * 1e3, 3)}
+
+
+class NullProfiler(object):
+    """
+    A profiler that records nothing. It is used when profiling is disabled, so that the instrumented code
+    does not have to test whether a profiler exists.
+    """
+    enabled = False
+
+    def now(self):
+        return None
+
+    def lap(self, stage, t0, roi_idx=0):
+        return None
+
+    def add(self, stage, dt, roi_idx=0):
+        pass
+
+    def summary(self, per_roi=False):
+        return {}
+
+    def write(self, result_writer):
+        pass
+
+
+class Profiler(NullProfiler):
+    enabled = True
+    _table_name = "PROFILE"
+
+    def __init__(self):
+        """
+        Records the wall time spent in each stage of the tracking loop (and, for some stages, in each ROI)
+        in :class:`~ethoscope.core.profiler.LatencyHistogram` objects. Nothing is logged whilst tracking:
+        the histograms are read live through :meth:`summary` and saved at the end of a run with :meth:`write`.
+
+        A stage is timed by chaining time stamps::
+
+            t0 = profiler.now()
+            do_something()
+            t0 = profiler.lap("something", t0)
+            do_something_else(roi)
+            profiler.lap("something_else", t0, roi.idx)
+
+        """
+        self._histograms = {}
+
+    def now(self):
+        return time.perf_counter()
+
+    def lap(self, stage, t0, roi_idx=0):
+        """
+        Record the time elapsed since ``t0`` for a stage.
+
+        :param stage: the name of the stage
+        :type stage: str
+        :param t0: the time stamp, from :meth:`now` (or a previous :meth:`lap`), when the stage started
+        :type t0: float
+        :param roi_idx: the index of the ROI, or ``0`` for the stages that concern the whole frame
+        :type roi_idx: int
+        :return: the current time stamp, to time the next stage
+        :rtype: float
+        """
+        t = time.perf_counter()
+        self.add(stage, t - t0, roi_idx)
+        return t
+
+    def add(self, stage, dt, roi_idx=0):
+        """
+        Record a duration that was measured elsewhere (e.g. in another process, see :class:`~ethoscope.core.profiler.DurationRecorder`).
+
+        :param stage: the name of the stage
+        :type stage: str
+        :param dt: the duration, in seconds
+        :type dt: float
+        :param roi_idx: the index of the ROI, or ``0`` for the stages that concern the whole frame
+        :type roi_idx: int
+        """
+        key = (stage, roi_idx)
+        try:
+            hist = self._histograms[key]
+        except KeyError:
+            hist = LatencyHistogram()
+            self._histograms[key] = hist
+        hist.add(dt)
+
+    def histograms(self, per_roi=True):
+        """
+        :param per_roi: whether to keep one histogram per ROI, or to merge the ROIs of each stage
+        :type per_roi: bool
+        :return: the histograms, by ``(stage, roi_idx)``. When ROIs are merged, ``roi_idx`` is ``0``.
+        :rtype: dict
+        """
+        # stages may be added by other threads whilst we read
+        items = sorted(list(self._histograms.items()))
+        if per_roi:
+            return dict(items)
+        out = {}
+        for (stage, _), hist in items:
+            merged = out.setdefault((stage, 0), LatencyHistogram())
+            merged.merge(hist)
+        return out
+
+    def summary(self, per_roi=False):
+        """
+        :return: The latency statistics (see :meth:`~ethoscope.core.profiler.LatencyHistogram.summary`) of each stage.
+            By default, the ROIs of a stage are merged, and the keys are the names of the stages.
+        :rtype: dict
+        """
+        hists = self.histograms(per_roi)
+        if per_roi:
+            return {"%s_%i" % k: h.summary() for k, h in hists.items()}
+        return {stage: h.summary() for (stage, _), h in hists.items()}
+
+    def write(self, result_writer):
+        """
+        Save all the histograms in the ``PROFILE`` table of the result database.
+        Each row is a stage in a ROI (``roi_idx = 0`` for whole frames), with its statistics, in ms,
+        and the non-empty bins, as ``upper_edge:count`` pairs (the upper edge in ms).
+
+        :param result_writer: the result writer of the run
+        :type result_writer: :class:`~ethoscope.utils.io.ResultWriter`
+        """
+        result_writer._create_table(self._table_name,
+                                    "stage CHAR(32), roi_idx SMALLINT, n INT, mean FLOAT, p50 FLOAT, "
+                                    "p95 FLOAT, p99 FLOAT, max FLOAT, bins VARCHAR(2000)")
+        edges = LatencyHistogram.bin_edges + [float("inf")]
+        for (stage, roi_idx), hist in self.histograms(per_roi=True).items():
+            s = hist.summary()
+            bins = ",".join(["%g:%i" % (e * 1e3, c) for e, c in zip(edges, hist.counts) if c > 0])
+            tp = (stage, roi_idx, s["n"], s["mean"], s["p50"], s["p95"], s["p99"], s["max"], bins)
+            result_writer._write_async_command("INSERT INTO %s VALUES %s" % (self._table_name, str(tp)))
+        logging.info("Saved the latency of %i stages in the %s table" % (len(self._histograms), self._table_name))
+
+
+class DurationRecorder(NullProfiler):
+    enabled = True
+
+    def __init__(self):
+        """
+        A profiler that keeps the durations it is given, rather than histograms, until they are collected with :meth:`pop`.
+        It is used where the histograms cannot be updated directly, e.g. in the tracking processes of
+        :class:`~ethoscope.core.parallel_monitor.ParallelMonitor`, which send the durations of each frame
+        back to the :class:`~ethoscope.core.profiler.Profiler` of the monitor.
+        """
+        self._durations = []
+
+    def now(self):
+        return time.perf_counter()
+
+    def lap(self, stage, t0, roi_idx=0):
+        t = time.perf_counter()
+        self._durations.append((stage, roi_idx, t - t0))
+        return t
+
+    def add(self, stage, dt, roi_idx=0):
+        self._durations.append((stage, roi_idx, dt))
+
+    def pop(self):
+        """
+        :return: the durations recorded since the last call, as ``(stage, roi_idx, duration)``
+        :rtype: list(tuple)
+        """
+        out = self._durations
+        self._durations = []
+        return out
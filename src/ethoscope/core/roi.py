@@ -1,6 +1,7 @@
 import cv2
 import numpy as np
 from ethoscope.utils.debug import EthoscopeException
+from ethoscope.utils.img_proc import PackedFrame
 
 __author__ = 'quentin'
 
@@ -143,16 +144,18 @@ class ROI(object):
         Cut an image where the ROI is defined.
 
         :param img: An image. Typically either one or three channels `uint8`.
-        :type img: :class:`~numpy.ndarray`
+            When only the pixels of the ROIs were transferred, they are read directly from the packed frame.
+        :type img: :class:`~numpy.ndarray` or :class:`~ethoscope.utils.img_proc.PackedFrame`
         :return: a tuple containing the resulting cropped image and the associated mask (both have the same dimension).
         :rtype: (:class:`~numpy.ndarray`, :class:`~numpy.ndarray`)
         """
         x,y,w,h = self._rectangle
 
-
-
         try:
-            out = img[y : y + h, x : x +w]
+            if isinstance(img, PackedFrame):
+                out = img.crop(self._rectangle)
+            else:
+                out = img[y : y + h, x : x +w]
         except:
             raise EthoscopeException("Error whilst slicing region of interest %s" % str(self.get_feature_dict()), img)
 
@@ -0,0 +1,326 @@
+"""
+Offline tracking of long recordings, in parallel.
+The recording (a single video file, or the consecutive chunks written by the recorder) is split into time segments,
+each tracked by its own process and saved in its own database. Each segment starts with a warm-up,
+the frames just before the segment, so that the background model has converged when the segment starts.
+The segment databases are then merged into a single database, as written by :class:`~ethoscope.utils.io.SQLiteResultWriter`.
+
+Typical use::
+
+    segments = plan_segments(paths, n_segments=8, warmup=120)
+    track_segments(segments, "result.db", AdaptiveBGModel, rois, jobs=8, metadata=metadata)
+
+"""
+
+__author__ = 'quentin'
+
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+import traceback
+
+import cv2
+
+from ethoscope.core.monitor import Monitor
+from ethoscope.drawers.drawers import NullDrawer
+from ethoscope.hardware.input.cameras import VideoSegmentCamera
+from ethoscope.utils.debug import EthoscopeException
+from ethoscope.utils.io import SQLiteResultWriter
+
+
+class VideoSegment(object):
+    def __init__(self, idx, parts, start_t, end_t=None):
+        """
+        A segment of a recording, tracked on its own.
+
+        :param idx: the index of the segment in the recording
+        :type idx: int
+        :param parts: the parts of video files to read, warm-up included (see :class:`~ethoscope.hardware.input.cameras.VideoSegmentCamera`)
+        :type parts: list(tuple)
+        :param start_t: the time stamp (in ms) of the first frame of the segment, after the warm-up
+        :type start_t: int
+        :param end_t: the time stamp (in ms) of the first frame of the next segment, or ``None`` for the last segment
+        :type end_t: int
+        """
+        self.idx = idx
+        self.parts = parts
+        self.start_t = start_t
+        self.end_t = end_t
+
+    def __repr__(self):
+        return "VideoSegment(%i, %s, %s, %s)" % (self.idx, str(self.parts), str(self.start_t), str(self.end_t))
+
+
+def _count_frames(path):
+    capture = cv2.VideoCapture(path)
+    try:
+        n = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        if n > 0:
+            return n
+        # raw streams (e.g. h264 chunks) do not tell their length
+        logging.warning("Counting the frames of %s" % path)
+        n = 0
+        while capture.grab():
+            n += 1
+        return n
+    finally:
+        capture.release()
+
+
+def _fps(path):
+    # chunks from the recorder have the frame rate in their name, e.g. "..._1280x960@25_00001.h264"
+    match = re.search(r"@(\d+)_\d+\.\w+$", os.path.basename(path))
+    if match is not None:
+        return float(match.group(1))
+    capture = cv2.VideoCapture(path)
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    capture.release()
+    if fps <= 0:
+        raise EthoscopeException("Cannot find the frame rate of %s" % path)
+    return fps
+
+
+def _time_stamp_at(path, frame_idx):
+    """
+    :return: the time stamp (in ms) that :class:`~ethoscope.hardware.input.cameras.MovieVirtualCamera` gives to a frame
+    """
+    if frame_idx == 0:
+        return 0
+    capture = cv2.VideoCapture(path)
+    capture.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+    t = capture.get(cv2.CAP_PROP_POS_MSEC)
+    capture.release()
+    return int(t)
+
+
+def plan_segments(paths, n_segments=1, warmup=120, jobs=1):
+    """
+    Split a recording into segments.
+    A single video file is split into ``n_segments`` segments of the same number of frames.
+    Consecutive chunk files are tracked one segment per file, and time stamps continue from one file to the next.
+
+    :param paths: the video file, or the chunk files, in order
+    :type paths: str or list(str)
+    :param n_segments: the number of segments, for a single video file
+    :type n_segments: int
+    :param warmup: the duration, in seconds, tracked before each segment and then discarded
+    :type warmup: float
+    :param jobs: the number of processes used to count the frames of chunk files
+    :type jobs: int
+    :return: the segments
+    :rtype: list(:class:`~ethoscope.core.segmented_tracking.VideoSegment`)
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    if len(paths) == 0:
+        raise EthoscopeException("No video to track")
+
+    if len(paths) == 1:
+        path = paths[0]
+        n_frames = _count_frames(path)
+        n_segments = max(1, min(int(n_segments), n_frames))
+        n_warmup = int(round(warmup * _fps(path)))
+        bounds = [n_frames * i // n_segments for i in range(n_segments + 1)]
+        start_ts = [_time_stamp_at(path, b) for b in bounds[:-1]]
+        out = []
+        for i in range(n_segments):
+            parts = [(path, max(0, bounds[i] - n_warmup), bounds[i + 1], 0, 0)]
+            end_t = start_ts[i + 1] if i + 1 < n_segments else None
+            out.append(VideoSegment(i, parts, start_ts[i], end_t))
+        return out
+
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            n_frames = pool.map(_count_frames, paths)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        n_frames = [_count_frames(p) for p in paths]
+
+    fps = [_fps(p) for p in paths]
+    # the index of the first frame of each file, and its time stamp
+    frame_offsets = [0]
+    t_offsets = [0]
+    for n, f in zip(n_frames, fps):
+        frame_offsets.append(frame_offsets[-1] + n)
+        t_offsets.append(t_offsets[-1] + int(round(1000.0 * n / f)))
+
+    out = []
+    for i, path in enumerate(paths):
+        parts = []
+        if i > 0:
+            n_warmup = int(round(warmup * fps[i - 1]))
+            prev = n_frames[i - 1]
+            parts.append((paths[i - 1], max(0, prev - n_warmup), prev, frame_offsets[i - 1], t_offsets[i - 1]))
+        parts.append((path, 0, n_frames[i], frame_offsets[i], t_offsets[i]))
+        end_t = t_offsets[i + 1] if i + 1 < len(paths) else None
+        out.append(VideoSegment(i, parts, t_offsets[i], end_t))
+    return out
+
+
+def track_segment(segment, db_path, tracker_class, rois, tracker_kwargs=None, metadata=None, prefetch=0, drop_each=1, M=None):
+    """
+    Track one segment, warm-up included, and save the result in its own database.
+
+    :param segment: the segment to track
+    :type segment: :class:`~ethoscope.core.segmented_tracking.VideoSegment`
+    :param db_path: the path of the resulting database
+    :type db_path: str
+    :param tracker_class: the class of tracker to use in each ROI
+    :param rois: the ROIs, shared by all segments
+    :type rois: list(:class:`~ethoscope.core.roi.ROI`)
+    :param tracker_kwargs: additional arguments of the tracker (and monitor)
+    :type tracker_kwargs: dict
+    :param metadata: the metadata of the experiment
+    :type metadata: dict
+    :param prefetch: the number of frames decoded ahead
+    :type prefetch: int
+    :param drop_each: track only one frame in ``drop_each``
+    :type drop_each: int
+    :param M: the rotation matrix from the ROI builder, if frames are rotated before tracking (as in :meth:`~ethoscope.core.monitor.Monitor.run`)
+    :type M: :class:`~numpy.ndarray`
+    """
+    if tracker_kwargs is None:
+        tracker_kwargs = {}
+    start = time.time()
+    cam = VideoSegmentCamera(segment.parts, prefetch=prefetch, drop_each=drop_each)
+    try:
+        monit = Monitor(cam, tracker_class, rois, **tracker_kwargs)
+        db_credentials = {"name": db_path, "user": "", "password": ""}
+        rw = SQLiteResultWriter(db_credentials, rois, metadata=metadata, path=db_path)
+        with rw as result_writer:
+            monit.run(result_writer, NullDrawer(), M=M)
+    finally:
+        cam._close()
+    logging.info("Segment %i tracked in %.1fs" % (segment.idx, time.time() - start))
+
+
+def _track_segment_process(*args):
+    try:
+        track_segment(*args)
+    except Exception:
+        logging.error("Failed to track a segment: '%s'" % traceback.format_exc())
+        os._exit(1)
+
+
+# tables describing the experiment rather than what happened in a segment. They are taken from the first segment
+_experiment_tables = ("METADATA", "ROI_MAP", "VAR_MAP", "START_EVENTS")
+
+
+def merge_segment_dbs(db_paths, segments, output):
+    """
+    Merge the databases of consecutive segments into one database.
+    Of each segment, only the rows between its start and the start of the next segment are kept (i.e. the warm-up is dropped).
+    Non-null ids are renumbered, so they are consecutive in the merged database.
+
+    :param db_paths: the database of each segment
+    :type db_paths: list(str)
+    :param segments: the segments, in the same order
+    :type segments: list(:class:`~ethoscope.core.segmented_tracking.VideoSegment`)
+    :param output: the path of the merged database. It is overwritten.
+    :type output: str
+    """
+    if os.path.exists(output):
+        os.remove(output)
+    db = sqlite3.connect(output)
+    try:
+        created = set()
+        for k, (db_path, segment) in enumerate(zip(db_paths, segments)):
+            db.execute("ATTACH DATABASE ? AS seg", (db_path,))
+            tables = db.execute("SELECT name, sql FROM seg.sqlite_master WHERE type = 'table'").fetchall()
+            for name, sql in tables:
+                if name not in created:
+                    db.execute(sql)
+                    created.add(name)
+
+                columns = [c[1] for c in db.execute("PRAGMA seg.table_info(%s)" % name)]
+                if name in _experiment_tables or "t" not in columns:
+                    if k == 0:
+                        db.execute("INSERT INTO main.%s SELECT * FROM seg.%s" % (name, name))
+                    continue
+
+                where = "t >= %i" % segment.start_t
+                if segment.end_t is not None:
+                    where += " AND t < %i" % segment.end_t
+                selected = list(columns)
+                if "id" in columns:
+                    # ids continue from the previous segments
+                    first_id = db.execute("SELECT MIN(id) FROM seg.%s WHERE %s" % (name, where)).fetchone()[0]
+                    last_id = db.execute("SELECT MAX(id) FROM main.%s" % name).fetchone()[0]
+                    if first_id is not None:
+                        selected[columns.index("id")] = "id - %i" % (first_id - (last_id or 0) - 1)
+                db.execute("INSERT INTO main.%s (%s) SELECT %s FROM seg.%s WHERE %s ORDER BY rowid" %
+                           (name, ", ".join(columns), ", ".join(selected), name, where))
+            db.commit()
+            db.execute("DETACH DATABASE seg")
+    finally:
+        db.close()
+
+
+def track_segments(segments, output, tracker_class, rois, jobs=None, tracker_kwargs=None,
+                   metadata=None, prefetch=0, drop_each=1, tmp_dir=None, keep_segments=False, M=None):
+    """
+    Track segments in parallel, one process per segment, and merge their results.
+
+    :param segments: the segments, from :func:`~ethoscope.core.segmented_tracking.plan_segments`
+    :type segments: list(:class:`~ethoscope.core.segmented_tracking.VideoSegment`)
+    :param output: the path of the resulting database
+    :type output: str
+    :param jobs: the number of segments tracked at the same time (the number of CPUs by default)
+    :type jobs: int
+    :param tmp_dir: where to create the directory holding the database of each segment (next to the output by default)
+    :type tmp_dir: str
+    :param keep_segments: whether to keep the directory of the segment databases after merging
+    :type keep_segments: bool
+
+    Other arguments are the same as in :func:`~ethoscope.core.segmented_tracking.track_segment`.
+    """
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    if tmp_dir is None:
+        tmp_dir = os.path.dirname(os.path.abspath(output))
+    os.makedirs(tmp_dir, exist_ok=True)
+    segment_dir = tempfile.mkdtemp(prefix="segments_", dir=tmp_dir)
+    db_paths = [os.path.join(segment_dir, "segment_%05d.db" % s.idx) for s in segments]
+
+    start = time.time()
+    pending = list(zip(segments, db_paths))
+    running = []
+    failed = []
+    try:
+        while len(pending) > 0 or len(running) > 0:
+            while len(pending) > 0 and len(running) < jobs:
+                segment, db_path = pending.pop(0)
+                p = multiprocessing.Process(target=_track_segment_process, name="ethoscope_segment_%i" % segment.idx,
+                                            args=(segment, db_path, tracker_class, rois, tracker_kwargs, metadata, prefetch, drop_each, M))
+                p.start()
+                running.append((segment, p))
+
+            running[0][1].join(timeout=1)
+            for segment, p in list(running):
+                if p.is_alive():
+                    continue
+                running.remove((segment, p))
+                if p.exitcode != 0:
+                    failed.append(segment.idx)
+
+        if len(failed) > 0:
+            raise EthoscopeException("Failed to track the segments %s" % str(sorted(failed)))
+
+        logging.info("%i segments tracked in %.1fs. Merging them in %s" % (len(segments), time.time() - start, output))
+        merge_segment_dbs(db_paths, segments, output)
+
+    finally:
+        for _, p in running:
+            p.terminate()
+        if not keep_segments:
+            shutil.rmtree(segment_dir, ignore_errors=True)
+        else:
+            logging.info("The database of each segment is kept in %s" % segment_dir)
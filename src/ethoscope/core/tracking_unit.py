@@ -2,6 +2,7 @@ __author__ = 'quentin'
 from ethoscope.core.variables import BaseRelativeVariable
 from ethoscope.core.data_point import DataPoint
 from ethoscope.stimulators.stimulators import DefaultStimulator
+from ethoscope.core.profiler import NullProfiler
 
 
 class TrackingUnit(object):
@@ -31,7 +32,17 @@ class TrackingUnit(object):
             self._stimulator = DefaultStimulator(None)
 
         self._stimulator.bind_tracker(self._tracker)
+        self._profiler = NullProfiler()
 
+    def set_profiler(self, profiler):
+        """
+        Record the time spent cropping, tracking and stimulating in this ROI.
+
+        :param profiler: the profiler of the monitor
+        :type profiler: :class:`~ethoscope.core.profiler.Profiler`
+        """
+        self._profiler = profiler
+        self._tracker.set_profiler(profiler)
 
     @property
     def stimulator(self):
@@ -41,6 +52,14 @@ class TrackingUnit(object):
         """
         return self._stimulator
 
+    @property
+    def tracker(self):
+        """
+        :return: A reference to the tracker used by this `TrackingUnit`
+        :rtype: :class:`~ethoscope.trackers.trackers.BaseTracker`
+        """
+        return self._tracker
+
     @property
     def roi(self):
         """
@@ -90,8 +109,37 @@ class TrackingUnit(object):
         :rtype:  :class:`~ethoscope.core.data_point.DataPoint`
         """
         data_rows = self._tracker.track(t, img)
+        return self._stimulate(data_rows)
+
+    def seed_background(self, img, t):
+        """
+        Initialise the background model of the tracker from a reference frame
+        (see :meth:`~ethoscope.trackers.trackers.BaseTracker.seed_background`).
+
+        :return: whether the tracker used the reference
+        :rtype: bool
+        """
+        return self._tracker.seed_background(img, t)
+
+    def replay(self, t, data_rows):
+        """
+        Uses data rows that were computed elsewhere (e.g. by a copy of the tracker living in a worker process)
+        as if they had just been found by the tracker of this unit. Then, runs the stimulator object.
+
+        :param t: the time stamp associated to the data rows (in ms).
+        :type t: int
+        :param data_rows: the positions found by the remote tracker
+        :type data_rows: list(:class:`~ethoscope.core.data_point.DataPoint`)
+        :return: The resulting data point
+        :rtype:  :class:`~ethoscope.core.data_point.DataPoint`
+        """
+        data_rows = self._tracker.replay(t, data_rows)
+        return self._stimulate(data_rows)
 
+    def _stimulate(self, data_rows):
+        t0 = self._profiler.now()
         interact, result = self._stimulator.apply()
+        self._profiler.lap("stimulator", t0, self._roi.idx)
         if len(data_rows) == 0:
             return []
 
@@ -150,4 +150,11 @@ class CoreMovement(XYDistance):
     header_name = "core_movement"
 
 class PeripheryMovement(XYDistance):
-    header_name = "periphery_movement"
\ No newline at end of file
+    header_name = "periphery_movement"
+
+class IsMotionGatedVariable(BaseBoolVariable):
+    """
+    Type encoding whether a data point was repeated because no change was detected in the ROI (1),
+    rather than found by a full tracking step (0).
+    """
+    header_name = "is_motion_gated"
@@ -9,22 +9,39 @@ except ImportError:
     from cv2 import LINE_AA
 
 from ethoscope.utils.description import DescribedObject
+from ethoscope.utils.img_proc import to_bgr, full_frame
+import numpy as np
 import os
+import threading
+import time
 
 class BaseDrawer(object):
+    # the ROI layer is drawn on this colour, so that the pixels that were drawn can be told apart
+    _layer_background = (1, 2, 3)
+    # how long (in s) another thread waits for the next frame to be copied
+    _copy_timeout = 1.0
+
     def __init__(self, video_out=None, draw_frames=True, video_out_fourcc="DIVX", video_out_fps=2):
         """
         A template class to annotate and save the processed frames. It can also save the annotated frames in a video
         file and/or display them in a new window. The :meth:`~ethoscope.drawers.drawers.BaseDrawer._annotate_frame`
         abstract method defines how frames are annotated.
 
+        Annotation is lazy: :meth:`draw` only keeps the last frame and positions,
+        and the annotated frame is rendered when it is needed (see :meth:`render`), i.e. when :attr:`last_drawn_frame` is read,
+        when frames are displayed, and when the video file is due a new frame.
+        The frame is only copied (in a preallocated buffer) when another thread asks for it.
+        The ROIs are drawn only once, in a layer that is then pasted on the frames.
+
         :param video_out: The path to the output file (.avi)
         :type video_out: str
         :param draw_frames: Whether frames should be displayed on the screen (a new window will be created).
         :type draw_frames: bool
         :param video_out_fourcc: When setting ``video_out``, this defines the codec used to save the output video (see `fourcc <http://www.fourcc.org/codecs.php>`_)
         :type video_out_fourcc: str
-        :param video_out_fps: When setting ``video_out``, this defines the output fps. typically, the same as the input fps.
+        :param video_out_fps: When setting ``video_out``, this defines the output fps.
+            Frames are written at this rate, in the time of the frames (when it is given to :meth:`draw`)
+            or in real time, regardless of the rate of tracking.
         :type video_out_fps: float
         """
         self._video_out = video_out
@@ -33,15 +50,32 @@ class BaseDrawer(object):
         self._window_name = "ethoscope_" + str(os.getpid())
         self._video_out_fourcc = video_out_fourcc
         self._video_out_fps = video_out_fps
+        self._last_video_t = None
         if draw_frames:
             cv2.namedWindow(self._window_name, cv2.WINDOW_AUTOSIZE)
         self._last_drawn_frame = None
+        # what to draw next: (frame, tracking units, positions, roi), and what was last rendered.
+        # The frame is only valid in the thread calling draw (the camera reuses its frames)
+        self._pending = None
+        self._rendered = None
+        self._draw_thread = None
+        self._last_draw_time = None
+        # other threads render a copy of the frame: (pending, (copy, tracking units, positions, roi)).
+        # They request it, and the next call to draw makes it (in a preallocated buffer)
+        self._copy = None
+        self._frame_buff = None
+        self._frame_lock = threading.Lock()
+        self._copy_requested = threading.Event()
+        self._copy_done = threading.Event()
+        self._roi_layer = None
         self.arena = None
 
-    def _annotate_frame(self,img, positions, tracking_units, roi):
+    def _annotate_frame(self,img, tracking_units, positions, roi):
         """
         Abstract method defining how frames should be annotated.
         The `img` array, which is passed by reference, is meant to be modified by this method.
+        When ``roi`` is ``True``, only the ROIs are drawn (and ``positions`` is ``None``).
+        Otherwise, only the positions are drawn.
 
         :param img: the frame that was just processed
         :type img: :class:`~numpy.ndarray`
@@ -55,39 +89,126 @@ class BaseDrawer(object):
 
     @property
     def last_drawn_frame(self):
-        return self._last_drawn_frame
+        """
+        :return: The last frame passed to :meth:`draw`, annotated (it is rendered now if needed)
+        :rtype: :class:`~numpy.ndarray`
+        """
+        return self.render()
 
-    def draw(self,img, tracking_units, positions, roi=True):
+    def _get_roi_layer(self, shape, tracking_units):
+        if self._roi_layer is None or self._roi_layer[0] is not tracking_units or self._roi_layer[1].shape != shape:
+            layer = np.empty(shape, dtype=np.uint8)
+            layer[:] = self._layer_background
+            self._annotate_frame(layer, tracking_units, None, True)
+            mask = np.any(layer != self._layer_background, axis=2).astype(np.uint8)
+            self._roi_layer = (tracking_units, layer, mask)
+        return self._roi_layer[1], self._roi_layer[2]
+
+    def _wait_for_copy(self):
+        # the frame is copied by the next call to draw, unless drawing has stopped
+        pending, copy = self._pending, self._copy
+        if pending is None or pending is self._rendered or (copy is not None and copy[0] is pending):
+            return
+        if time.time() - self._last_draw_time > self._copy_timeout:
+            return
+        self._copy_done.clear()
+        self._copy_requested.set()
+        self._copy_done.wait(self._copy_timeout)
+
+    def render(self):
         """
-        Draw results on a frame.
+        Annotate the last frame passed to :meth:`draw`, unless it was already done.
+        This may be called from another thread than :meth:`draw`, in which case it waits for the next call to :meth:`draw`
+        to copy its frame (or renders the last frame that was copied).
 
-        :param img: the frame that was just processed
+        :return: The annotated frame, or ``None`` if nothing was drawn yet
+        :rtype: :class:`~numpy.ndarray`
+        """
+        in_draw_thread = threading.get_ident() == self._draw_thread
+        if not in_draw_thread:
+            self._wait_for_copy()
+
+        with self._frame_lock:
+            pending = self._pending
+            if pending is None or pending is self._rendered:
+                return self._last_drawn_frame
+            if in_draw_thread:
+                to_render = pending
+            elif self._copy is not None:
+                pending, to_render = self._copy
+                if pending is self._rendered:
+                    return self._last_drawn_frame
+            else:
+                return self._last_drawn_frame
+            img, tracking_units, positions, roi = to_render
+            out = to_bgr(img)
+
+        if roi:
+            layer, mask = self._get_roi_layer(out.shape, tracking_units)
+            cv2.copyTo(layer, mask, out)
+        if positions is not None:
+            self._annotate_frame(out, tracking_units, positions, False)
+
+        self._last_drawn_frame = out
+        self._rendered = pending
+        return out
+
+    def _copy_pending(self):
+        img, tracking_units, positions, roi = self._pending
+        img = full_frame(img)
+        with self._frame_lock:
+            if self._frame_buff is None or self._frame_buff.shape != img.shape or self._frame_buff.dtype != img.dtype:
+                self._frame_buff = np.empty_like(img)
+            np.copyto(self._frame_buff, img)
+            self._copy = (self._pending, (self._frame_buff, tracking_units, positions, roi))
+
+    def draw(self,img, tracking_units, positions, roi=True, t=None):
+        """
+        Set the frame to draw on. It is only annotated when needed (see :meth:`render`).
+        Frames are displayed (when ``draw_frames`` is set) and saved in the output video at the ``video_out_fps`` rate.
+        Otherwise, the frame is neither copied nor annotated, unless another thread is waiting for it.
+
+        :param img: the frame that was just processed. Grey frames are converted to BGR, so they can be annotated in colour.
         :type img: :class:`~numpy.ndarray`
         :param positions: a list of positions resulting from analysis of the frame by a tracker
         :type positions: list(:class:`~ethoscope.core.data_point.DataPoint`)
         :param tracking_units: the tracking units corresponding to the positions
         :type tracking_units: list(:class:`~ethoscope.core.tracking_unit.TrackingUnit`)
+        :param roi: whether to draw the ROIs
+        :type roi: bool
+        :param t: the time stamp of the frame, in ms. The output video is written at its rate in this time (or in real time, when it is ``None``).
+        :type t: int
         :return:
         """
+        # the monitor updates positions in place, so the dictionary (not the positions) is copied
+        with self._frame_lock:
+            self._pending = (img, tracking_units, None if positions is None else dict(positions), roi)
+        self._draw_thread = threading.get_ident()
+        self._last_draw_time = time.time()
 
-        self._last_drawn_frame = img.copy()
-
-        img = self._annotate_frame(self._last_drawn_frame, tracking_units, positions, roi)
+        if self._copy_requested.is_set():
+            self._copy_requested.clear()
+            self._copy_pending()
+            self._copy_done.set()
 
         if self._draw_frames:
-            cv2.imshow(self._window_name, self._last_drawn_frame )
+            cv2.imshow(self._window_name, self.render())
             cv2.waitKey(0)
 
         if self._video_out is None:
-            return self._last_drawn_frame
+            return
+
+        now = self._last_draw_time if t is None else t / 1000.0
+        if self._last_video_t is not None and now - self._last_video_t < 1.0 / self._video_out_fps:
+            return
+        self._last_video_t = now
+        out = self.render()
 
         if self._video_writer is None:
             self._video_writer = cv2.VideoWriter(self._video_out, VideoWriter_fourcc(*self._video_out_fourcc),
-                                                 self._video_out_fps, (img.shape[1], img.shape[0]))
-
-        self._video_writer.write(self._last_drawn_frame)
+                                                 self._video_out_fps, (out.shape[1], out.shape[0]))
 
-        return img
+        self._video_writer.write(out)
 
     def __del__(self):
         if self._draw_frames:
@@ -106,12 +227,12 @@ class NullDrawer(BaseDrawer):
         :return:
         """
         super(NullDrawer,self).__init__( draw_frames=False)
-    def _annotate_frame(self,img, positions, tracking_units):
+    def _annotate_frame(self,img, tracking_units, positions=None, roi=True):
         pass
 
 
 class DefaultDrawer(BaseDrawer):
-    def __init__(self, video_out= None, draw_frames=False):
+    def __init__(self, video_out= None, draw_frames=False, video_out_fps=2):
         """
         The default drawer. It draws ellipses on the detected objects and polygons around ROIs. When an "interaction"
         see :class:`~ethoscope.stimulators.stimulators.BaseInteractor` happens within a ROI,
@@ -121,8 +242,10 @@ class DefaultDrawer(BaseDrawer):
         :type video_out: str
         :param draw_frames: Whether frames should be displayed on the screen (a new window will be created).
         :type draw_frames: bool
+        :param video_out_fps: When setting ``video_out``, the rate at which annotated frames are saved.
+        :type video_out_fps: float
         """
-        super(DefaultDrawer,self).__init__(video_out=video_out, draw_frames=draw_frames)
+        super(DefaultDrawer,self).__init__(video_out=video_out, draw_frames=draw_frames, video_out_fps=video_out_fps)
 
     def _annotate_frame(self,img, tracking_units, positions=None, roi=True):
         if img is None:
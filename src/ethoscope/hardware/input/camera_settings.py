@@ -1,5 +1,9 @@
 import logging
 logging.basicConfig(level=logging.INFO)
+import time
+
+import cv2
+import numpy as np
 
 
 def report_camera(camera):
@@ -62,3 +66,139 @@ def configure_camera(camera, mode, resolution=None, fps=None):
     #camera.exposure_mode = "off"
     return camera
 
+
+
+class ExposureController(object):
+
+    def __init__(self, band, value, bounds, settle_frames=2, max_steps=30):
+        """
+        Bring the mean intensity of frames within a band, by adjusting a camera parameter (e.g. the analog gain)
+        to which the intensity is roughly proportional.
+        Each update is proportional (the parameter is scaled by the ratio between the target and the measured mean).
+        The values known to give too dark and too bright frames bracket the next one,
+        and the bracket is bisected when a proportional update would leave it (e.g. when the sensor saturates).
+        The camera takes a few frames to apply a new value, so ``settle_frames`` frames are ignored after each change.
+
+        :param band: the lowest and highest acceptable mean intensity
+        :type band: (float, float)
+        :param value: the current value of the parameter
+        :type value: float
+        :param bounds: the lowest and highest values the parameter can take
+        :type bounds: (float, float)
+        :param settle_frames: the number of frames ignored after each change
+        :type settle_frames: int
+        :param max_steps: the number of changes after which the controller gives up
+        :type max_steps: int
+        """
+        self._low, self._high = float(band[0]), float(band[1])
+        self._target = (self._low + self._high) / 2.0
+        self._value = float(value)
+        self._bounds = (float(bounds[0]), float(bounds[1]))
+        self._bracket = list(self._bounds)
+        self._settle_frames = settle_frames
+        self._max_steps = max_steps
+        self._to_skip = 0
+        self._n_steps = 0
+        self._start = None
+        self._last_t = None
+        self._last_mean = None
+        self._done = False
+        self._converged = False
+
+    @property
+    def done(self):
+        return self._done
+
+    @property
+    def converged(self):
+        return self._converged
+
+    @property
+    def value(self):
+        return self._value
+
+    @property
+    def result(self):
+        """
+        :return: Whether the mean intensity ``converged`` within the band, the final ``value`` of the parameter,
+            the last ``mean`` intensity, the number of changes (``n_steps``), the time it took in seconds (``duration``)
+            and the time stamp of the last frame used (``t``)
+        :rtype: dict
+        """
+        return {"converged": self._converged,
+                "value": self._value,
+                "mean": self._last_mean,
+                "n_steps": self._n_steps,
+                "duration": 0 if self._start is None else self._last_t - self._start,
+                "t": self._last_t}
+
+    @staticmethod
+    def mean_intensity(img):
+        """
+        :param img: a grey image
+        :type img: :class:`~numpy.ndarray`
+        :return: the mean intensity of the image, from its histogram
+        :rtype: float
+        """
+        hist = cv2.calcHist([img], [0], None, [256], [0, 256]).ravel()
+        return float(np.dot(hist, np.arange(256)) / max(hist.sum(), 1))
+
+    def update(self, img, t=None):
+        """
+        Measure a frame, and compute the next value of the parameter.
+
+        :param img: a grey frame, acquired with the current value (it can be subsampled)
+        :type img: :class:`~numpy.ndarray`
+        :param t: the time stamp of the frame, in seconds (``time.time()`` by default)
+        :type t: float
+        :return: the new value to apply, or ``None`` if it should not change
+        :rtype: float
+        """
+        if self._done:
+            return None
+        if t is None:
+            t = time.time()
+        if self._start is None:
+            self._start = t
+        self._last_t = t
+
+        if self._to_skip > 0:
+            self._to_skip -= 1
+            return None
+
+        mean = self.mean_intensity(img)
+        self._last_mean = mean
+        if self._low <= mean <= self._high:
+            self._finish(True)
+            return None
+
+        lo, hi = self._bracket
+        if mean < self._low:
+            lo = max(lo, self._value)
+        else:
+            hi = min(hi, self._value)
+        self._bracket = [lo, hi]
+
+        new = self._value * self._target / max(mean, 1.0)
+        if not lo < new < hi:
+            new = (lo + hi) / 2.0
+        if self._n_steps >= self._max_steps or abs(new - self._value) < 1e-3 * max(self._value, 1e-3):
+            # the band cannot be reached (e.g. the parameter is at its bound)
+            self._finish(False)
+            return None
+
+        self._value = new
+        self._n_steps += 1
+        self._to_skip = self._settle_frames
+        return new
+
+    def _finish(self, converged):
+        self._done = True
+        self._converged = converged
+        result = self.result
+        if converged:
+            logging.info("Exposure converged in %.1fs (%i steps): value=%.3f, mean=%.1f" %
+                         (result["duration"], result["n_steps"], result["value"], result["mean"]))
+        else:
+            logging.warning("Exposure did not converge in %.1fs (%i steps): value=%.3f, mean=%.1f, band=%s" %
+                            (result["duration"], result["n_steps"], result["value"], result["mean"], str((self._low, self._high))))
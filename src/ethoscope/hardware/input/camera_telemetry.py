@@ -0,0 +1,137 @@
+__author__ = 'quentin'
+
+import logging
+import queue
+
+
+# the settings of the camera that are recorded, and their SQL types
+_TELEMETRY_FIELDS = (("framerate", "FLOAT"),
+                     ("exposure_mode", "CHAR(16)"),
+                     ("shutter_speed", "INT"),
+                     ("exposure_speed", "INT"),
+                     ("awb_red", "FLOAT"),
+                     ("awb_blue", "FLOAT"),
+                     ("analog_gain", "FLOAT"),
+                     ("digital_gain", "FLOAT"),
+                     ("iso", "SMALLINT"))
+
+
+def read_camera_telemetry(camera):
+    """
+    :param camera: a pi camera
+    :type camera: :class:`~picamera.PiCamera`
+    :return: the current settings of the camera that are recorded as telemetry
+    :rtype: dict
+    """
+    red, blue = camera.awb_gains
+    return {"framerate": round(float(camera.framerate), 3),
+            "exposure_mode": str(camera.exposure_mode),
+            "shutter_speed": int(camera.shutter_speed),
+            "exposure_speed": int(camera.exposure_speed),
+            "awb_red": round(float(red), 3),
+            "awb_blue": round(float(blue), 3),
+            "analog_gain": round(float(camera.analog_gain), 3),
+            "digital_gain": round(float(camera.digital_gain), 3),
+            "iso": int(camera.iso)}
+
+
+class TelemetrySampler(object):
+
+    def __init__(self, telemetry_queue, period=60, poll_period=5):
+        """
+        Samples the settings of a camera, in the frame grabber, and sends them to the camera at a low rate:
+        when they change, and at least every ``period`` seconds.
+        Reading the settings is not free, so it is only done every ``poll_period`` seconds, or when they are known to have changed
+        (see :meth:`due`).
+
+        :param telemetry_queue: the queue where samples are sent, as ``(capture_time, values)``
+        :type telemetry_queue: :class:`~multiprocessing.Queue`
+        :param period: the longest time, in seconds, between two samples
+        :type period: float
+        :param poll_period: the time, in seconds, between two readings of the settings
+        :type poll_period: float
+        """
+        self._queue = telemetry_queue
+        self._period = period
+        self._poll_period = poll_period
+        self._last_poll = None
+        self._last_sent = None
+        self._last_values = None
+
+    def due(self, t):
+        """
+        :param t: the current time, in seconds
+        :type t: float
+        :return: whether the settings should be read
+        :rtype: bool
+        """
+        return self._last_poll is None or t - self._last_poll >= self._poll_period
+
+    def update(self, values, t):
+        """
+        Send the settings if they changed, or if the last sample is too old.
+
+        :param values: the settings, as returned by :func:`read_camera_telemetry`
+        :type values: dict
+        :param t: the time they were read, in seconds
+        :type t: float
+        :return: whether a sample was sent
+        :rtype: bool
+        """
+        self._last_poll = t
+        if values == self._last_values and t - self._last_sent < self._period:
+            return False
+        try:
+            self._queue.put_nowait((t, values))
+        except queue.Full:
+            logging.warning("Camera telemetry queue is full. Dropping a sample")
+            return False
+        self._last_values = values
+        self._last_sent = t
+        return True
+
+
+class TelemetryRecorder(object):
+    _table_name = "CAMERA_TELEMETRY"
+
+    def __init__(self):
+        """
+        Saves the camera settings sampled during a run in the ``CAMERA_TELEMETRY`` table
+        (see :meth:`~ethoscope.hardware.input.cameras.FSLPiCameraAsync.pop_telemetry`), one row per sample.
+        The table is only created with the first sample, so cameras that report no settings do not add an empty table.
+        """
+        self._recording = False
+        self._table_created = False
+
+    def bind(self, result_writer=None):
+        """
+        Prepare a run.
+
+        :param result_writer: the result writer of the run, if any
+        :type result_writer: :class:`~ethoscope.utils.io.ResultWriter`
+        """
+        self._recording = result_writer is not None
+        self._table_created = False
+
+    def write(self, result_writer, samples):
+        """
+        Hand samples over to the result writer.
+
+        :param result_writer: the result writer of the run
+        :type result_writer: :class:`~ethoscope.utils.io.ResultWriter`
+        :param samples: the samples, as ``(t, values)``, with ``t`` in ms
+        :type samples: list((int, dict))
+        """
+        if not self._recording or len(samples) == 0:
+            return
+        if not self._table_created:
+            fields = ", ".join(["t INT"] + ["%s %s" % f for f in _TELEMETRY_FIELDS])
+            result_writer._create_table(self._table_name, fields)
+            self._table_created = True
+        insert_dict = result_writer._insert_dict
+        for t, values in samples:
+            tp = (int(t),) + tuple(values.get(name, 0) for name, _ in _TELEMETRY_FIELDS)
+            if self._table_name not in insert_dict or insert_dict[self._table_name] == "":
+                insert_dict[self._table_name] = "INSERT INTO %s VALUES %s" % (self._table_name, str(tp))
+            else:
+                insert_dict[self._table_name] += ("," + str(tp))
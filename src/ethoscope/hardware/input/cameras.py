@@ -7,6 +7,7 @@ import os
 import re
 import datetime
 import threading
+import math
 
 try:
     from cv2.cv import CV_CAP_PROP_FRAME_WIDTH as CAP_PROP_FRAME_WIDTH
@@ -14,17 +15,25 @@ try:
     from cv2.cv import CV_CAP_PROP_FRAME_COUNT as CAP_PROP_FRAME_COUNT
     from cv2.cv import CV_CAP_PROP_POS_MSEC as CAP_PROP_POS_MSEC
     from cv2.cv import CV_CAP_PROP_FPS as CAP_PROP_FPS
+    from cv2.cv import CV_CAP_PROP_POS_FRAMES as CAP_PROP_POS_FRAMES
 
 except ImportError:
-    from cv2 import CAP_PROP_FRAME_WIDTH, CAP_PROP_FRAME_HEIGHT, CAP_PROP_FRAME_COUNT, CAP_PROP_POS_MSEC, CAP_PROP_FPS
+    from cv2 import CAP_PROP_FRAME_WIDTH, CAP_PROP_FRAME_HEIGHT, CAP_PROP_FRAME_COUNT, CAP_PROP_POS_MSEC, CAP_PROP_FPS, CAP_PROP_POS_FRAMES
 
 import cv2
+import numpy as np
 from ethoscope.utils.debug import EthoscopeException
 import multiprocessing
 import traceback
 import queue
+import collections
 
-from ethoscope.hardware.input.camera_settings import configure_camera
+from ethoscope.hardware.input.camera_settings import configure_camera, ExposureController
+from ethoscope.hardware.input.camera_telemetry import TelemetrySampler, read_camera_telemetry
+from ethoscope.hardware.input.ring_buffer import FrameRingBuffer, RoiFramePublisher
+from ethoscope.hardware.input.video_index import VideoIndex
+from ethoscope.core.roi import ROI
+from ethoscope.utils.img_proc import RoiPacker, PackedFrame
 
 
 def kill_all_instances():
@@ -83,6 +92,9 @@ class BaseCamera(object):
     capture = None
     _resolution = None
     _frame_idx = 0
+    #: Whether the camera can deliver single channel (grey) frames instead of BGR ones
+    _grey_capable = False
+    _grey = False
 
     def __init__(self, drop_each=1, max_duration=None, *args, **kwargs):
         """
@@ -130,12 +142,47 @@ class BaseCamera(object):
                 break
 
 
-    def set_tracker(self):
+    def set_tracker(self, rois=None):
+        """
+        Called when the ROIs are built and tracking starts.
+
+        :param rois: the ROIs that will be tracked. Cameras may then only deliver their pixels (see :class:`~ethoscope.utils.img_proc.PackedFrame`).
+            ``None`` means entire frames are needed.
+        :type rois: list(:class:`~ethoscope.core.roi.ROI`)
+        """
         pass
 
     def set_roi_builder(self):
         pass
 
+    @property
+    def grey_capable(self):
+        """
+        :return: Whether this camera can deliver single channel frames natively
+        :rtype: bool
+        """
+        return self._grey_capable
+
+    @property
+    def is_grey(self):
+        """
+        :return: Whether frames are currently delivered as single channel (grey) images
+        :rtype: bool
+        """
+        return self._grey
+
+    def set_grey(self, grey=True):
+        """
+        Deliver single channel (grey) frames rather than BGR ones. This saves colour conversions
+        when the camera acquires grey images and all the trackers can use them.
+
+        :param grey: whether frames should be grey
+        :type grey: bool
+        """
+        if grey and not self._grey_capable:
+            raise EthoscopeException("%s cannot deliver grey frames" % self.__class__.__name__)
+        self._grey = grey
+
     @property
     def resolution(self):
         """
@@ -192,14 +239,132 @@ class BaseCamera(object):
 
 
 
+class VideoPrefetcher(threading.Thread):
+    _poll_interval = 0.5 # in seconds
+
+    def __init__(self, capture, n_frames, drop_each=1, start_idx=0, convert=None, maxsize=8):
+        """
+        Decode a video file ahead of its consumer. Designed to be used within :class:`~ethoscope.hardware.input.cameras.MovieVirtualCamera`,
+        so that decoding the next frames happens whilst the current one is tracked (OpenCV releases the GIL whilst decoding).
+
+        Frames that the camera would not deliver (see ``drop_each``) are only grabbed, not decoded.
+
+        :param capture: an opened video capture. It must not be used by anything else whilst the prefetcher runs.
+        :type capture: :class:`~cv2.VideoCapture`
+        :param n_frames: the number of frames in the video, or ``0`` if it is unknown
+        :type n_frames: int
+        :param drop_each: keep only ``1/drop_each``'th frame
+        :type drop_each: int
+        :param start_idx: the number of frames already read from the capture
+        :type start_idx: int
+        :param convert: a function applied to each kept frame, in the decoding thread (e.g. a colour conversion).
+            Frames are converted when they are decoded, so the consumer must convert again the frames decoded before a change
+            of format (e.g. :meth:`~ethoscope.hardware.input.cameras.BaseCamera.set_grey`).
+        :param maxsize: the number of decoded frames that can wait for the consumer
+        :type maxsize: int
+        """
+        self._capture = capture
+        self._n_frames = n_frames
+        self._drop_each = drop_each
+        self._frame_idx = start_idx
+        self._convert = convert
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._stop_event = threading.Event()
+
+        self._n_decoded = 0
+        self._n_grabbed = 0
+        self._decoding_time = 0.0
+        self._waiting_time = 0.0
+        self._start_time = None
+        super(VideoPrefetcher, self).__init__(name="ethoscope_video_prefetcher")
+        self.daemon = True
+
+    @property
+    def stats(self):
+        """
+        :return: ``decoded`` (frames decoded), ``grabbed`` (frames skipped without decoding),
+            ``decoding_fps`` (frames read per second of decoding), ``waiting`` (the seconds the consumer waited for frames,
+            i.e. when decoding is the bottleneck) and ``pending`` (frames decoded ahead)
+        :rtype: dict
+        """
+        busy = self._decoding_time
+        n = self._n_decoded + self._n_grabbed
+        return {"decoded": self._n_decoded,
+                "grabbed": self._n_grabbed,
+                "decoding_fps": round(n / busy, 2) if busy > 0 else None,
+                "waiting": round(self._waiting_time, 3),
+                "pending": self._queue.qsize()}
+
+    def run(self):
+        try:
+            while not self._stop_event.is_set():
+                if self._n_frames > 0 and self._frame_idx >= self._n_frames:
+                    break
+                # as in MovieVirtualCamera, the time stamp is read before the frame
+                t = self._capture.get(CAP_PROP_POS_MSEC) / 1e3
+                keep = (self._frame_idx + 1) % self._drop_each == 0
+                start = time.perf_counter()
+                if keep:
+                    ok, frame = self._capture.read()
+                else:
+                    ok, frame = self._capture.grab(), None
+                self._decoding_time += time.perf_counter() - start
+                if not ok:
+                    break
+                self._frame_idx += 1
+
+                if not keep:
+                    self._n_grabbed += 1
+                    continue
+                if self._convert is not None:
+                    frame = self._convert(frame)
+                self._n_decoded += 1
+                self._put((self._frame_idx, t, frame))
+        except Exception as e:
+            logging.error("Video prefetcher failed: '%s'" % traceback.format_exc())
+        finally:
+            self._put(None)
+
+    def _put(self, item):
+        while not self._stop_event.is_set():
+            try:
+                self._queue.put(item, timeout=self._poll_interval)
+                return
+            except queue.Full:
+                pass
+
+    def get(self):
+        """
+        :return: the index of the frame (counting the frames not delivered), its time stamp (in s) and the frame,
+            or ``None`` at the end of the video
+        :rtype: (int, float, :class:`~numpy.ndarray`)
+        """
+        start = time.perf_counter()
+        item = self._queue.get()
+        self._waiting_time += time.perf_counter() - start
+        return item
+
+    def stop(self):
+        self._stop_event.set()
+        # unblock the decoding thread if it waits for room in the queue
+        try:
+            while True:
+                self._queue.get_nowait()
+        except queue.Empty:
+            pass
+        self.join()
+
+
 class MovieVirtualCamera(BaseCamera):
     _description = {"overview":  "Class to acquire frames from a video file.",
                     "arguments": [
                                     {"type": "filepath", "name": "path", "description": "The *LOCAL* path to the video file to use as virtual camera","default":""},
+                                    {"type": "number", "min": 0, "max": 64, "step": 1, "name": "prefetch",
+                                     "description": "The number of frames decoded ahead, in a background thread. 0 decodes frames when they are needed", "default": 0},
                                    ]}
 
 
-    def __init__(self, path, use_wall_clock=False, *args, **kwargs ):
+    def __init__(self, path, use_wall_clock=False, prefetch=0, start_frame=0, end_frame=None, *args, **kwargs ):
         """
         Class to acquire frames from a video file.
 
@@ -208,6 +373,13 @@ class MovieVirtualCamera(BaseCamera):
         :param use_wall_clock: whether to use the real time from the machine (True) or from the video file (False).\
             The former can be useful for prototyping.
         :type use_wall_clock: bool
+        :param prefetch: the number of frames decoded ahead by a :class:`~ethoscope.hardware.input.cameras.VideoPrefetcher`.
+            ``0`` decodes each frame when it is needed.
+        :type prefetch: int
+        :param start_frame: the index of the first frame to read (frame indices and time stamps are those of the whole video)
+        :type start_frame: int
+        :param end_frame: the index of the frame after the last frame to read, or ``None`` to read until the end of the video
+        :type end_frame: int
         :param args: additional arguments.
         :param kwargs: additional keyword arguments.
         """
@@ -217,6 +389,12 @@ class MovieVirtualCamera(BaseCamera):
         self._frame_idx = 0
         self._path = path
         self._use_wall_clock = use_wall_clock
+        self._prefetch = int(prefetch)
+        self._prefetcher = None
+        self._last_t = 0
+        self._start_frame = int(start_frame)
+        self._end_frame = end_frame
+        self._index = None
 
 
         if not (isinstance(path, str) or isinstance(path, str)):
@@ -236,6 +414,16 @@ class MovieVirtualCamera(BaseCamera):
 
         self._resolution = (int(w),int(h))
 
+        if self._start_frame > 0:
+            self.capture.set(CAP_PROP_POS_FRAMES, self._start_frame)
+            self._frame_idx = self._start_frame
+        if end_frame is not None:
+            if self._has_end_of_file:
+                self._total_n_frames = min(self._total_n_frames, end_frame)
+            else:
+                self._total_n_frames = end_frame
+                self._has_end_of_file = True
+
         super(MovieVirtualCamera, self).__init__(*args, **kwargs)
 
         # emulates v4l2 (real time camera) from video file
@@ -256,11 +444,100 @@ class MovieVirtualCamera(BaseCamera):
         return True
 
     def restart(self):
-        self.__init__(self._path, use_wall_clock=self._use_wall_clock, drop_each=self._drop_each, max_duration = self._max_duration)
+        self._stop_prefetching()
+        self.__init__(self._path, use_wall_clock=self._use_wall_clock, prefetch=self._prefetch,
+                      start_frame=self._start_frame, end_frame=self._end_frame,
+                      drop_each=self._drop_each, max_duration = self._max_duration)
+
+    @property
+    def index(self):
+        """
+        :return: The index of the video, built on first use and cached next to the file
+        :rtype: :class:`~ethoscope.hardware.input.video_index.VideoIndex`
+        """
+        if self._index is None:
+            self._index = VideoIndex.load_or_build(self._path)
+        return self._index
+
+    def seek_frame(self, frame_idx):
+        """
+        Move the camera so that the next frame read is ``frame_idx``.
+        Frames are decoded forward when no keyframe lies between the current position and the target.
+        Otherwise, the video is moved to the last keyframe before the target, and decoded forward from there.
+
+        :param frame_idx: the index of the next frame to read
+        :type frame_idx: int
+        :return: the index of the next frame to read (the target, unless it is after the end of the video)
+        :rtype: int
+        """
+        index = self.index
+        frame_idx = max(0, min(int(frame_idx), index.n_frames))
+        keyframe = index.keyframe_before(frame_idx)
+        # the prefetcher reads ahead, so the position of the video is unknown
+        position_known = self._prefetcher is None
+        self._stop_prefetching()
+
+        if not position_known or not keyframe <= self._frame_idx <= frame_idx:
+            self.capture.set(CAP_PROP_POS_FRAMES, keyframe)
+            self._frame_idx = keyframe
+
+        while self._frame_idx < frame_idx:
+            if not self.capture.grab():
+                break
+            self._frame_idx += 1
+        return self._frame_idx
+
+    def seek_time(self, t):
+        """
+        Move the camera to the first frame with a time stamp at or after ``t``.
+
+        :param t: the time, in ms, as given when iterating through the camera
+        :type t: float
+        :return: the index of the next frame to read
+        :rtype: int
+        """
+        return self.seek_frame(self.index.frame_at_camera_time(t))
+
+    @property
+    def decoder_stats(self):
+        """
+        :return: The decoding throughput, when frames are prefetched (see :attr:`~ethoscope.hardware.input.cameras.VideoPrefetcher.stats`),
+            otherwise ``None``
+        :rtype: dict
+        """
+        if self._prefetcher is None:
+            return None
+        return self._prefetcher.stats
+
+    def _convert(self, frame):
+        return frame
+
+    def _next_time_image(self):
+        if self._prefetch <= 0:
+            return super(MovieVirtualCamera, self)._next_time_image()
+
+        if self._prefetcher is None:
+            self._prefetcher = VideoPrefetcher(self.capture, int(self._total_n_frames), self._drop_each,
+                                               self._frame_idx, self._convert, self._prefetch)
+            self._prefetcher.start()
+
+        item = self._prefetcher.get()
+        if item is None:
+            return self._last_t, None
+        # frames that are not delivered are skipped by the prefetcher, hence the jump in index
+        self._frame_idx, t, frame = item
+        # frames decoded ahead may predate a change of format. Converting them again costs nothing otherwise
+        frame = self._convert(frame)
+        if self._use_wall_clock:
+            t = self._time_stamp()
+        self._last_t = t
+        return t, frame
 
     def _next_image(self):
         _, frame = self.capture.read()
-        return frame
+        if frame is None:
+            return None
+        return self._convert(frame)
 
     def _time_stamp(self):
         if self._use_wall_clock:
@@ -274,7 +551,14 @@ class MovieVirtualCamera(BaseCamera):
             return True
         return False
 
+    def _stop_prefetching(self):
+        if self._prefetcher is not None:
+            logging.info("Video decoding: %s" % str(self._prefetcher.stats))
+            self._prefetcher.stop()
+            self._prefetcher = None
+
     def _close(self):
+        self._stop_prefetching()
         self.capture.release()
 
 
@@ -290,6 +574,7 @@ class FSLVirtualCamera(MovieVirtualCamera):
     """
 
     _ref_time = datetime.datetime.fromtimestamp(0, datetime.timezone.utc)
+    _grey_capable = True
 
     def __init__(self, *args, bw=False, **kwargs):
 
@@ -302,12 +587,18 @@ class FSLVirtualCamera(MovieVirtualCamera):
         self._start_time = self._parse_start_time()
         self._bw = bw
 
+    def _convert(self, frame):
+        # frames may already be converted (see MovieVirtualCamera._next_time_image), possibly before a call to set_grey
+        if self._bw or self._grey:
+            if frame.ndim == 3:
+                return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        elif frame.ndim == 2:
+            return cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+        return frame
+
     def _next_time_image(self):
         time, im = super()._next_time_image()
         frame_idx = self._frame_idx
-        if self._bw:
-            im = cv2.cvtColor(im, cv2.COLOR_BGR2GRAY)
-
         return frame_idx, (time, im)
 
     def _parse_start_time(self):
@@ -360,15 +651,178 @@ class FSLVirtualCamera(MovieVirtualCamera):
 
 
 
+class VideoSegmentCamera(BaseCamera):
+
+    def __init__(self, parts, prefetch=0, *args, **kwargs):
+        """
+        Class to acquire frames from consecutive parts of one or several video files. For instance, a time segment of
+        a long recording, preceded by the frames used to warm up the trackers (see :mod:`~ethoscope.core.segmented_tracking`).
+        Frame indices and time stamps are those of the whole recording, so that segments can be tracked separately.
+
+        :param parts: the parts to read, in order, as ``(path, start_frame, end_frame, frame_offset, t_offset)``,
+            where the offsets are the index of the first frame of the file in the recording, and its time stamp (in ms)
+        :type parts: list(tuple)
+        :param prefetch: the number of frames decoded ahead (see :class:`~ethoscope.hardware.input.cameras.MovieVirtualCamera`)
+        :type prefetch: int
+        :param args: additional arguments.
+        :param kwargs: additional keyword arguments.
+        """
+        if len(parts) == 0:
+            raise EthoscopeException("A video segment needs at least one part")
+        self._parts = [tuple(p) for p in parts]
+        self._prefetch = prefetch
+        self._current = None
+        self._part_idx = 0
+        self.canbepickled = False
+        super(VideoSegmentCamera, self).__init__(*args, **kwargs)
+
+        self._current = self._open(0)
+        self._resolution = self._current.resolution
+        self._start_time = 0
+
+    def _open(self, i):
+        path, start_frame, end_frame, frame_offset, _ = self._parts[i]
+        # when possible, the dropped frames are skipped (and not decoded) by the camera of the part
+        drop_each = self._drop_each if frame_offset % self._drop_each == 0 else 1
+        return MovieVirtualCamera(path, prefetch=self._prefetch, start_frame=start_frame, end_frame=end_frame, drop_each=drop_each)
+
+    @property
+    def start_time(self):
+        return self._start_time
+
+    @property
+    def decoder_stats(self):
+        if self._current is None:
+            return None
+        return self._current.decoder_stats
+
+    def is_opened(self):
+        return True
+
+    def is_last_frame(self):
+        return False
+
+    def restart(self):
+        self._close()
+        self._frame_idx = 0
+        self._part_idx = 0
+        self._current = self._open(0)
+
+    def __iter__(self):
+        # like other cameras, a new iteration resumes after the last frame read
+        at_least_one_frame = False
+        while self._part_idx < len(self._parts):
+            if self._current is None:
+                self._current = self._open(self._part_idx)
+            _, _, _, frame_offset, t_offset = self._parts[self._part_idx]
+            for idx, (t_ms, out) in self._current:
+                at_least_one_frame = True
+                self._frame_idx = frame_offset + idx
+                t_ms += int(t_offset)
+                if (self._frame_idx % self._drop_each) == 0:
+                    yield self._frame_idx, (t_ms, out)
+                if self._max_duration is not None and t_ms > 1000 * self._max_duration:
+                    return
+            self._close()
+            self._part_idx += 1
+
+        if not at_least_one_frame:
+            raise EthoscopeException("Camera could not read the first frame")
+
+    def _close(self):
+        if self._current is not None:
+            self._current._close()
+            self._current = None
+
+
+class V4L2FrameGrabber(threading.Thread):
+
+    def __init__(self, capture, frame_buffer, target_fps, max_failures=50):
+        """
+        Class to grab frames from a V4L2 device in a background thread. Designed to be used within :class:`~ethoscope.hardware.input.cameras.V4L2Camera`.
+        Frames are grabbed at the rate of the device, and kept at ``target_fps``.
+        Each kept frame is decoded directly into a slot of the ring buffer, with its capture time stamp.
+
+        :param capture: an opened video capture
+        :type capture: :class:`~cv2.VideoCapture`
+        :param frame_buffer: a ring buffer of BGR frames, with the resolution of the device
+        :type frame_buffer: :class:`~ethoscope.hardware.input.ring_buffer.FrameRingBuffer`
+        :param target_fps: the desired number of frames per second
+        :type target_fps: float
+        :param max_failures: the number of consecutive failed grabs after which acquisition stops
+        :type max_failures: int
+        """
+        self._capture = capture
+        self._frame_buffer = frame_buffer
+        self._period = 1.0 / target_fps
+        self._max_failures = max_failures
+        self._stop_event = threading.Event()
+        self._n_grabbed = 0
+        self._n_kept = 0
+        super(V4L2FrameGrabber, self).__init__()
+        self.daemon = True
+
+    @property
+    def stats(self):
+        """
+        :return: The number of frames ``grabbed`` from the device and the number ``kept`` at the target rate
+        :rtype: dict
+        """
+        return {"grabbed": self._n_grabbed, "kept": self._n_kept}
+
+    def run(self):
+        failures = 0
+        next_time = 0
+        try:
+            while not self._stop_event.is_set():
+                if not self._capture.grab():
+                    failures += 1
+                    if failures >= self._max_failures:
+                        logging.error("Could not grab frames from the camera. Stopping acquisition")
+                        break
+                    continue
+                failures = 0
+                capture_time = time.time()
+                self._n_grabbed += 1
+
+                # frames in excess of the target fps are dropped
+                if capture_time < next_time:
+                    continue
+                # the schedule is kept, unless grabbing fell behind by more than a frame
+                next_time = max(next_time + self._period, capture_time)
+
+                claimed = self._frame_buffer.claim()
+                if claimed is None:
+                    continue
+                idx, slot = claimed
+                _, out = self._capture.retrieve(slot)
+                if out is not None and out is not slot:
+                    np.copyto(slot, out)
+                self._frame_buffer.publish(idx, capture_time)
+                self._n_kept += 1
+        finally:
+            logging.info("V4L2 frame grabber stopped: %s" % str(self.stats))
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
 class V4L2Camera(BaseCamera):
     _description = {"overview": "Class to acquire frames from the V4L2 default interface (e.g. a webcam).",
                     "arguments": [
                     {"type": "number", "min": 0, "max": 4, "step": 1, "name": "device", "description": "The device to be open", "default":0},
+                    {"type": "number", "min": 2, "max": 64, "step": 1, "name": "n_buffer_slots",
+                     "description": "The number of frames buffered between the grabbing thread and the tracking", "default": 4},
+                    {"type": "number", "min": 0, "max": 1, "step": 1, "name": "latest",
+                     "description": "1 to read the most recent frame, skipping older unread ones (lowest latency). 0 to read every frame, in order", "default": 0},
                     ]}
 
-    def __init__(self, device=0, target_fps=5, target_resolution=(960,720), *args, **kwargs):
+    def __init__(self, device=0, target_fps=5, target_resolution=(960,720), n_buffer_slots=4, latest=False, *args, **kwargs):
         """
         class to acquire stream from a video for linux compatible device (v4l2).
+        Frames are grabbed in a background thread (see :class:`~ethoscope.hardware.input.cameras.V4L2FrameGrabber`),
+        so the latency of the device does not stall the processing of frames.
 
         :param device: The index of the device, or its path.
         :type device: int or str
@@ -376,11 +830,18 @@ class V4L2Camera(BaseCamera):
         :type target_fps: int
         :param target_fps: the desired resolution (W x H)
         :param target_resolution: (int,int)
+        :param n_buffer_slots: the number of frames buffered between the grabbing thread and the camera.
+            When they are all unread, the oldest one is overwritten (see :attr:`frame_buffer_stats`).
+        :type n_buffer_slots: int
+        :param latest: whether to read the most recent frame, skipping older unread ones (lowest latency),
+            rather than every frame, in order
+        :type latest: bool
         :param args: additional arguments
         :param kwargs: additional keyword arguments
         """
 
         self.canbepickled = False
+        self._latest = bool(latest)
         self.capture = cv2.VideoCapture(device)
         self._warm_up()
 
@@ -420,6 +881,9 @@ class V4L2Camera(BaseCamera):
 
         super(V4L2Camera, self).__init__(*args, **kwargs)
         self._start_time = time.time()
+        self._frame_buffer = FrameRingBuffer(im.shape, n_slots=n_buffer_slots)
+        self._grabber = V4L2FrameGrabber(self.capture, self._frame_buffer, self._target_fps)
+        self._grabber.start()
 
     def _warm_up(self):
         logging.info("%s is warming up" % (str(self)))
@@ -443,27 +907,53 @@ class V4L2Camera(BaseCamera):
     def start_time(self):
         return self._start_time
 
+    @property
+    def frame_buffer_stats(self):
+        """
+        :return: The counters of the ring buffer between the frame grabber and the camera (see :attr:`~ethoscope.hardware.input.ring_buffer.FrameRingBuffer.stats`),
+            and those of the grabber (see :attr:`~ethoscope.hardware.input.cameras.V4L2FrameGrabber.stats`).
+            ``overwritten`` frames are frames that were acquired but never read, as the processing fell behind.
+        :rtype: dict
+        """
+        stats = self._frame_buffer.stats
+        stats.update(self._grabber.stats)
+        return stats
+
     def _close(self):
+        self._grabber.stop()
+        logging.info("Frame buffer: %s" % str(self.frame_buffer_stats))
         self.capture.release()
-    def _next_image(self):
-        if self._frame_idx >0 :
-            expected_time =  self._start_time + self._frame_idx / self._target_fps
-            now = time.time()
-            to_sleep = expected_time - now
-            # Warnings if the fps is so high that we cannot grab fast enough
-            if to_sleep < 0:
-                if self._frame_idx % 5000 == 0:
-                    logging.warning("The target FPS (%f) could not be reached. Effective FPS is about %f" % (self._target_fps, self._frame_idx/(now - self._start_time)))
-                self.capture.grab()
-
-            # we simply drop frames until we go above expected time
-            while now < expected_time:
-                self.capture.grab()
-                now = time.time()
-        else:
-            self.capture.grab()
-        self.capture.retrieve(self._frame)
-        return self._frame
+        self._frame_buffer.close()
+
+    def _next_time_image(self):
+        waited = 0
+        while True:
+            try:
+                _, capture_time, frame = self._frame_buffer.get(timeout=1, latest=self._latest)
+                break
+            except queue.Empty:
+                if not self._grabber.is_alive():
+                    return self._time_stamp(), None
+                waited += 1
+                if waited >= 30:
+                    raise EthoscopeException("Could not get frame from camera after %i seconds" % waited)
+
+        self._frame_idx += 1
+        # frame is a read-only view on the ring buffer. It remains valid until the next frame is requested
+        # time stamps are relative to the start and come from the time of acquisition, not of reading
+        return capture_time - self._start_time, frame
+
+
+def _receive_roi_layout(layout_queue, timeout=1):
+    """
+    :return: The bounding rectangles of the ROIs sent by a camera to its frame grabber when tracking starts,
+        or ``None`` if none were sent (the camera needs entire frames)
+    :rtype: list(tuple)
+    """
+    try:
+        return layout_queue.get(timeout=timeout)
+    except queue.Empty:
+        return None
 
 
 class PiFrameGrabber(threading.Thread):
@@ -570,8 +1060,12 @@ class PiFrameGrabber(threading.Thread):
             logging.warning("Camera Frame grabber stopped acquisition cleanly")
 
 class DualPiFrameGrabber(PiFrameGrabber):
+    # the camera parameter adjusted to reach the target intensity in each mode, and its bounds
+    _exposure_parameters = {"target_detection": ("analog_gain", (1.0, 16.0)),
+                            "roi_builder": ("awb_gains", (0.1, 8.0)),
+                            "tracker": ("analog_gain", (1.0, 16.0))}
 
-    def __init__(self, exposure_queue, *args, **kwargs):
+    def __init__(self, exposure_queue, *args, telemetry_period=60, **kwargs):
         """
         Class to grab frames from pi camera. Designed to be used within :class:`~ethoscope.hardware.camreras.camreras.OurPiCameraAsync`
         This allows to get frames asynchronously as acquisition is a bottleneck.
@@ -584,10 +1078,13 @@ class DualPiFrameGrabber(PiFrameGrabber):
         :type target_fps: int
         :param target_resolution: the desired resolution (w, h)
         :type target_resolution: (int, int)
-        :param queue: a queue that stores frame and makes them available to the parent process
-        :type queue: :class:`~multiprocessing.JoinableQueue`
+        :param queue: a ring buffer where frames are written and made available to the camera
+        :type queue: :class:`~ethoscope.hardware.input.ring_buffer.FrameRingBuffer`
         :param stop_queue: a queue that can stop the async acquisition
         :type stop_queue: :class:`~multiprocessing.JoinableQueue`
+        :param telemetry_period: the longest time, in seconds, between two samples of the camera settings
+            (see :class:`~ethoscope.hardware.input.camera_telemetry.TelemetrySampler`)
+        :type telemetry_period: float
         :param args: additional arguments
         :param kwargs: additional keyword arguments
         """
@@ -595,6 +1092,15 @@ class DualPiFrameGrabber(PiFrameGrabber):
         self._exposure_queue = exposure_queue
         self._tracker_event = multiprocessing.Event()
         self._roi_builder_event = multiprocessing.Event()
+        # the bounding rectangles of the ROIs, sent by the camera when tracking starts
+        self._layout_queue = multiprocessing.Queue(maxsize=1)
+        self._layout = None
+        # requests to bring the frame intensity within a band, and the outcome of each (see :class:`~ethoscope.hardware.input.camera_settings.ExposureController`)
+        self._convergence_queue = multiprocessing.Queue(maxsize=1)
+        self._convergence_result_queue = multiprocessing.Queue(maxsize=1)
+        # the settings of the camera, sampled when they change and every telemetry_period seconds
+        self._telemetry_queue = multiprocessing.Queue(maxsize=100)
+        self._telemetry_period = telemetry_period
         super().__init__(*args, **kwargs)
 
     @staticmethod
@@ -622,6 +1128,48 @@ class DualPiFrameGrabber(PiFrameGrabber):
         camera = cp.update_cam(camera)
         return camera
 
+    @staticmethod
+    def get_parameter(camera, name):
+        """
+        :return: the value of a camera parameter, or of its first element if it has several (e.g. the red gain of ``awb_gains``)
+        :rtype: float
+        """
+        val = getattr(camera, name)
+        if isinstance(val, (tuple, list)):
+            val = val[0]
+        return float(val)
+
+    @staticmethod
+    def set_parameter(camera, name, value):
+        """
+        Set a camera parameter. When it has several elements (e.g. ``awb_gains``), ``value`` replaces the first one
+        and the others are scaled by the same factor, so their ratios are kept.
+        """
+        # Lazy load dependencies
+        from picamera_attributes import variables
+
+        original_val = getattr(camera, name)
+        CameraParameter = variables.ParameterSet._supported[name]
+        if issubclass(CameraParameter, variables.Plural):
+            factor = value / float(original_val[0])
+            val = [float(e) * factor for e in original_val]
+        else:
+            val = value
+
+        cp = CameraParameter(val)
+        cp.validate()
+        return cp.update_cam(camera)
+
+    def _receive_exposure_request(self, camera, mode):
+        try:
+            mode_requested, band = self._convergence_queue.get(block=False)
+        except queue.Empty:
+            return None
+        if mode_requested != mode:
+            logging.warning("Exposure requested for %s while the camera is in %s mode" % (mode_requested, mode))
+        name, bounds = self._exposure_parameters[mode_requested]
+        return name, ExposureController(band, self.get_parameter(camera, name), bounds)
+
 
     def run(self):
         """
@@ -658,17 +1206,24 @@ class DualPiFrameGrabber(PiFrameGrabber):
                     time.sleep(5)
                     roi_builder_event = False
                     tracker_event = False
+                    mode = "target_detection"
+                    exposure_parameter, exposure_controller = None, None
     
                     raw_capture = PiRGBArray(capture, size=self._target_resolution)
+                    publisher = RoiFramePublisher(self._queue)
+                    telemetry = TelemetrySampler(self._telemetry_queue, period=self._telemetry_period)
                     max_trials = 5
 
                     try:
 
                         for frame in capture.capture_continuous(raw_capture, format="bgr", use_video_port=True):
-    
+                            capture_time = time.time()
+                            settings_changed = False
+
                             try:
                                 gain, sign = self._exposure_queue.get(block=False)
                                 capture = self.adjust_camera(capture, gain, sign)
+                                settings_changed = True
                                 logging.info('Success adjusting analog gain')
     
                             except queue.Empty:
@@ -677,13 +1232,35 @@ class DualPiFrameGrabber(PiFrameGrabber):
                             if self._roi_builder_event.is_set() and not roi_builder_event and recursion == 0:
                                 capture = configure_camera(capture, mode="roi_builder")
                                 roi_builder_event = True
+                                mode = "roi_builder"
+                                settings_changed = True
                                 logging.info('Success switching to roi_builder mode')
  
                             if self._tracker_event.is_set() and not tracker_event:
                                 capture = configure_camera(capture, mode="tracker")
                                 tracker_event = True
+                                mode = "tracker"
+                                settings_changed = True
                                 logging.info('Success switching to tracker mode')
-    
+                                if self._layout is None:
+                                    self._layout = _receive_roi_layout(self._layout_queue)
+                                publisher.set_layout(self._layout)
+
+                            # the exposure is controlled after switching modes, from the settings of the current one
+                            if exposure_controller is None:
+                                request = self._receive_exposure_request(capture, mode)
+                                if request is not None:
+                                    exposure_parameter, exposure_controller = request
+                            if exposure_controller is not None:
+                                grey = cv2.cvtColor(frame.array[::4, ::4], cv2.COLOR_BGR2GRAY)
+                                value = exposure_controller.update(grey, capture_time)
+                                if value is not None:
+                                    capture = self.set_parameter(capture, exposure_parameter, value)
+                                    settings_changed = True
+                                if exposure_controller.done:
+                                    self._convergence_result_queue.put(exposure_controller.result)
+                                    exposure_controller = None
+
                             if not self._stop_queue.empty():
                                 logging.info(f"PID {os.getpid()}: The stop queue is not empty. Stop acquiring frames")
     
@@ -692,27 +1269,17 @@ class DualPiFrameGrabber(PiFrameGrabber):
                                 logging.warning("Stop Task Done")
                                 break
     
-                            logging.info(f'camera framerate: {capture.framerate}')
-                            logging.info(f'camera resolution: {capture.resolution}')
-                            logging.info(f'camera exposure_mode: {capture.exposure_mode}')
-                            logging.info(f'camera shutter_speed: {capture.shutter_speed}')
-                            logging.info(f'camera exposure_speed: {capture.exposure_speed}')
-                            logging.info(f'camera awb_gains: {capture.awb_gains}')
-                            logging.info(f'camera analog_gain: {float(capture.analog_gain)}')
-                            logging.info(f'camera digital_gain: {float(capture.digital_gain)}')
-                            logging.info(f'camera iso: {float(capture.iso)}')
- 
+                            # the settings are sampled at a low rate rather than logged for every frame
+                            if settings_changed or telemetry.due(capture_time):
+                                telemetry.update(read_camera_telemetry(capture), capture_time)
+
                             # raw_capture.truncate()
                             # raw_capture.seek(0)
                             raw_capture.truncate(0)
-                            logging.info('Success taking capture')
    
     
-                            # out = np.copy(frame.array)
-                            out = cv2.cvtColor(frame.array,cv2.COLOR_BGR2GRAY)
-                            #fixme here we could actually pass a JPG compressed file object (http://docs.scipy.org/doc/scipy-0.16.0/reference/generated/scipy.misc.imsave.html)
-                            # This way, we would manage to get faster FPS
-                            self._queue.put(out)
+                            # frames are converted straight into a slot of the ring buffer. No copy is needed to share them
+                            publisher.publish(frame.array, capture_time, cv2.COLOR_BGR2GRAY)
                             trials = 0
 
                     except (PiCameraValueError, PiCameraRuntimeError) as error:
@@ -737,8 +1304,8 @@ class DualPiFrameGrabber(PiFrameGrabber):
 
         finally:
             logging.warning(f"PID {os.getpid()}: Closing frame grabber process")
+            # the ring buffer belongs to the camera, which releases it
             self._stop_queue.close()
-            self._queue.close()
             logging.warning(f"PID {os.getpid()}: Camera Frame grabber stopped acquisition cleanly")
 
 
@@ -748,6 +1315,8 @@ class OurPiCameraAsync(BaseCamera):
 
 
     _frame_grabber_class = PiFrameGrabber
+    _grey_capable = True
+
     def __init__(self, target_fps=20, target_resolution=(1280, 960), *args, **kwargs):
         """
         Class to acquire frames from the raspberry pi camera asynchronously.
@@ -850,17 +1419,19 @@ class OurPiCameraAsync(BaseCamera):
         trial = 1
         try:
             g = self._queue.get(timeout=30)
-            cv2.cvtColor(g,cv2.COLOR_GRAY2BGR,self._frame)
-            return self._frame
         except OSError as error:
             trial += 1
             g = self._queue.get(timeout=30)
-            cv2.cvtColor(g, cv2.COLOR_GRAY2BGR, self._frame)
-            return self._frame
 
         except Exception as e:
             raise EthoscopeException("Could not get frame from camera\n%s", traceback.format_exc())
 
+        # grabbers acquire grey frames, so they are only converted to BGR when needed
+        if self._grey:
+            return g
+        cv2.cvtColor(g, cv2.COLOR_GRAY2BGR, self._frame)
+        return self._frame
+
 
 class FSLPiCameraAsync(OurPiCameraAsync):
     _description = {"overview": "Default class to acquire frames from the raspberry pi camera asynchronously.",
@@ -868,7 +1439,10 @@ class FSLPiCameraAsync(OurPiCameraAsync):
 
 
     _frame_grabber_class = DualPiFrameGrabber
-    def __init__(self, target_fps=2, target_resolution=(1280, 960), *args, **kwargs):
+    # the number of frames in the ring buffer between the grabber and the camera
+    _n_buffer_slots = 4
+
+    def __init__(self, target_fps=2, target_resolution=(1280, 960), *args, roi_crop=True, telemetry_period=60, **kwargs):
         """
         Class to acquire frames from the raspberry pi camera asynchronously.
         At the moment, frames are only greyscale images.
@@ -877,6 +1451,10 @@ class FSLPiCameraAsync(OurPiCameraAsync):
         :type target_fps: int
         :param target_resolution: the desired resolution (W x H)
         :param target_resolution: (int,int)
+        :param roi_crop: whether, once tracking starts, the grabber only transfers the pixels of the ROIs (see :meth:`set_tracker`)
+        :type roi_crop: bool
+        :param telemetry_period: the longest time, in seconds, between two samples of the camera settings (see :meth:`pop_telemetry`)
+        :type telemetry_period: float
         :param args: additional arguments
         :param kwargs: additional keyword arguments
         """
@@ -886,45 +1464,37 @@ class FSLPiCameraAsync(OurPiCameraAsync):
         if not isinstance(target_fps, int):
             raise EthoscopeException("FPS must be an integer number")
         self._args = args
-        self._kwargs = kwargs
-        self._queue = multiprocessing.Queue(maxsize=1)
-        self._exposure_queue = multiprocessing.Queue(maxsize=2)
-
-        self._stop_queue = multiprocessing.JoinableQueue(maxsize=1)
-        self._p = self._frame_grabber_class(self._exposure_queue, target_fps, target_resolution, self._queue, self._stop_queue, *args, **kwargs)
-        self._p.daemon = True
-        self._p.start()
+        self._kwargs = dict(kwargs, roi_crop=roi_crop, telemetry_period=telemetry_period)
+        self._roi_crop = roi_crop
+        self._packer = None
+        self._frame_buffer = None
+        self._telemetry_lock = threading.Lock()
+        self._telemetry_samples = collections.deque(maxlen=1000)
+        self._last_telemetry = None
+        self._start_frame_grabber(target_fps, target_resolution, *args, telemetry_period=telemetry_period, **kwargs)
 
         try:
             try:
-                im = self._queue.get(timeout=30)
+                _, t, im = self._frame_buffer.get(timeout=30)
 
             # to deal with broken camera thread. Just recreate it
             except (OSError, queue.Empty) as error:
                 logging.warning("30 seconds timeout detected")
                 logging.warning("Regenerating camera thread")
-                self._queue = multiprocessing.Queue(maxsize=1)
-                self._exposure_queue = multiprocessing.Queue(maxsize=2)
-                self._stop_queue = multiprocessing.JoinableQueue(maxsize=1)
- 
-                self._p = self._frame_grabber_class(self._exposure_queue, target_fps, target_resolution, self._queue, self._stop_queue, *args, **kwargs)
-                self._p.daemon = True
-                self._p.start()
-                im = self._queue.get(timeout=30)
+                self._frame_buffer.close()
+                self._start_frame_grabber(target_fps, target_resolution, *args, telemetry_period=telemetry_period, **kwargs)
+                _, t, im = self._frame_buffer.get(timeout=30)
 
-               
         except Exception as error:
             logging.error("Could not get any frame from the camera")
             self._stop_queue.cancel_join_thread()
-            self._queue.cancel_join_thread()
             logging.warning("Stopping stop queue")
             self._stop_queue.close()
-            logging.warning("Stopping queue")
-            self._queue.close()
             logging.warning("Joining process")
             # we kill the frame grabber if it does not reply within 10s
             self._p.join(10)
             logging.warning("Process joined")
+            self._frame_buffer.close()
             raise error
 
         self._frame = cv2.cvtColor(im,cv2.COLOR_GRAY2BGR)
@@ -940,10 +1510,146 @@ class FSLPiCameraAsync(OurPiCameraAsync):
         self._start_time = time.time()
         logging.info("Camera initialised")
 
+    def _start_frame_grabber(self, target_fps, target_resolution, *args, **kwargs):
+        """
+        Allocate the ring buffer shared with the frame grabber, and start the grabber.
+        Frames are greyscale images of the target resolution.
+        """
+        w, h = target_resolution
+        self._frame_buffer = FrameRingBuffer((h, w), n_slots=self._n_buffer_slots)
+        self._exposure_queue = multiprocessing.Queue(maxsize=2)
+        self._stop_queue = multiprocessing.JoinableQueue(maxsize=1)
+        self._p = self._frame_grabber_class(self._exposure_queue, target_fps, target_resolution, self._frame_buffer, self._stop_queue, *args, **kwargs)
+        self._p.daemon = True
+        self._p.start()
+
+    @property
+    def frame_buffer_stats(self):
+        """
+        :return: The counters of the ring buffer between the frame grabber and the camera.
+            In particular, ``overwritten`` frames are frames that were acquired but never tracked, as the tracking fell behind.
+        :rtype: dict
+        """
+        return self._frame_buffer.stats
+
+    def _receive_telemetry(self):
+        with self._telemetry_lock:
+            while True:
+                try:
+                    capture_time, values = self._p._telemetry_queue.get(block=False)
+                except queue.Empty:
+                    break
+                # time stamps are in ms, relative to the start, as the ones of frames
+                sample = (int(round((capture_time - self._start_time) * 1000)), values)
+                self._telemetry_samples.append(sample)
+                self._last_telemetry = sample
+
+    def pop_telemetry(self):
+        """
+        :return: The settings of the camera (gains, shutter speed, ...) sampled by the frame grabber since the last call,
+            oldest first, as ``(t, values)``. They are sampled when they change, and at least every ``telemetry_period`` seconds.
+        :rtype: list((int, dict))
+        """
+        self._receive_telemetry()
+        with self._telemetry_lock:
+            out = list(self._telemetry_samples)
+            self._telemetry_samples.clear()
+        return out
+
+    @property
+    def telemetry(self):
+        """
+        :return: The last sampled settings of the camera, and the time stamp of the sample (``t``, in ms), or ``None`` if none was sampled yet
+        :rtype: dict
+        """
+        self._receive_telemetry()
+        if self._last_telemetry is None:
+            return None
+        t, values = self._last_telemetry
+        return dict(values, t=t)
+
+    def _next_time_image(self):
+        try:
+            _, capture_time, g = self._frame_buffer.get(timeout=30)
+        except Exception as e:
+            raise EthoscopeException("Could not get frame from camera\n%s", traceback.format_exc())
+
+        self._frame_idx += 1
+        # time stamps are relative to the start and come from the time of acquisition, not of reading
+        t = capture_time - self._start_time
+
+        if self._packer is not None:
+            if self._frame_buffer.last_tag == RoiFramePublisher.packed_tag:
+                # only the ROIs were transferred, at the start of the slot
+                packed = g.reshape(-1)[:self._packer.size]
+                if self._grey:
+                    return t, PackedFrame(packed, self._packer, self._grey_background)
+                cv2.cvtColor(packed.reshape(-1, 1), cv2.COLOR_GRAY2BGR, self._packed_bgr)
+                return t, PackedFrame(self._packed_bgr.reshape(-1, 3), self._packer, self._frame)
+            if self._grey:
+                np.copyto(self._grey_background, g)
+
+        # g is a read-only view on the ring buffer. It remains valid until the next frame is requested
+        if self._grey:
+            return t, g
+        cv2.cvtColor(g, cv2.COLOR_GRAY2BGR, self._frame)
+        return t, self._frame
+
+    def _close(self):
+        logging.info("Requesting grabbing process to stop!")
+        self._stop_queue.put(None)
+        self._p.join()
+        logging.info("Frame grabbing thread is joined")
+        logging.info("Frame buffer: %s" % str(self._frame_buffer.stats))
+        self._frame_buffer.close()
+
+    def set_tracker(self, rois=None):
+        """
+        Switch the camera to tracking mode.
+        Unless ``roi_crop`` is disabled, the grabber then only transfers the pixels of the ``rois``, and frames are
+        :class:`~ethoscope.utils.img_proc.PackedFrame` objects (except for a complete frame every minute).
 
-    def set_tracker(self):
+        :param rois: the ROIs that will be tracked, or ``None`` if entire frames are needed
+        :type rois: list(:class:`~ethoscope.core.roi.ROI`)
+        """
+        if rois is not None and self._roi_crop:
+            rectangles = [tuple(int(v) for v in r.rectangle) for r in rois]
+            self._packer = RoiPacker(rectangles, self._frame_buffer.shape)
+            self._grey_background = np.zeros(self._frame_buffer.shape, dtype=np.uint8)
+            self._packed_bgr = np.empty((self._packer.size, 1, 3), dtype=np.uint8)
+            # the layout is sent before the event, so the grabber finds it when it switches to tracking
+            self._p._layout_queue.put(rectangles)
         self._p._tracker_event.set()
 
+    def converge_exposure(self, mode, band, timeout=60):
+        """
+        Let the frame grabber adjust the camera until the mean intensity of frames is within ``band``
+        (see :class:`~ethoscope.hardware.input.camera_settings.ExposureController`).
+        The frames acquired before convergence are discarded.
+
+        :param mode: the current mode of the camera (``target_detection`` or ``roi_builder``)
+        :type mode: str
+        :param band: the lowest and highest acceptable mean intensity
+        :type band: (float, float)
+        :param timeout: the maximal time to wait for the grabber, in seconds
+        :type timeout: float
+        :return: the outcome of the controller (see :attr:`~ethoscope.hardware.input.camera_settings.ExposureController.result`),
+            or ``None`` if the grabber did not reply in time
+        :rtype: dict
+        """
+        self._p._convergence_queue.put((mode, tuple(band)))
+        try:
+            result = self._p._convergence_result_queue.get(timeout=timeout)
+        except queue.Empty:
+            logging.warning("The exposure of the camera was not adjusted within %i seconds" % timeout)
+            return None
+
+        while True:
+            _, capture_time, _ = self._frame_buffer.get(timeout=30, latest=True)
+            if capture_time >= result["t"]:
+                break
+        return result
+
     def change_gain(self, mean_intensity, means, mode, i=0):
         
         within = mean_intensity > means[mode][0] and mean_intensity < means[mode][1]
@@ -963,16 +1669,26 @@ class FSLPiCameraAsync(OurPiCameraAsync):
 
 
 class DummyFrameGrabber(multiprocessing.Process):
-    def __init__(self, target_fps, target_resolution, queue, stop_queue, path, *args, **kwargs):
+    def __init__(self, exposure_queue, target_fps, target_resolution, queue, stop_queue, path, *args, telemetry_period=60, **kwargs):
         """
-        Class to mimic the behaviour of :class:`~ethoscope.hardware.input.cameras.PiFrameGrabber`.
+        Class to mimic the behaviour of :class:`~ethoscope.hardware.input.cameras.DualPiFrameGrabber`.
         This is intended for testing purposes.
         This way, we can emulate the async functionality of the hardware camera by a video file.
 
+        :param exposure_queue: unused, for compatibility with :class:`~ethoscope.hardware.input.cameras.DualPiFrameGrabber`.
+            The exposure is emulated by a gain applied to the frames of the video (see :meth:`~ethoscope.hardware.input.cameras.FSLPiCameraAsync.converge_exposure`).
         :param target_fps: the desired number of frames par second (FPS)
         :type target_fps: int
         :param target_fps: the desired resolution (W x H)
         :param target_resolution: (int,int)
+        :param queue: a ring buffer where frames are written and made available to the camera
+        :type queue: :class:`~ethoscope.hardware.input.ring_buffer.FrameRingBuffer`
+        :param stop_queue: a queue that can stop the async acquisition
+        :type stop_queue: :class:`~multiprocessing.JoinableQueue`
+        :param path: the path to the video file
+        :type path: str
+        :param telemetry_period: the longest time, in seconds, between two samples of the emulated gain
+        :type telemetry_period: float
         :param args: additional arguments
         :param kwargs: additional keyword arguments
         """
@@ -981,11 +1697,24 @@ class DummyFrameGrabber(multiprocessing.Process):
         self._target_fps = target_fps
         self._target_resolution = target_resolution
         self._video_file = path
+        self._tracker_event = multiprocessing.Event()
+        self._roi_builder_event = multiprocessing.Event()
+        self._layout_queue = multiprocessing.Queue(maxsize=1)
+        self._convergence_queue = multiprocessing.Queue(maxsize=1)
+        self._convergence_result_queue = multiprocessing.Queue(maxsize=1)
+        self._telemetry_queue = multiprocessing.Queue(maxsize=100)
+        self._telemetry_period = telemetry_period
         super(DummyFrameGrabber, self).__init__()
+
     def run(self):
         try:
 
             cap = cv2.VideoCapture(self._video_file)
+            publisher = RoiFramePublisher(self._queue)
+            tracker_event = False
+            gain = 1.0
+            exposure_controller = None
+            telemetry = TelemetrySampler(self._telemetry_queue, period=self._telemetry_period)
             while True:
                 if not self._stop_queue.empty():
 
@@ -994,10 +1723,35 @@ class DummyFrameGrabber(multiprocessing.Process):
                     self._stop_queue.task_done()
                     logging.warning("Stop Task Done")
                     break
-                _, out = cap.read()
-                #todo sleep here
-                out = cv2.cvtColor(out, cv2.COLOR_BGR2GRAY)
-                self._queue.put(out)
+                ret, out = cap.read()
+                if not ret:
+                    # loop over the video
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    continue
+                capture_time = time.time()
+                if self._tracker_event.is_set() and not tracker_event:
+                    tracker_event = True
+                    publisher.set_layout(_receive_roi_layout(self._layout_queue))
+                if gain != 1.0:
+                    out = cv2.convertScaleAbs(out, alpha=gain)
+                if exposure_controller is None:
+                    try:
+                        _, band = self._convergence_queue.get(block=False)
+                        exposure_controller = ExposureController(band, gain, (0.1, 16.0))
+                    except queue.Empty:
+                        pass
+                if exposure_controller is not None:
+                    value = exposure_controller.update(cv2.cvtColor(out[::4, ::4], cv2.COLOR_BGR2GRAY), capture_time)
+                    if value is not None:
+                        gain = value
+                        telemetry.update({"analog_gain": round(gain, 3)}, capture_time)
+                    if exposure_controller.done:
+                        self._convergence_result_queue.put(exposure_controller.result)
+                        exposure_controller = None
+                if telemetry.due(capture_time):
+                    telemetry.update({"analog_gain": round(gain, 3)}, capture_time)
+                publisher.publish(out, capture_time, cv2.COLOR_BGR2GRAY)
+                time.sleep(1.0 / self._target_fps)
 
         finally:
             logging.warning("Closing frame grabber process")
@@ -1005,9 +1759,266 @@ class DummyFrameGrabber(multiprocessing.Process):
             self._queue.close()
             logging.warning("Camera Frame grabber stopped acquisition cleanly")
 
-class DummyPiCameraAsync(OurPiCameraAsync):
+class DummyPiCameraAsync(FSLPiCameraAsync):
     """
-    Class to mimic the behaviour of :class:`~ethoscope.hardware.input.cameras.OurPiCameraAsync`.
+    Class to mimic the behaviour of :class:`~ethoscope.hardware.input.cameras.FSLPiCameraAsync`.
     This is intended for testing purposes. This way, we can emulate the async functionality of the hardware camera by a video file.
+    Frames are read from the video at ``target_fps``, and the resolution is the one of the video.
     """
     _frame_grabber_class = DummyFrameGrabber
+
+    def _start_frame_grabber(self, target_fps, target_resolution, path, *args, **kwargs):
+        cap = cv2.VideoCapture(path)
+        try:
+            if not cap.isOpened():
+                raise EthoscopeException("Could not open video file %s" % path)
+            video_resolution = (int(cap.get(CAP_PROP_FRAME_WIDTH)), int(cap.get(CAP_PROP_FRAME_HEIGHT)))
+        finally:
+            cap.release()
+        super(DummyPiCameraAsync, self)._start_frame_grabber(target_fps, video_resolution, path, *args, **kwargs)
+
+    def change_gain(self, mean_intensity, means, mode, i=0):
+        return i + 1
+
+
+class SyntheticArenaCamera(BaseCamera):
+    _description = {"overview": "Class to render an arena of flies, for testing purposes. The true position of each fly is known.",
+                    "arguments": [
+                                    {"type": "number", "min": 1, "max": 200, "step": 1, "name": "n_rois",
+                                     "description": "The number of regions of interest, each with one fly", "default": 20},
+                                    {"type": "number", "min": 1, "max": 200, "step": 1, "name": "target_fps",
+                                     "description": "The number of frames per second", "default": 20},
+                                   ]}
+    _grey_capable = True
+
+    def __init__(self, n_rois=20, target_fps=20, target_resolution=(1280, 960), n_columns=2, motion=None,
+                 speed=0.2, light_drift=0.05, light_period=600, noise=4, real_time=False, n_frames=None,
+                 record_ground_truth=False, seed=0, *args, **kwargs):
+        """
+        Class to render frames of an arena procedurally: a grid of bright regions of interest, each with a dark, fly-like, blob.
+        Flies alternate between walking (a random walk) and resting, unless their motion is scripted.
+        The lighting drifts slowly and each frame is noisy.
+        The true position of each fly is available (see :attr:`ground_truth`), so trackers can be evaluated,
+        and monitors, trackers and result writers can be load tested without a camera or a video.
+
+        :param n_rois: the number of regions of interest, each with one fly
+        :type n_rois: int
+        :param target_fps: the number of frames per second. It defines the time stamps of the frames
+        :type target_fps: float
+        :param target_resolution: the resolution of the frames (W x H)
+        :type target_resolution: (int, int)
+        :param n_columns: the number of columns of the grid of regions of interest
+        :type n_columns: int
+        :param motion: a function of the time (in s) and of the index of the region of interest (from 1),
+            that returns the position of the fly, relative to the region of interest (both coordinates between 0 and 1).
+            ``None`` makes the flies do a random walk
+        :type motion: callable
+        :param speed: the walking speed of the flies, in length of their region of interest per second
+        :type speed: float
+        :param light_drift: the relative amplitude of the (sinusoidal) drift of the lighting
+        :type light_drift: float
+        :param light_period: the period of the drift of the lighting, in s
+        :type light_period: float
+        :param noise: the standard deviation of the pixel noise
+        :type noise: float
+        :param real_time: whether frames are delivered at ``target_fps``, on the wall clock.
+            Frames that are due while the consumer is busy are lost, as with a real camera.
+            Otherwise, frames are rendered as fast as they are read.
+        :type real_time: bool
+        :param n_frames: the number of frames to render, or ``None`` for no limit
+        :type n_frames: int
+        :param record_ground_truth: whether to keep the true positions of the flies in every frame (see :attr:`ground_truth_history`)
+        :type record_ground_truth: bool
+        :param seed: the seed of the random number generator, so runs can be reproduced
+        :type seed: int
+        :param args: additional arguments
+        :param kwargs: additional keyword arguments
+        """
+        self._n_rois = int(n_rois)
+        self._target_fps = float(target_fps)
+        self._resolution = (int(target_resolution[0]), int(target_resolution[1]))
+        self._n_columns = int(n_columns)
+        self._motion = motion
+        self._speed = speed
+        self._light_drift = light_drift
+        self._light_period = light_period
+        self._noise = noise
+        self._real_time = real_time
+        self._n_frames = n_frames
+        self._record_ground_truth = record_ground_truth
+        self._seed = seed
+        self.canbepickled = False
+
+        self._rois = self._make_rois()
+        self._rectangles = np.array([r.rectangle for r in self._rois], dtype=np.float64)
+        short_side = np.min(self._rectangles[:, 2:4], axis=1)
+        # semi-axes of the flies
+        self._fly_size = np.stack([np.maximum(3, short_side * 0.2), np.maximum(2, short_side * 0.09)], axis=1)
+        self._background = self._make_background()
+        w, h = self._resolution
+        self._frame = np.zeros((h, w, 3), dtype=np.uint8)
+
+        super(SyntheticArenaCamera, self).__init__(*args, **kwargs)
+        self.restart()
+
+    def _make_rois(self):
+        w, h = self._resolution
+        n_rows = int(math.ceil(self._n_rois / float(self._n_columns)))
+        cell_w, cell_h = w / float(self._n_columns), h / float(n_rows)
+        margin_x, margin_y = max(2, int(cell_w * 0.05)), max(2, int(cell_h * 0.1))
+        rois = []
+        for i in range(self._n_rois):
+            col, row = i // n_rows, i % n_rows
+            x0, y0 = int(col * cell_w) + margin_x, int(row * cell_h) + margin_y
+            x1, y1 = int((col + 1) * cell_w) - margin_x, int((row + 1) * cell_h) - margin_y
+            if x1 - x0 < 8 or y1 - y0 < 6:
+                raise EthoscopeException("%i regions of interest do not fit in a %ix%i frame" % (self._n_rois, w, h))
+            rois.append(ROI(np.array([(x0, y0), (x1, y0), (x1, y1), (x0, y1)]), idx=i + 1))
+        return rois
+
+    def _make_background(self):
+        w, h = self._resolution
+        background = np.full((h, w), 40, dtype=np.uint8)
+        for x, y, rw, rh in self._rectangles.astype(int):
+            background[y:y + rh, x:x + rw] = 200
+        return background
+
+    @property
+    def rois(self):
+        """
+        :return: The regions of interest of the arena, each with one fly
+        :rtype: list(:class:`~ethoscope.core.roi.ROI`)
+        """
+        return self._rois
+
+    @property
+    def ground_truth(self):
+        """
+        :return: The true position of each fly in the last frame, in pixels, from the top left corner of the frame, by index of region of interest
+        :rtype: dict
+        """
+        return {r.idx: (float(p[0]), float(p[1])) for r, p in zip(self._rois, self._positions)}
+
+    @property
+    def ground_truth_history(self):
+        """
+        :return: For every frame read, when ``record_ground_truth`` is set: the index of the frame,
+            its time stamp (in ms) and the true position of the flies (an array with one row per region of interest)
+        :rtype: list((int, int, :class:`~numpy.ndarray`))
+        """
+        return self._history
+
+    @property
+    def frame_buffer_stats(self):
+        """
+        :return: The number of frames lost because they were due while the previous one was being processed (``overwritten``),
+            when frames are delivered in real time
+        :rtype: dict
+        """
+        return {"pending": 0, "overwritten": self._lost, "dropped": 0, "skipped": 0, "rendered": self._rendered}
+
+    @property
+    def start_time(self):
+        return self._start_time
+
+    def is_opened(self):
+        return True
+
+    def is_last_frame(self):
+        return self._n_frames is not None and self._frame_idx >= self._n_frames
+
+    def restart(self):
+        self._frame_idx = 0
+        self._rng = np.random.RandomState(self._seed)
+        self._lost = 0
+        self._rendered = 0
+        self._history = []
+        self._start_time = time.time()
+
+        rect = self._rectangles
+        self._positions = rect[:, 0:2] + rect[:, 2:4] * self._rng.uniform(0.2, 0.8, (self._n_rois, 2))
+        self._heading = self._rng.uniform(0, 2 * np.pi, self._n_rois)
+        self._walking = self._rng.uniform(size=self._n_rois) < 0.5
+        # noise is drawn from a few precomputed images, at a random offset, which is much cheaper than drawing it for each frame
+        w, h = self._resolution
+        self._noise_bank = [np.abs(self._rng.normal(0, self._noise, (h * 2, w))).astype(np.uint8) for _ in range(4)]
+
+    def _move(self, t):
+        rect = self._rectangles
+        if self._motion is not None:
+            rel = np.array([self._motion(t, r.idx) for r in self._rois], dtype=np.float64)
+            new = rect[:, 0:2] + rect[:, 2:4] * rel
+            step = new - self._positions
+            moved = np.hypot(step[:, 0], step[:, 1]) > 0
+            self._heading[moved] = np.arctan2(step[moved, 1], step[moved, 0])
+            self._positions = new
+            return
+
+        dt = 1.0 / self._target_fps
+        n = self._n_rois
+        # bouts of activity last 2s on average, and rests 5s
+        stop = self._rng.uniform(size=n) < dt / 2.0
+        start = self._rng.uniform(size=n) < dt / 5.0
+        self._walking = np.where(self._walking, ~stop, start)
+
+        self._heading += self._rng.normal(0, 2.0 * math.sqrt(dt), n)
+        step = self._speed * np.max(rect[:, 2:4], axis=1) * dt * self._walking
+        pos = self._positions + np.stack([np.cos(self._heading), np.sin(self._heading)], axis=1) * step[:, None]
+
+        # flies bounce on the walls of their region of interest
+        low = rect[:, 0:2] + self._fly_size[:, 0:1]
+        high = rect[:, 0:2] + rect[:, 2:4] - self._fly_size[:, 0:1]
+        high = np.maximum(high, low)
+        out_x = (pos[:, 0] < low[:, 0]) | (pos[:, 0] > high[:, 0])
+        out_y = (pos[:, 1] < low[:, 1]) | (pos[:, 1] > high[:, 1])
+        self._heading[out_x] = np.pi - self._heading[out_x]
+        self._heading[out_y] = -self._heading[out_y]
+        self._positions = np.clip(pos, low, high)
+
+    def _render(self, t):
+        img = self._background.copy()
+        for (x, y), (a, b), heading in zip(self._positions, self._fly_size, self._heading):
+            cv2.ellipse(img, ((x, y), (2 * a, 2 * b), math.degrees(heading)), 30, -1)
+
+        if self._light_drift > 0:
+            gain = 1 + self._light_drift * math.sin(2 * math.pi * t / self._light_period)
+            cv2.convertScaleAbs(img, img, alpha=gain)
+
+        if self._noise > 0:
+            h = self._resolution[1]
+            i, j = self._rng.randint(0, len(self._noise_bank), 2)
+            offset_i, offset_j = self._rng.randint(0, h, 2)
+            cv2.add(img, self._noise_bank[i][offset_i:offset_i + h], img)
+            cv2.subtract(img, self._noise_bank[j][offset_j:offset_j + h], img)
+        self._rendered += 1
+        return img
+
+    def _time_stamp(self):
+        return self._frame_idx / self._target_fps
+
+    def _next_time_image(self):
+        if self._real_time:
+            due = self._start_time + self._frame_idx / self._target_fps
+            now = time.time()
+            if now < due:
+                time.sleep(due - now)
+            else:
+                # the flies keep moving in the frames that are never delivered
+                n_lost = int((now - self._start_time) * self._target_fps) - self._frame_idx
+                if self._n_frames is not None:
+                    n_lost = min(n_lost, self._n_frames - self._frame_idx - 1)
+                for _ in range(n_lost):
+                    self._move(self._time_stamp())
+                    self._frame_idx += 1
+                self._lost += max(n_lost, 0)
+
+        t = self._time_stamp()
+        self._move(t)
+        img = self._render(t)
+        self._frame_idx += 1
+        if self._record_ground_truth:
+            self._history.append((self._frame_idx, int(1000 * t), self._positions.copy()))
+        if self._grey:
+            return t, img
+        cv2.cvtColor(img, cv2.COLOR_GRAY2BGR, self._frame)
+        return t, self._frame
@@ -0,0 +1,357 @@
+__author__ = 'quentin'
+
+import logging
+import multiprocessing
+import os
+import queue
+import time
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from ethoscope.utils.debug import EthoscopeException
+from ethoscope.utils.img_proc import RoiPacker
+
+
+class FrameRingBuffer(object):
+    _policies = ("overwrite", "drop")
+
+    # indices in the shared state array
+    _WRITE_SEQ = 0
+    _READ_SEQ = 1
+    _LEASED = 2
+    _WRITING = 3
+    _DROPPED = 4
+    _OVERWRITTEN = 5
+    _SKIPPED = 6
+    _N_STATE = 8
+
+    def __init__(self, shape, dtype=np.uint8, n_slots=4, policy="overwrite"):
+        """
+        A ring buffer of preallocated frames, in shared memory, to hand frames over from a frame grabber
+        (thread or process) to a camera object without copying or pickling them.
+        Each slot holds a frame, its sequence number, its capture time stamp and a tag,
+        with which the producer can tell how the frame is laid out (see :attr:`last_tag`).
+
+        There is a single producer, which claims a free slot, writes the frame in it and publishes it
+        (see :meth:`claim`, :meth:`publish` and :meth:`put`), and a single consumer (see :meth:`get`).
+        The consumer receives a read-only view on the slot. The slot is leased to the consumer,
+        so it is not written until the next call to :meth:`get`.
+
+        When the consumer falls behind and all the other slots hold unread frames, the policy defines
+        what happens to a new frame:
+
+        * ``"overwrite"``: the oldest unread frame is replaced (counted as ``overwritten``)
+        * ``"drop"``: the new frame is discarded (counted as ``dropped``)
+
+        :param shape: the shape of the frames
+        :type shape: tuple
+        :param dtype: the data type of the frames
+        :param n_slots: the number of frames in the buffer (at least 2: one leased to the consumer and one to write)
+        :type n_slots: int
+        :param policy: either ``"overwrite"`` or ``"drop"``
+        :type policy: str
+        """
+        if n_slots < 2:
+            raise EthoscopeException("A frame ring buffer needs at least two slots")
+        if policy not in self._policies:
+            raise EthoscopeException("Unknown ring buffer policy '%s'. Use one of %s" % (policy, str(self._policies)))
+
+        self._shape = tuple(shape)
+        self._dtype = np.dtype(dtype)
+        self._n_slots = n_slots
+        self._policy = policy
+        self._cond = multiprocessing.Condition()
+
+        size = self._header_size(n_slots) + n_slots * int(np.prod(self._shape)) * self._dtype.itemsize
+        self._shm = shared_memory.SharedMemory(create=True, size=size)
+        # forked processes inherit this object, but only the creator destroys the shared memory
+        self._owner_pid = os.getpid()
+        self._attach()
+        self._seqs.fill(0)
+        self._stamps.fill(0)
+        self._tags.fill(0)
+        self._state.fill(0)
+        self._state[self._LEASED] = -1
+        self._state[self._WRITING] = -1
+
+    @staticmethod
+    def _header_size(n_slots):
+        size = (3 * n_slots + FrameRingBuffer._N_STATE) * 8
+        # keep frames aligned on cache lines
+        return (size + 63) // 64 * 64
+
+    def _attach(self):
+        n = self._n_slots
+        buf = self._shm.buf
+        self._seqs = np.ndarray((n,), dtype=np.int64, buffer=buf, offset=0)
+        self._stamps = np.ndarray((n,), dtype=np.float64, buffer=buf, offset=n * 8)
+        self._tags = np.ndarray((n,), dtype=np.int64, buffer=buf, offset=2 * n * 8)
+        self._state = np.ndarray((self._N_STATE,), dtype=np.int64, buffer=buf, offset=3 * n * 8)
+        self._frames = np.ndarray((n,) + self._shape, dtype=self._dtype, buffer=buf, offset=self._header_size(n))
+
+    def __getstate__(self):
+        return {"name": self._shm.name,
+                "shape": self._shape,
+                "dtype": self._dtype.str,
+                "n_slots": self._n_slots,
+                "policy": self._policy,
+                "cond": self._cond}
+
+    def __setstate__(self, state):
+        self._shape = state["shape"]
+        self._dtype = np.dtype(state["dtype"])
+        self._n_slots = state["n_slots"]
+        self._policy = state["policy"]
+        self._cond = state["cond"]
+        self._shm = shared_memory.SharedMemory(name=state["name"])
+        self._owner_pid = None
+        self._attach()
+
+    @property
+    def shape(self):
+        return self._shape
+
+    @property
+    def n_slots(self):
+        return self._n_slots
+
+    @property
+    def stats(self):
+        """
+        :return: Counters describing the traffic through the buffer:
+            ``written`` (frames published), ``read`` (sequence number of the last frame read),
+            ``dropped`` (new frames discarded because the buffer was full),
+            ``overwritten`` (unread frames replaced by newer ones),
+            ``skipped`` (unread frames ignored when the consumer asked for the latest frame) and
+            ``pending`` (frames waiting to be read).
+        :rtype: dict
+        """
+        with self._cond:
+            read_seq = int(self._state[self._READ_SEQ])
+            return {"written": int(self._state[self._WRITE_SEQ]),
+                    "read": read_seq,
+                    "dropped": int(self._state[self._DROPPED]),
+                    "overwritten": int(self._state[self._OVERWRITTEN]),
+                    "skipped": int(self._state[self._SKIPPED]),
+                    "pending": int(np.count_nonzero(self._seqs > read_seq))}
+
+    @property
+    def last_tag(self):
+        """
+        :return: The tag of the last frame returned by :meth:`get` (see :meth:`publish`)
+        :rtype: int
+        """
+        with self._cond:
+            leased = self._state[self._LEASED]
+            if leased < 0:
+                return 0
+            return int(self._tags[leased])
+
+    def claim(self):
+        """
+        Reserve a slot for the producer to write a frame in.
+
+        :return: the index of the slot and a writable view on it, or ``None`` if the frame has to be dropped
+        :rtype: (int, :class:`~numpy.ndarray`)
+        """
+        with self._cond:
+            if self._state[self._WRITING] >= 0:
+                raise EthoscopeException("A slot is already claimed. Publish it before claiming another one")
+
+            leased = self._state[self._LEASED]
+            read_seq = self._state[self._READ_SEQ]
+            idx = None
+            oldest = None
+            for i in range(self._n_slots):
+                if i == leased:
+                    continue
+                if self._seqs[i] <= read_seq:
+                    # empty or already consumed
+                    idx = i
+                    break
+                if oldest is None or self._seqs[i] < self._seqs[oldest]:
+                    oldest = i
+
+            if idx is None:
+                if self._policy == "drop":
+                    self._state[self._DROPPED] += 1
+                    return None
+                idx = oldest
+                self._state[self._OVERWRITTEN] += 1
+
+            # hide the slot from the consumer whilst it is written
+            self._seqs[idx] = -1
+            self._state[self._WRITING] = idx
+
+        return idx, self._frames[idx]
+
+    def publish(self, idx, t=None, tag=0):
+        """
+        Make a claimed slot available to the consumer.
+
+        :param idx: the index returned by :meth:`claim`
+        :type idx: int
+        :param t: the capture time stamp (``time.time()`` by default)
+        :type t: float
+        :param tag: how the frame is laid out in the slot. ``0`` means a frame of the shape of the buffer
+        :type tag: int
+        :return: the sequence number of the frame
+        :rtype: int
+        """
+        if t is None:
+            t = time.time()
+        with self._cond:
+            if self._state[self._WRITING] != idx:
+                raise EthoscopeException("Slot %i was not claimed" % idx)
+            self._state[self._WRITE_SEQ] += 1
+            seq = int(self._state[self._WRITE_SEQ])
+            self._stamps[idx] = t
+            self._tags[idx] = tag
+            self._seqs[idx] = seq
+            self._state[self._WRITING] = -1
+            self._cond.notify_all()
+        return seq
+
+    def put(self, frame, t=None):
+        """
+        Copy a frame in the buffer. Producers that can write directly in the slot should use :meth:`claim` and :meth:`publish` instead.
+
+        :param frame: a frame with the shape and type of the buffer
+        :type frame: :class:`~numpy.ndarray`
+        :param t: the capture time stamp (``time.time()`` by default)
+        :type t: float
+        :return: the sequence number of the frame, or ``None`` if it was dropped
+        :rtype: int
+        """
+        if frame.shape != self._shape:
+            raise EthoscopeException("Frame shape %s does not match the ring buffer (%s)" % (str(frame.shape), str(self._shape)))
+        claimed = self.claim()
+        if claimed is None:
+            return None
+        idx, slot = claimed
+        np.copyto(slot, frame)
+        return self.publish(idx, t)
+
+    def get(self, timeout=None, latest=False):
+        """
+        Get the next frame. The returned frame is a read-only view on shared memory,
+        which is valid until the next call to this method.
+
+        :param timeout: how long to wait for a frame, in seconds (``None`` means forever)
+        :type timeout: float
+        :param latest: if ``True``, return the most recent frame and skip the older unread ones.
+            Otherwise, frames are returned in the order they were acquired.
+        :type latest: bool
+        :return: the sequence number, the capture time stamp and the frame
+        :rtype: (int, float, :class:`~numpy.ndarray`)
+        :raises queue.Empty: if no frame arrives within ``timeout``
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while True:
+                read_seq = self._state[self._READ_SEQ]
+                pending = np.flatnonzero(self._seqs > read_seq)
+                if len(pending) > 0:
+                    break
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise queue.Empty("No frame in the ring buffer after %s seconds" % str(timeout))
+                self._cond.wait(remaining)
+
+            seqs = self._seqs[pending]
+            if latest:
+                idx = int(pending[np.argmax(seqs)])
+                self._state[self._SKIPPED] += len(pending) - 1
+            else:
+                idx = int(pending[np.argmin(seqs)])
+
+            seq = int(self._seqs[idx])
+            t = float(self._stamps[idx])
+            self._state[self._READ_SEQ] = seq
+            self._state[self._LEASED] = idx
+
+        out = self._frames[idx].view()
+        out.flags.writeable = False
+        return seq, t, out
+
+    def close(self):
+        """
+        Release the shared memory. The process that created the buffer also destroys it.
+        """
+        if self._shm is None:
+            return
+        self._seqs = self._stamps = self._tags = self._state = self._frames = None
+        self._shm.close()
+        if self._owner_pid == os.getpid():
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                logging.warning("Shared memory of the frame ring buffer was already unlinked")
+        self._shm = None
+
+
+class RoiFramePublisher(object):
+    #: the tag of frames of which only the ROIs were written (see :meth:`FrameRingBuffer.publish`)
+    packed_tag = 1
+
+    def __init__(self, frame_buffer, full_frame_period=60):
+        """
+        Write the frames of a frame grabber in a ring buffer.
+        Once the layout of the ROIs is known (see :meth:`set_layout`), only their pixels are written, packed at the start of the slot
+        (see :class:`~ethoscope.utils.img_proc.RoiPacker`), which cuts the memory traffic in proportion to the part of the frame they cover.
+        A complete frame is still written every ``full_frame_period`` seconds, so the rest of the frame is refreshed.
+
+        :param frame_buffer: the ring buffer
+        :type frame_buffer: :class:`~ethoscope.hardware.input.ring_buffer.FrameRingBuffer`
+        :param full_frame_period: the interval between complete frames, once the layout is set, in seconds
+        :type full_frame_period: float
+        """
+        self._frame_buffer = frame_buffer
+        self._full_frame_period = full_frame_period
+        self._packer = None
+        self._last_full_frame = None
+
+    def set_layout(self, rectangles):
+        """
+        :param rectangles: the bounding rectangles of the ROIs, as (x, y, w, h) tuples, or ``None`` to write complete frames
+        :type rectangles: list(tuple)
+        """
+        if rectangles is None:
+            self._packer = None
+            return
+        self._packer = RoiPacker(rectangles, self._frame_buffer.shape)
+        # the consumer needs a complete frame to start from
+        self._last_full_frame = None
+        logging.info("Only the ROIs are transferred from now on: %.1f%% of the frame, in %i blocks" %
+                     (100 * self._packer.coverage, len(self._packer.blocks)))
+
+    def publish(self, frame, t, code=None):
+        """
+        Write a frame in a slot of the buffer.
+
+        :param frame: the frame
+        :type frame: :class:`~numpy.ndarray`
+        :param t: the capture time stamp
+        :type t: float
+        :param code: an optional colour conversion (e.g. ``cv2.COLOR_BGR2GRAY``), applied whilst writing
+        :type code: int
+        :return: the sequence number of the frame, or ``None`` if it was dropped
+        :rtype: int
+        """
+        claimed = self._frame_buffer.claim()
+        if claimed is None:
+            return None
+        idx, slot = claimed
+        full = self._packer is None or self._last_full_frame is None or t - self._last_full_frame >= self._full_frame_period
+        if full:
+            if code is None:
+                np.copyto(slot, frame)
+            else:
+                cv2.cvtColor(frame, code, slot)
+            self._last_full_frame = t
+            return self._frame_buffer.publish(idx, t)
+
+        self._packer.pack(frame, slot.reshape((-1,) + slot.shape[2:]), code)
+        return self._frame_buffer.publish(idx, t, self.packed_tag)
@@ -0,0 +1,221 @@
+__author__ = 'quentin'
+
+import bisect
+import logging
+import os
+import time
+import traceback
+
+import cv2
+import numpy as np
+
+from ethoscope.utils.debug import EthoscopeException
+
+
+class VideoIndex(object):
+    _version = 1
+    _suffix = ".index.npz"
+
+    def __init__(self, pts, keyframes, size=0, mtime=0.0):
+        """
+        The presentation time stamp of each frame of a video file, and whether it is a keyframe.
+        This allows frame-accurate access to a recorded video, by time or by frame number (see :meth:`~ethoscope.hardware.input.cameras.MovieVirtualCamera.seek_frame`).
+        The index is built once, by reading the packets of the video without decoding them (see :meth:`build`),
+        and cached next to the video (see :meth:`load_or_build`).
+
+        :param pts: the time stamp of each frame, in ms
+        :type pts: :class:`~numpy.ndarray`
+        :param keyframes: whether each frame is a keyframe
+        :type keyframes: :class:`~numpy.ndarray`
+        :param size: the size of the indexed file, in bytes, to detect when it changes
+        :type size: int
+        :param mtime: the modification time of the indexed file
+        :type mtime: float
+        """
+        self._pts = np.asarray(pts, dtype=np.float64)
+        self._keyframes = np.asarray(keyframes, dtype=bool)
+        self._key_idx = [int(i) for i in np.flatnonzero(self._keyframes)]
+        self._pts_list = self._pts.tolist()
+        self._size = int(size)
+        self._mtime = float(mtime)
+
+    @property
+    def n_frames(self):
+        return len(self._pts)
+
+    @property
+    def pts(self):
+        return self._pts
+
+    @property
+    def keyframes(self):
+        return self._keyframes
+
+    @classmethod
+    def index_path(cls, path):
+        """
+        :return: the path of the index of a video file
+        :rtype: str
+        """
+        return path + cls._suffix
+
+    @classmethod
+    def build(cls, path):
+        """
+        Index a video by reading its packets, without decoding them.
+        When the packets cannot be read, the frames are decoded instead, and the keyframes are unknown.
+
+        :param path: the path of the video file
+        :type path: str
+        :rtype: :class:`~ethoscope.hardware.input.video_index.VideoIndex`
+        """
+        if not os.path.exists(path):
+            raise EthoscopeException("'%s' does not exist. No such file" % path)
+        start = time.time()
+        stat = os.stat(path)
+        try:
+            pts, keyframes = cls._scan_packets(path)
+        except EthoscopeException as e:
+            logging.warning("%s. Indexing by decoding the video instead" % str(e))
+            pts, keyframes = cls._scan_frames(path)
+
+        logging.info("Indexed %i frames of %s in %.2fs" % (len(pts), path, time.time() - start))
+        return cls(pts, keyframes, stat.st_size, stat.st_mtime)
+
+    @staticmethod
+    def _scan_packets(path):
+        if not hasattr(cv2, "CAP_PROP_LRF_HAS_KEY_FRAME"):
+            raise EthoscopeException("This version of OpenCV cannot read the packets of a video")
+        capture = cv2.VideoCapture(path, cv2.CAP_FFMPEG)
+        pts = []
+        keyframes = []
+        try:
+            if not capture.set(cv2.CAP_PROP_FORMAT, -1):
+                raise EthoscopeException("Cannot read the packets of %s" % path)
+            while True:
+                ok, _ = capture.read()
+                if not ok:
+                    break
+                pts.append(capture.get(cv2.CAP_PROP_POS_MSEC))
+                keyframes.append(bool(capture.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME)))
+        finally:
+            capture.release()
+
+        if len(pts) > 0:
+            # decoding always starts on a keyframe
+            keyframes[0] = True
+        return pts, keyframes
+
+    @staticmethod
+    def _scan_frames(path):
+        capture = cv2.VideoCapture(path)
+        pts = []
+        try:
+            while capture.grab():
+                pts.append(capture.get(cv2.CAP_PROP_POS_MSEC))
+        finally:
+            capture.release()
+        # keyframes are unknown, so seeks are left to the video backend
+        return pts, [True] * len(pts)
+
+    def save(self, path):
+        """
+        Save the index, atomically.
+
+        :param path: the path of the index file
+        :type path: str
+        """
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez_compressed(f, version=self._version, pts=self._pts, keyframes=self._keyframes,
+                                size=self._size, mtime=self._mtime)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        :param path: the path of an index file
+        :type path: str
+        :rtype: :class:`~ethoscope.hardware.input.video_index.VideoIndex`
+        """
+        with np.load(path, allow_pickle=False) as data:
+            if int(data["version"]) != cls._version:
+                raise EthoscopeException("Unsupported video index version in %s" % path)
+            return cls(data["pts"], data["keyframes"], int(data["size"]), float(data["mtime"]))
+
+    def matches(self, path):
+        """
+        :return: whether this index describes the current content of a video file
+        :rtype: bool
+        """
+        stat = os.stat(path)
+        return stat.st_size == self._size and stat.st_mtime == self._mtime
+
+    @classmethod
+    def load_or_build(cls, path):
+        """
+        Load the cached index of a video, or build it (and cache it) if it does not exist or is out of date.
+        If the index cannot be written next to the video, it is only kept in memory.
+
+        :param path: the path of the video file
+        :type path: str
+        :rtype: :class:`~ethoscope.hardware.input.video_index.VideoIndex`
+        """
+        index_path = cls.index_path(path)
+        if os.path.exists(index_path):
+            try:
+                index = cls.load(index_path)
+                if index.matches(path):
+                    return index
+                logging.info("The index of %s is out of date" % path)
+            except Exception:
+                logging.warning("Could not load the index of %s: '%s'" % (path, traceback.format_exc()))
+
+        index = cls.build(path)
+        try:
+            index.save(index_path)
+        except OSError as e:
+            logging.warning("Could not save the index of %s: %s" % (path, str(e)))
+        return index
+
+    def frame_at(self, t):
+        """
+        :param t: a time, in ms
+        :type t: float
+        :return: the index of the first frame presented at or after ``t`` (``n_frames`` if there is none)
+        :rtype: int
+        """
+        return bisect.bisect_left(self._pts_list, t)
+
+    def keyframe_before(self, frame_idx):
+        """
+        :param frame_idx: the index of a frame
+        :type frame_idx: int
+        :return: the index of the last keyframe at or before ``frame_idx``
+        :rtype: int
+        """
+        i = bisect.bisect_right(self._key_idx, frame_idx) - 1
+        return self._key_idx[max(i, 0)]
+
+    def camera_time_stamp(self, frame_idx):
+        """
+        :param frame_idx: the index of a frame
+        :type frame_idx: int
+        :return: the time stamp, in ms, that :class:`~ethoscope.hardware.input.cameras.MovieVirtualCamera` gives to the frame.
+            The camera reads the position in the video before reading a frame, which is the time stamp of the previous frame.
+        :rtype: float
+        """
+        if frame_idx <= 0:
+            return 0.0
+        return self._pts_list[min(frame_idx, self.n_frames) - 1]
+
+    def frame_at_camera_time(self, t):
+        """
+        :param t: a time stamp, in ms, as given by :class:`~ethoscope.hardware.input.cameras.MovieVirtualCamera`
+        :type t: float
+        :return: the index of the first frame with a camera time stamp at or after ``t``
+        :rtype: int
+        """
+        if t <= 0:
+            return 0
+        return self.frame_at(t) + 1
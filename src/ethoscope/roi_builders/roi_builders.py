@@ -47,6 +47,12 @@ class BaseROIBuilder(DescribedObject):
             accum = np.copy(input)
 
         else:
+            # cameras that control their exposure while grabbing reach the target intensity before frames are accumulated
+            exposure_set = False
+            if mode is not None and hasattr(input, "converge_exposure"):
+                result = input.converge_exposure(mode, means[mode])
+                exposure_set = result is not None and result["converged"]
+
             i = 0
             for x in input:
 
@@ -61,7 +67,10 @@ class BaseROIBuilder(DescribedObject):
                 if mode is not None:
 
                     mean_intensity = np.mean(frame)
-                    i = input.change_gain(mean_intensity=mean_intensity, means=means, mode=mode, i=i)                    
+                    if exposure_set:
+                        i += 1
+                    else:
+                        i = input.change_gain(mean_intensity=mean_intensity, means=means, mode=mode, i=i)
                     if mean_intensity < modes_min[mode]:
                         modes_n[next_mode[mode]] -= 1
 
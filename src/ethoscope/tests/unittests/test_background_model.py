@@ -0,0 +1,42 @@
+__author__ = 'quentin'
+
+import unittest
+
+import cv2
+import numpy as np
+
+from ethoscope.trackers.adaptive_bg_tracker import BackgroundModel
+
+
+def reference_update(bg, img, fg_mask, alpha):
+    # the original, array-based, update
+    alpha_matrix = np.full(img.shape, alpha, dtype=np.float32)
+    if fg_mask is not None:
+        cv2.dilate(fg_mask, None, fg_mask)
+        cv2.subtract(alpha_matrix, alpha_matrix, alpha_matrix, mask=fg_mask)
+    return alpha_matrix * img + (1 - alpha_matrix) * bg
+
+
+class TestBackgroundModel(unittest.TestCase):
+
+    def test_update(self):
+        rng = np.random.RandomState(1)
+        model = BackgroundModel()
+        first = rng.randint(0, 256, (60, 80)).astype(np.uint8)
+        model.update(first, 0)
+        expected = first.astype(np.float32)
+
+        for i in range(1, 20):
+            img = rng.randint(0, 256, (60, 80)).astype(np.uint8)
+            # a foreground that is not binary, as in the trackers
+            fg = np.zeros_like(img)
+            fg[10 + i:20 + i, 30:40] = rng.randint(1, 256, (10, 10))
+            t = i * 500
+            alpha = 1 - np.exp(-np.log(2) / model._current_half_life * (t - model.last_t))
+            expected = reference_update(expected, img, fg.copy(), alpha)
+            model.update(img, t, fg)
+            np.testing.assert_allclose(model.bg_img, expected, atol=1e-3)
+            np.testing.assert_array_equal(model.bg_img_u8, model.bg_img.astype(np.uint8))
+
+        model.update(img, 20 * 500)
+        np.testing.assert_array_equal(model.bg_img_u8, model.bg_img.astype(np.uint8))
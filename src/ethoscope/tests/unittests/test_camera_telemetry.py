@@ -0,0 +1,108 @@
+__author__ = 'quentin'
+
+import os
+import queue
+import shutil
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+
+from ethoscope.hardware.input.camera_telemetry import TelemetrySampler, TelemetryRecorder
+from ethoscope.hardware.input.cameras import DummyPiCameraAsync
+
+
+class Writer(object):
+    def __init__(self):
+        self._insert_dict = {}
+        self.tables = {}
+
+    def _create_table(self, name, fields, engine=None):
+        self.tables[name] = fields
+
+
+class TestTelemetrySampler(unittest.TestCase):
+
+    def test_rate(self):
+        q = queue.Queue()
+        sampler = TelemetrySampler(q, period=60, poll_period=5)
+        sent = []
+        # one frame every 0.5s, for 3 min, with the gain changing once
+        for i in range(360):
+            t = i * 0.5
+            if sampler.due(t):
+                sent.append(sampler.update({"analog_gain": 1.0 if t < 100 else 2.0}, t))
+        self.assertEqual(sum(sent), 4)
+        samples = [q.get() for _ in range(q.qsize())]
+        self.assertEqual([s[0] for s in samples], [0, 60, 100, 160])
+        self.assertEqual(samples[2][1], {"analog_gain": 2.0})
+        # settings read twice in a row are only sent once
+        self.assertFalse(sampler.update({"analog_gain": 2.0}, 161))
+
+
+class TestTelemetryRecorder(unittest.TestCase):
+
+    def test_write(self):
+        writer = Writer()
+        recorder = TelemetryRecorder()
+        recorder.bind(writer)
+        # the table is created with the first sample
+        recorder.write(writer, [])
+        self.assertEqual(writer.tables, {})
+        recorder.write(writer, [(1000, {"framerate": 2.0, "exposure_mode": "off", "analog_gain": 8.0}),
+                                (61000, {"framerate": 2.0, "exposure_mode": "off", "analog_gain": 4.0})])
+        self.assertTrue(writer.tables["CAMERA_TELEMETRY"].startswith("t INT, framerate FLOAT"))
+        self.assertEqual(writer._insert_dict["CAMERA_TELEMETRY"],
+                         "INSERT INTO CAMERA_TELEMETRY VALUES (1000, 2.0, 'off', 0, 0, 0, 0, 8.0, 0, 0),"
+                         "(61000, 2.0, 'off', 0, 0, 0, 0, 4.0, 0, 0)")
+
+    def test_no_writer(self):
+        writer = Writer()
+        recorder = TelemetryRecorder()
+        recorder.bind(None)
+        recorder.write(writer, [(0, {"analog_gain": 1.0})])
+        self.assertEqual(writer._insert_dict, {})
+        self.assertEqual(writer.tables, {})
+
+    def test_created_once(self):
+        writer = Writer()
+        created = []
+        writer._create_table = lambda name, fields, engine=None: created.append(name)
+        recorder = TelemetryRecorder()
+        recorder.bind(writer)
+        for t in (1000, 2000):
+            recorder.write(writer, [(t, {"analog_gain": 1.0})])
+        self.assertEqual(created, ["CAMERA_TELEMETRY"])
+
+
+class TestCameraTelemetry(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._path = os.path.join(self._dir, "video.avi")
+        writer = cv2.VideoWriter(self._path, cv2.VideoWriter_fourcc(*"MJPG"), 10, (160, 120))
+        for i in range(20):
+            writer.write(np.full((120, 160, 3), 30, dtype=np.uint8))
+        writer.release()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_camera(self):
+        cam = DummyPiCameraAsync(target_fps=50, path=self._path)
+        try:
+            for i, _ in cam:
+                if i == 5:
+                    break
+            self.assertEqual(cam.telemetry["analog_gain"], 1.0)
+            cam.pop_telemetry()
+            # the settings are sampled again when they change
+            result = cam.converge_exposure("target_detection", (140, 190), timeout=10)
+            samples = cam.pop_telemetry()
+            self.assertEqual(len(samples), result["n_steps"])
+            self.assertEqual(samples[-1][1]["analog_gain"], round(result["value"], 3))
+            self.assertEqual([s[0] for s in samples], sorted(s[0] for s in samples))
+            self.assertEqual(cam.pop_telemetry(), [])
+        finally:
+            cam._close()
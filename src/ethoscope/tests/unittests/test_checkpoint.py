@@ -0,0 +1,182 @@
+__author__ = 'quentin'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+
+from ethoscope.core.roi import ROI
+from ethoscope.trackers.adaptive_bg_tracker import AdaptiveBGModel, ObjectModel
+from ethoscope.utils.checkpoint import StateCheckpointer
+from ethoscope.utils.io import DAMFileHelper
+
+
+def make_frame(i, shape=(120, 200)):
+    """
+    A bright arena with a dark animal moving along x
+    """
+    rng = np.random.RandomState(i)
+    frame = np.full(shape + (3,), 200, dtype=np.uint8)
+    frame = cv2.add(frame, rng.randint(0, 10, frame.shape).astype(np.uint8))
+    x = 30 + (i * 3) % 140
+    cv2.ellipse(frame, (x, 60), (8, 4), 0, 0, 360, (20, 20, 20), -1)
+    return frame
+
+
+class TestTrackerState(unittest.TestCase):
+    def setUp(self):
+        fg_model = AdaptiveBGModel.fg_model
+        self.addCleanup(setattr, AdaptiveBGModel, "fg_model", fg_model)
+
+    def _roi(self):
+        return ROI(np.array([(10, 10), (190, 10), (190, 110), (10, 110)]), idx=1)
+
+    def _track(self, tracker, frames):
+        return [tracker.track(t, f) for t, f in frames]
+
+    def test_resume_warm(self):
+        frames = [(i * 200, make_frame(i)) for i in range(60)]
+        a = AdaptiveBGModel(self._roi())
+        self._track(a, frames[:50])
+        state = a.get_state()
+        shared_state = AdaptiveBGModel.get_shared_state()
+
+        b = AdaptiveBGModel(self._roi())
+        # the foreground model is shared by all instances, so the state is restored before each run
+        b.set_state(state)
+        AdaptiveBGModel.set_shared_state(shared_state)
+        out_b = self._track(b, frames[50:])
+        a.set_state(state)
+        AdaptiveBGModel.set_shared_state(shared_state)
+        out_a = self._track(a, frames[50:])
+
+        self.assertEqual(len(out_a), len(out_b))
+        for pa, pb in zip(out_a, out_b):
+            self.assertEqual([dict(p) for p in pa], [dict(p) for p in pb])
+        self.assertTrue(any(len(p) > 0 for p in out_b))
+
+    def test_shared_state_saved_once(self):
+        frames = [(i * 200, make_frame(i)) for i in range(20)]
+        a = AdaptiveBGModel(self._roi())
+        self._track(a, frames)
+        self.assertFalse(any([k.startswith("fg_") for k in a.get_state().keys()]))
+        shared_state = AdaptiveBGModel.get_shared_state()
+        np.testing.assert_array_equal(shared_state["fg_ring_buff"], AdaptiveBGModel.fg_model.get_state()["ring_buff"])
+
+        AdaptiveBGModel.fg_model = ObjectModel()
+        AdaptiveBGModel.set_shared_state(shared_state)
+        np.testing.assert_array_equal(AdaptiveBGModel.fg_model.get_state()["ring_buff"], shared_state["fg_ring_buff"])
+
+    def test_cold_tracker_has_state(self):
+        a = AdaptiveBGModel(self._roi())
+        state = a.get_state()
+        b = AdaptiveBGModel(self._roi())
+        b.set_state(state)
+        self.assertEqual(b.last_time_point, 0)
+
+
+class TestDAMState(unittest.TestCase):
+    def test_round_trip(self):
+        dam = DAMFileHelper(period=60.0, n_rois=4)
+        dam._activity_accum[3] = {1: 0.5, 2: 0.0, 3: 1.25, 4: 0.0}
+        dam._last_positions[2] = 10 + 4j
+
+        other = DAMFileHelper(period=60.0, n_rois=4)
+        other.set_state(dam.get_state())
+        self.assertEqual(dict(other._activity_accum[3]), dam._activity_accum[3])
+        self.assertEqual(other._last_positions[2], 10 + 4j)
+        self.assertIsNone(other._last_positions[1])
+
+    def test_wrong_n_rois(self):
+        state = DAMFileHelper(n_rois=4).get_state()
+        state["activity"] = np.zeros((1, 3))
+        with self.assertRaises(ValueError):
+            DAMFileHelper(n_rois=4).set_state(state)
+
+
+class TestStateCheckpointer(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._path = os.path.join(self._dir, "state", "tracking_state.npz")
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_save_load(self):
+        ckpt = StateCheckpointer(self._path, period=1)
+        self.assertTrue(ckpt.is_due(0))
+        ckpt.save(0, {"roi_1.mean": np.arange(6.0).reshape(2, 3), "roi_1.last_time_point": 42})
+        self.assertFalse(ckpt.is_due(500))
+        self.assertTrue(ckpt.is_due(1000))
+        ckpt.close()
+
+        self.assertEqual(ckpt.n_saved, 1)
+        self.assertFalse(os.path.exists(self._path + ".tmp"))
+        state = StateCheckpointer.load(self._path)
+        self.assertEqual(state["t"], 0)
+        self.assertEqual(state["roi_1.last_time_point"], 42)
+        np.testing.assert_array_equal(state["roi_1.mean"], np.arange(6.0).reshape(2, 3))
+
+    def test_remove(self):
+        ckpt = StateCheckpointer(self._path)
+        ckpt.save(0, {"a": 1})
+        ckpt.close()
+        ckpt = StateCheckpointer(self._path)
+        ckpt.close(remove=True)
+        self.assertFalse(os.path.exists(self._path))
+        self.assertIsNone(StateCheckpointer.load(self._path))
+
+    def test_corrupted(self):
+        os.makedirs(os.path.dirname(self._path))
+        with open(self._path, "wb") as f:
+            f.write(b"not a checkpoint")
+        self.assertIsNone(StateCheckpointer.load(self._path))
+
+
+class RecordingCheckpointer(object):
+    def __init__(self):
+        self.states = []
+
+    def is_due(self, t):
+        return True
+
+    def save(self, t, state):
+        self.states.append(state)
+
+
+class TestParallelMonitorState(unittest.TestCase):
+    def setUp(self):
+        fg_model = AdaptiveBGModel.fg_model
+        self.addCleanup(setattr, AdaptiveBGModel, "fg_model", fg_model)
+
+    def _run(self, n_frames, state=None):
+        from ethoscope.core.parallel_monitor import ParallelMonitor
+        from ethoscope.drawers.drawers import NullDrawer
+        from ethoscope.hardware.input.cameras import SyntheticArenaCamera
+
+        AdaptiveBGModel.fg_model = ObjectModel()
+        cam = SyntheticArenaCamera(n_rois=4, target_resolution=(320, 240), n_frames=n_frames)
+        monitor = ParallelMonitor(cam, AdaptiveBGModel, cam.rois, n_workers=2)
+        if state is not None:
+            self.assertEqual(monitor.set_state(state), 4)
+        checkpointer = RecordingCheckpointer()
+        monitor.set_checkpointer(checkpointer)
+        monitor.run(drawer=NullDrawer())
+        return checkpointer.states
+
+    def test_resume_in_workers(self):
+        state = self._run(40)[-1]
+        # the models live in the workers, and each worker has its own foreground model
+        for idx in range(1, 5):
+            self.assertIn("roi_%i.bg_mean" % idx, state)
+        n_rows = [int(state["shared.worker_%i.fg_ring_buff_idx" % i]) for i in range(2)]
+        self.assertTrue(all([n > 20 for n in n_rows]))
+
+        first = self._run(3, state)[0]
+        # the workers resumed from the state, rather than from scratch
+        for i in range(2):
+            self.assertGreaterEqual(int(first["shared.worker_%i.fg_ring_buff_idx" % i]), n_rows[i])
+        self.assertEqual(float(first["roi_1.bg_half_life"]), float(state["roi_1.bg_half_life"]))
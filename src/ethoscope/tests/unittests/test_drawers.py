@@ -0,0 +1,104 @@
+__author__ = 'quentin'
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import cv2
+import numpy as np
+
+from ethoscope.core.roi import ROI
+from ethoscope.core.tracking_unit import TrackingUnit
+from ethoscope.core.data_point import DataPoint
+from ethoscope.core.variables import XPosVariable, YPosVariable, WidthVariable, HeightVariable, PhiVariable
+from ethoscope.drawers.drawers import DefaultDrawer
+from ethoscope.trackers.adaptive_bg_tracker import AdaptiveBGModel
+
+
+class TestLazyDrawer(unittest.TestCase):
+
+    def setUp(self):
+        rois = [ROI(np.array([(10, 10 + 60 * i), (290, 10 + 60 * i), (290, 50 + 60 * i), (10, 50 + 60 * i)]), idx=i + 1)
+                for i in range(3)]
+        self._units = [TrackingUnit(AdaptiveBGModel, r, None) for r in rois]
+        self._frame = np.full((200, 300), 200, np.uint8)
+        pos = DataPoint([XPosVariable(100), YPosVariable(30), WidthVariable(20), HeightVariable(8), PhiVariable(0)])
+        self._positions = {1: [pos], 2: [], 3: []}
+
+    @staticmethod
+    def _green(img):
+        return (img[:, :, 1] > 150) & (img[:, :, 0] < 80) & (img[:, :, 2] < 80)
+
+    @staticmethod
+    def _red(img):
+        return (img[:, :, 2] > 150) & (img[:, :, 0] < 80) & (img[:, :, 1] < 80)
+
+    def test_lazy_rendering(self):
+        drawer = DefaultDrawer()
+        drawer.draw(self._frame, self._units, self._positions)
+        self.assertIsNone(drawer._rendered)
+
+        out = drawer.last_drawn_frame
+        self.assertEqual(out.shape, (200, 300, 3))
+        # the frame is rendered once, and not modified
+        self.assertIs(drawer.last_drawn_frame, out)
+        self.assertTrue(np.all(self._frame == 200))
+
+        # ROI outlines (green) and the animal (red) are drawn
+        self.assertTrue(np.any(self._green(out)))
+        self.assertTrue(np.any(self._red(out[20:40, 85:115])))
+
+    def test_roi_layer_cached(self):
+        drawer = DefaultDrawer()
+        drawer.draw(self._frame, self._units, self._positions)
+        first = drawer.last_drawn_frame
+        layer = drawer._roi_layer[1]
+
+        drawer.draw(self._frame, self._units, {})
+        second = drawer.last_drawn_frame
+        self.assertIs(drawer._roi_layer[1], layer)
+        # the ROIs are the same, but the animal is gone
+        mask = drawer._roi_layer[2].astype(bool)
+        np.testing.assert_array_equal(first[mask], second[mask])
+        self.assertFalse(np.any(self._red(second)))
+
+    def test_nothing_drawn(self):
+        self.assertIsNone(DefaultDrawer().last_drawn_frame)
+
+    def test_frame_reused(self):
+        drawer = DefaultDrawer()
+        frame = self._frame.copy()
+        drawer.draw(frame, self._units, {})
+        # nothing reads the frame, so it is not copied
+        self.assertIsNone(drawer._copy)
+
+        # another thread reads the frame whilst the camera overwrites it with the next one
+        out = []
+        poll = threading.Thread(target=lambda: out.append(drawer.last_drawn_frame))
+        frame[:] = 0
+        poll.start()
+        while poll.is_alive():
+            frame[:] = 200
+            drawer.draw(frame, self._units, {})
+            frame[:] = 0
+            poll.join(0.01)
+        self.assertTrue(np.all(out[0][~drawer._roi_layer[2].astype(bool)] == 200))
+
+    def test_video_rate(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, "out.avi")
+        drawer = DefaultDrawer(path, draw_frames=False, video_out_fps=2)
+        # 2 s of frames at 10 fps, processed much faster than real time
+        for i in range(20):
+            drawer.draw(self._frame, self._units, self._positions, t=i * 100)
+        drawer._video_writer.release()
+
+        cap = cv2.VideoCapture(path)
+        n = 0
+        while cap.read()[0]:
+            n += 1
+        cap.release()
+        self.assertEqual(n, 4)
@@ -0,0 +1,94 @@
+__author__ = 'quentin'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+
+from ethoscope.hardware.input.camera_settings import ExposureController
+from ethoscope.hardware.input.cameras import DummyPiCameraAsync
+
+
+class SimulatedSensor(object):
+    """
+    A sensor whose response is proportional to the gain, and saturates
+    """
+    def __init__(self, gain, scene, lag=2):
+        self._scene = scene
+        self._gains = [gain] * (lag + 1)
+
+    def set_gain(self, gain):
+        self._gains.append(gain)
+
+    def frame(self):
+        # a new gain only applies after a few frames
+        gain = self._gains.pop(0) if len(self._gains) > 1 else self._gains[0]
+        return np.clip(self._scene * gain, 0, 255).astype(np.uint8)
+
+
+class TestExposureController(unittest.TestCase):
+    _scene = np.tile(np.linspace(2, 40, 64), (48, 1))
+
+    def _run(self, band, gain, bounds=(1, 16), n_frames=100):
+        sensor = SimulatedSensor(gain, self._scene)
+        controller = ExposureController(band, gain, bounds)
+        for i in range(n_frames):
+            value = controller.update(sensor.frame(), t=i * 0.5)
+            if value is not None:
+                sensor.set_gain(value)
+            if controller.done:
+                break
+        return controller, sensor
+
+    def test_converges(self):
+        for band, gain in [((140, 190), 1.0), ((20, 40), 12.0), ((140, 190), 16.0)]:
+            controller, sensor = self._run(band, gain)
+            self.assertTrue(controller.converged)
+            result = controller.result
+            self.assertTrue(band[0] <= result["mean"] <= band[1])
+            self.assertTrue(band[0] <= np.mean(sensor.frame()) <= band[1])
+            self.assertLessEqual(result["n_steps"], 5)
+            self.assertGreater(result["duration"], 0)
+
+    def test_saturation(self):
+        # the mean of a saturated frame underestimates the response. The bracket keeps the gain from oscillating
+        controller, _ = self._run((200, 230), 1.0, bounds=(1, 64))
+        self.assertTrue(controller.converged)
+        self.assertLessEqual(controller.result["n_steps"], 10)
+
+    def test_unreachable(self):
+        controller, _ = self._run((140, 190), 1.0, bounds=(1, 2))
+        self.assertTrue(controller.done)
+        self.assertFalse(controller.converged)
+        self.assertAlmostEqual(controller.value, 2, places=2)
+        self.assertIsNone(controller.update(self._scene.astype(np.uint8)))
+
+
+class TestConvergeExposure(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._path = os.path.join(self._dir, "video.avi")
+        writer = cv2.VideoWriter(self._path, cv2.VideoWriter_fourcc(*"MJPG"), 10, (160, 120))
+        for i in range(20):
+            writer.write(np.full((120, 160, 3), 30, dtype=np.uint8))
+        writer.release()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_camera(self):
+        cam = DummyPiCameraAsync(target_fps=50, path=self._path)
+        try:
+            result = cam.converge_exposure("target_detection", (140, 190), timeout=10)
+            self.assertTrue(result["converged"])
+            # the frames that follow are within the band
+            for i, (t, frame) in cam:
+                self.assertTrue(140 <= np.mean(frame) <= 190)
+                if i == 3:
+                    break
+        finally:
+            cam._close()
@@ -0,0 +1,73 @@
+__author__ = 'quentin'
+
+import unittest
+
+import cv2
+import numpy as np
+from scipy import ndimage
+
+from ethoscope.core.roi import ROI
+from ethoscope.trackers.adaptive_bg_tracker import AdaptiveBGModel
+from ethoscope.trackers.trackers import NoPositionError
+
+
+def reference(tracker, fg, fg_backup, hull):
+    # the position, the ellipse and the masked foreground, as they were computed over the whole ROI
+    (x, y), (w, h), angle = cv2.minAreaRect(hull)
+    if w < h:
+        angle -= 90
+        w, h = h, w
+    angle = angle % 180
+    ellipse = tracker.object_mask(x=x, y=y, w=w, h=h, angle=angle, roi=fg)
+    backup = cv2.bitwise_and(fg_backup, fg)
+    cv2.bitwise_and(backup, ellipse, backup)
+    y, x = ndimage.center_of_mass(backup)
+    return int(round(x)), int(round(y)), ellipse, backup
+
+
+class TestExtractFeatures(unittest.TestCase):
+
+    def setUp(self):
+        roi = ROI(np.array([(0, 0), (300, 0), (300, 60), (0, 60)]), idx=1)
+        self._tracker = AdaptiveBGModel(roi)
+        self._tracker.live_tracking = False
+        self._tracker._old_pos = 0.0 + 0.0j
+
+    def test_same_as_whole_roi(self):
+        rng = np.random.RandomState(6)
+        for i in range(50):
+            fg = np.zeros((61, 301), np.uint8)
+            centre = (int(rng.randint(0, 301)), int(rng.randint(0, 61)))
+            axes = (int(rng.randint(3, 20)), int(rng.randint(2, 8)))
+            cv2.ellipse(fg, centre, axes, int(rng.randint(0, 180)), 0, 360, 255, -1)
+            fg = cv2.bitwise_and(fg, rng.randint(21, 256, fg.shape).astype(np.uint8))
+            # a second, smaller, blob that is partly in the ellipse of the first one
+            cv2.circle(fg, (centre[0] + axes[0], centre[1]), 2, 90, -1)
+
+            self._tracker._buff_fg = fg.copy()
+            hull, _ = self._tracker.get_hull()
+            # as the background model does, before the features are extracted
+            cv2.dilate(self._tracker._buff_fg, None, self._tracker._buff_fg)
+            x, y, ellipse, backup = reference(self._tracker, self._tracker._buff_fg, fg, hull)
+
+            try:
+                point = self._tracker.extract_features(hull)[0]
+            except NoPositionError:
+                continue
+            self.assertEqual((point["x"], point["y"]), (x, y))
+            np.testing.assert_array_equal(self._tracker.ellipse, ellipse)
+            np.testing.assert_array_equal(self._tracker._buff_fg_backup, backup)
+
+    def test_buffers_reused(self):
+        fg = np.zeros((61, 301), np.uint8)
+        cv2.ellipse(fg, (100, 30), (12, 5), 20, 0, 360, 200, -1)
+        self._tracker._buff_fg = fg.copy()
+        hull, _ = self._tracker.get_hull()
+        self._tracker.extract_features(hull)
+        backup, ellipse_fg = self._tracker._fg_backup, self._tracker._buff_ellipse_fg
+
+        self._tracker._buff_fg = fg.copy()
+        hull, _ = self._tracker.get_hull()
+        self._tracker.extract_features(hull)
+        self.assertIs(self._tracker._fg_backup, backup)
+        self.assertIs(self._tracker._buff_ellipse_fg, ellipse_fg)
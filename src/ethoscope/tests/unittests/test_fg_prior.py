@@ -0,0 +1,96 @@
+__author__ = 'quentin'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+
+from ethoscope.core.roi import ROI
+from ethoscope.trackers.adaptive_bg_tracker import ObjectModel, AdaptiveBGModel
+
+
+def fly(length, grey=40):
+    img = np.full((100, 100, 3), 200, dtype=np.uint8)
+    contour = cv2.ellipse2Poly((50, 50), (length, length // 3), 30, 0, 360, 10).reshape(-1, 1, 2)
+    cv2.drawContours(img, [contour], -1, (grey, grey, grey), -1)
+    return img, contour
+
+
+class TestForegroundPrior(unittest.TestCase):
+    _history_length = 20
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._path = os.path.join(self._dir, "fg_prior.npz")
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _learn(self, model, n, t0=0):
+        for i in range(n):
+            img, contour = fly(10 + i % 3, grey=35 + 5 * (i % 3))
+            model.update(img, contour, t0 + i * 500)
+
+    def test_saved_as_learnt(self):
+        model = ObjectModel(self._history_length)
+        model.use_prior(self._path)
+        self.assertFalse(model.is_ready)
+        self._learn(model, self._history_length - 1)
+        self.assertFalse(os.path.exists(self._path))
+        # the prior is saved once the history is full
+        self._learn(model, 1)
+        self.assertTrue(model.is_ready)
+        self.assertTrue(os.path.exists(self._path))
+
+    def test_ready_from_prior(self):
+        model = ObjectModel(self._history_length)
+        self._learn(model, self._history_length)
+        model.save_prior(self._path)
+
+        new_model = ObjectModel(self._history_length)
+        new_model.use_prior(self._path, weight=100)
+        self.assertTrue(new_model.is_ready)
+        like = new_model.compute_features(*fly(11))
+        unlike = new_model.compute_features(*fly(16, grey=60))
+        self.assertLess(new_model.distance(like, 0), 5.5)
+        self.assertGreater(new_model.distance(unlike, 0), 5.5)
+        # the prior survives a reset
+        new_model.distance(like, 10 * 60 * 1000)
+        self.assertTrue(new_model.is_ready)
+
+    def test_live_data_override_prior(self):
+        model = ObjectModel(self._history_length)
+        self._learn(model, self._history_length)
+        model.save_prior(self._path)
+
+        new_model = ObjectModel(self._history_length)
+        new_model.use_prior(self._path, weight=100)
+        # the animals of this run are larger
+        for i in range(self._history_length):
+            img, contour = fly(20 + i % 3, grey=80 + 5 * (i % 3))
+            new_model.update(img, contour, i * 500)
+        large = new_model.compute_features(*fly(21, grey=85))
+        small = new_model.compute_features(*fly(11))
+        self.assertLess(new_model.distance(large, 10000), new_model.distance(small, 10000))
+
+    def test_incompatible_prior(self):
+        with open(self._path, "wb") as f:
+            f.write(b"not a prior")
+        model = ObjectModel(self._history_length)
+        model.use_prior(self._path)
+        self.assertFalse(model.is_ready)
+
+    def test_tracker_argument(self):
+        fg_model = AdaptiveBGModel.fg_model
+        self.addCleanup(setattr, AdaptiveBGModel, "fg_model", fg_model)
+        model = ObjectModel(self._history_length)
+        self._learn(model, self._history_length)
+        model.save_prior(self._path)
+
+        AdaptiveBGModel.fg_model = ObjectModel(self._history_length)
+        roi = ROI(np.array([(0, 0), (100, 0), (100, 100), (0, 100)]), idx=1)
+        AdaptiveBGModel(roi, fg_prior_path=self._path, fg_prior_weight=50)
+        self.assertTrue(AdaptiveBGModel.fg_model.is_ready)
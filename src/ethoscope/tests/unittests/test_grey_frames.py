@@ -0,0 +1,35 @@
+__author__ = 'quentin'
+
+import unittest
+
+import cv2
+import numpy as np
+
+from ethoscope.trackers.adaptive_bg_tracker import ObjectModel
+from ethoscope.utils.img_proc import to_grey, to_bgr
+
+
+class TestGreyFrames(unittest.TestCase):
+
+    def setUp(self):
+        self._grey = np.full((60, 200), 200, np.uint8)
+        cv2.ellipse(self._grey, ((80, 30), (24, 10), 30), 40, -1)
+        self._bgr = cv2.cvtColor(self._grey, cv2.COLOR_GRAY2BGR)
+        contours, _ = cv2.findContours(255 - cv2.threshold(self._grey, 100, 255, cv2.THRESH_BINARY)[1],
+                                       cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        self._contour = contours[0]
+
+    def test_to_grey(self):
+        dst = np.zeros_like(self._grey)
+        np.testing.assert_array_equal(to_grey(self._bgr), self._grey)
+        np.testing.assert_array_equal(to_grey(self._grey, dst), self._grey)
+        self.assertIsNot(to_grey(self._grey), self._grey)
+
+    def test_to_bgr(self):
+        np.testing.assert_array_equal(to_bgr(self._grey), self._bgr)
+        self.assertIsNot(to_bgr(self._bgr), self._bgr)
+
+    def test_features_same_for_grey_and_bgr(self):
+        features_bgr = ObjectModel().compute_features(self._bgr, self._contour)
+        features_grey = ObjectModel().compute_features(self._grey, self._contour)
+        np.testing.assert_array_equal(features_bgr, features_grey)
@@ -0,0 +1,144 @@
+__author__ = 'quentin'
+
+import unittest
+
+import cv2
+import numpy as np
+
+from ethoscope.core.monitor import Monitor
+from ethoscope.core.roi import ROI
+from ethoscope.drawers.drawers import NullDrawer
+from ethoscope.hardware.input.cameras import SyntheticArenaCamera
+from ethoscope.trackers.adaptive_bg_tracker import AdaptiveBGModel
+from ethoscope.utils.img_proc import AffineRemapper, RoiPacker, PackedFrame, to_bgr
+
+
+class TestAffineRemapper(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self._img = cv2.GaussianBlur(rng.integers(0, 255, (240, 320), dtype=np.uint8), (5, 5), 2)
+        self._M = cv2.getRotationMatrix2D((160, 120), 4.0, 1.0)
+        self._rectangles = [(20, 30, 100, 40), (150, 120, 120, 60)]
+
+    def _reference(self, interpolation):
+        return cv2.warpAffine(self._img, self._M, self._img.shape[::-1], flags=interpolation, borderMode=cv2.BORDER_REPLICATE)
+
+    def _roi_diffs(self, name, flag):
+        out = AffineRemapper(self._M, self._img.shape, self._rectangles, name).apply(self._img)
+        ref = self._reference(flag)
+        return [np.abs(out[y: y + h, x: x + w].astype(np.int16) - ref[y: y + h, x: x + w]) for x, y, w, h in self._rectangles]
+
+    def test_same_as_warp_affine_in_rois(self):
+        for name, flag in [("cubic", cv2.INTER_CUBIC), ("linear", cv2.INTER_LINEAR)]:
+            for diff in self._roi_diffs(name, flag):
+                self.assertLessEqual(diff.max(), 1, name)
+
+    def test_nearest(self):
+        # rounding can pick a neighbouring pixel, exactly in between two pixels
+        for diff in self._roi_diffs("nearest", cv2.INTER_NEAREST):
+            self.assertLess(np.count_nonzero(diff) / float(diff.size), 0.01)
+
+    def test_outside_rois_is_black(self):
+        out = AffineRemapper(self._M, self._img.shape, self._rectangles).apply(self._img)
+        self.assertEqual(out.shape, self._img.shape)
+        self.assertEqual(out[0:30, :].max(), 0)
+        self.assertEqual(out[:, 270:].max(), 0)
+
+    def test_full(self):
+        remapper = AffineRemapper(self._M, self._img.shape, self._rectangles)
+        out = remapper.apply(self._img, full=True)
+        diff = np.abs(out.astype(np.int16) - self._reference(cv2.INTER_CUBIC))
+        self.assertLessEqual(diff.max(), 1)
+        # the next frames are only rotated where the ROIs are, and keep the rest of the last full frame
+        out = remapper.apply(255 - self._img).copy()
+        np.testing.assert_array_equal(out[0:30, :], self._reference(cv2.INTER_CUBIC)[0:30, :])
+        x, y, w, h = self._rectangles[0]
+        self.assertGreater(np.mean(np.abs(out[y: y + h, x: x + w].astype(np.int16) - self._img[y: y + h, x: x + w])), 10)
+
+    def test_colour_frames(self):
+        img = cv2.cvtColor(self._img, cv2.COLOR_GRAY2BGR)
+        out = AffineRemapper(self._M, img.shape, self._rectangles).apply(img)
+        self.assertEqual(out.shape, img.shape)
+
+    def test_unknown_interpolation(self):
+        self.assertRaises(ValueError, AffineRemapper, self._M, self._img.shape, self._rectangles, "lanczos")
+
+
+class RecordingQualityControl(object):
+    def __init__(self):
+        self.frames = []
+
+    def qc(self, frame):
+        self.frames.append(frame.copy())
+        return {}
+
+    def write(self, t, qc):
+        pass
+
+
+class TestRotatedMonitor(unittest.TestCase):
+
+    def test_quality_control_sees_entire_frames(self):
+        cam = SyntheticArenaCamera(n_rois=2, target_resolution=(320, 240), n_frames=20)
+        M = cv2.getRotationMatrix2D((160, 120), 3.0, 1.0)
+        quality_controller = RecordingQualityControl()
+        monitor = Monitor(cam, AdaptiveBGModel, cam.rois)
+        monitor.run(drawer=NullDrawer(), quality_controller=quality_controller, M=M)
+        # the first frame is only used to show the ROIs
+        self.assertEqual(len(quality_controller.frames), 19)
+        outside = np.ones((240, 320), bool)
+        for x, y, w, h in [roi.rectangle for roi in cam.rois]:
+            outside[y: y + h, x: x + w] = False
+        self.assertTrue(np.any(outside))
+        # the synthetic arena has no black pixels, and neither has its rotation
+        self.assertTrue(all([f[outside].min() > 0 for f in quality_controller.frames]))
+
+
+class TestRoiPacker(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        self._img = rng.integers(0, 255, (120, 160), dtype=np.uint8)
+        # the first two overlap, the last one is partly out of the frame
+        self._rectangles = [(10, 10, 40, 30), (40, 20, 30, 30), (100, 80, 20, 20), (150, 110, 20, 20)]
+
+    def test_layout(self):
+        packer = RoiPacker(self._rectangles, self._img.shape)
+        self.assertEqual([b[0:4] for b in packer.blocks], [(10, 10, 60, 40), (100, 80, 20, 20), (150, 110, 10, 10)])
+        self.assertEqual(packer.size, 60 * 40 + 20 * 20 + 10 * 10)
+        self.assertAlmostEqual(packer.coverage, packer.size / (120.0 * 160))
+
+    def test_crop(self):
+        packer = RoiPacker(self._rectangles, self._img.shape)
+        buffer = np.zeros(packer.size, dtype=np.uint8)
+        packer.pack(self._img, buffer)
+        frame = PackedFrame(buffer, packer, np.zeros_like(self._img))
+        roi = ROI(np.array([(40, 20), (69, 20), (69, 49), (40, 49)]), idx=1)
+        packed, mask = roi.apply(frame)
+        ref, _ = roi.apply(self._img)
+        np.testing.assert_array_equal(packed, ref)
+        # the crop is read from the buffer, not copied
+        self.assertTrue(np.shares_memory(packed, buffer))
+
+    def test_to_frame(self):
+        packer = RoiPacker(self._rectangles, self._img.shape)
+        colour = cv2.cvtColor(self._img, cv2.COLOR_GRAY2BGR)
+        buffer = np.zeros((packer.size, 3), dtype=np.uint8)
+        packer.pack(colour, buffer)
+        background = np.zeros_like(colour)
+        frame = PackedFrame(buffer, packer, background)
+        self.assertEqual(frame.shape, colour.shape)
+        out = to_bgr(frame)
+        for x, y, w, h, _ in packer.blocks:
+            np.testing.assert_array_equal(out[y:y + h, x:x + w], colour[y:y + h, x:x + w])
+        # pixels outside the blocks come from the background
+        self.assertEqual(out[0, 0].tolist(), [0, 0, 0])
+
+    def test_pack_converts(self):
+        packer = RoiPacker(self._rectangles, self._img.shape)
+        colour = cv2.cvtColor(self._img, cv2.COLOR_GRAY2BGR)
+        buffer = np.zeros(packer.size, dtype=np.uint8)
+        packer.pack(colour, buffer, cv2.COLOR_BGR2GRAY)
+        x, y, w, h, o = packer.blocks[1]
+        np.testing.assert_array_equal(buffer[o:o + w * h].reshape(h, w), self._img[y:y + h, x:x + w])
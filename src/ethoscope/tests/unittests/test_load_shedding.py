@@ -0,0 +1,95 @@
+__author__ = 'quentin'
+
+import unittest
+
+from ethoscope.core.load_shedding import LoadShedder
+from ethoscope.stimulators.stimulators import DefaultStimulator, BaseStimulator
+
+
+class Unit(object):
+    def __init__(self, idx, stimulator):
+        self.roi = type("ROI", (), {"idx": idx})()
+        self.stimulator = stimulator
+
+
+class Writer(object):
+    def __init__(self):
+        self._insert_dict = {}
+        self.tables = {}
+
+    def _create_table(self, name, fields, engine=None):
+        self.tables[name] = fields
+
+
+class TestLoadShedder(unittest.TestCase):
+    _n_units = 6
+
+    def _units(self, stimulated=()):
+        return [Unit(i + 1, BaseStimulator(None) if i in stimulated else DefaultStimulator(None))
+                for i in range(self._n_units)]
+
+    def _run(self, shedder, n_frames=100, cost=0.2, interval=100):
+        """
+        Simulate frames arriving every ``interval`` ms, a whole frame costing ``cost`` s to track
+        """
+        out = []
+        for i in range(n_frames):
+            active = shedder.select(i, i * interval)
+            out.append(active)
+            if active is not None:
+                shedder.update(cost * sum(active) / float(len(active)), active)
+        return out
+
+    def test_no_shedding_when_fast(self):
+        shedder = LoadShedder("uniform")
+        shedder.bind(self._units())
+        out = self._run(shedder, cost=0.05)
+        self.assertTrue(all([a is not None and all(a) for a in out]))
+        self.assertEqual(shedder.stats["dropped_frames"], 0)
+
+    def test_uniform(self):
+        shedder = LoadShedder("uniform")
+        writer = Writer()
+        shedder.bind(self._units(), writer)
+        out = self._run(shedder)
+        kept = [a is not None for a in out[-50:]]
+        # about 0.9 * 100 / 200 of the frames fit in the budget
+        self.assertTrue(18 <= sum(kept) <= 27)
+        self.assertEqual(shedder.stats["dropped_frames"], out.count(None))
+
+        shedder.write(writer)
+        self.assertIn("DROPPED_FRAMES", writer.tables)
+        rows = writer._insert_dict["DROPPED_FRAMES"]
+        self.assertEqual(rows.count("'load'"), out.count(None))
+
+    def test_round_robin(self):
+        shedder = LoadShedder("round_robin")
+        shedder.bind(self._units())
+        out = self._run(shedder)
+        self.assertTrue(all([a is not None for a in out]))
+        # every ROI keeps being tracked, in turns
+        last = out[-20:]
+        for j in range(self._n_units):
+            self.assertTrue(any([a[j] for a in last]))
+        self.assertTrue(all([sum(a) < self._n_units for a in last]))
+
+    def test_stimulated_rois_always_tracked(self):
+        shedder = LoadShedder("stimulated")
+        shedder.bind(self._units(stimulated=(2,)))
+        out = self._run(shedder)
+        self.assertTrue(all([a[2] for a in out]))
+        self.assertTrue(any([not all(a) for a in out]))
+
+    def test_camera_losses(self):
+        shedder = LoadShedder("uniform", max_latency=1000)
+        writer = Writer()
+        shedder.bind(self._units(), writer)
+        shedder.select(0, 0, camera_lost=0)
+        shedder.select(1, 100, camera_lost=3)
+        shedder.select(2, 200, camera_lost=3)
+        shedder.write(writer)
+        self.assertEqual(shedder.stats["camera_lost"], 3)
+        self.assertEqual(writer._insert_dict["DROPPED_FRAMES"], "INSERT INTO DROPPED_FRAMES VALUES (100, 1, 0, 3, 'camera')")
+
+    def test_unknown_policy(self):
+        self.assertRaises(ValueError, LoadShedder, "random")
@@ -0,0 +1,55 @@
+__author__ = 'quentin'
+
+import unittest
+
+import cv2
+import numpy as np
+
+from ethoscope.core.roi import ROI
+from ethoscope.trackers.motion_gated_tracker import MotionGatedAdaptiveBGModel
+
+
+class TestMotionGatedAdaptiveBGModel(unittest.TestCase):
+
+    def setUp(self):
+        self._roi = ROI(np.array([(10, 10), (410, 10), (410, 60), (10, 60)]), idx=1)
+        self._rng = np.random.default_rng(1)
+
+    def _frame(self, x):
+        img = np.full((80, 420), 200, np.uint8)
+        cv2.ellipse(img, ((10 + x, 35), (20, 8), 0), 40, -1)
+        return cv2.add(img, self._rng.integers(0, 4, img.shape, dtype=np.uint8))
+
+    def _run(self, tracker, positions):
+        out = []
+        for i, x in enumerate(positions):
+            out.append(tracker.track(i * 200, self._frame(x)))
+        return out
+
+    def test_still_animal_is_gated(self):
+        tracker = MotionGatedAdaptiveBGModel(self._roi)
+        positions = [60 + 10 * i for i in range(20)] + [260] * 20
+        out = self._run(tracker, positions)
+
+        last = out[-1][0]
+        self.assertEqual(last["is_motion_gated"], 1)
+        self.assertEqual(last["is_inferred"], 0)
+        self.assertEqual(last["xy_dist_log10x1000"], round(np.log10(1. / self._roi.rectangle[2]) * 1000))
+        self.assertTrue(abs(last["x"] - 260) <= 2)
+        self.assertGreater(tracker.validation_report["n_gated"], 10)
+
+    def test_moving_animal_is_tracked(self):
+        tracker = MotionGatedAdaptiveBGModel(self._roi)
+        positions = [60 + 10 * i for i in range(30)]
+        out = self._run(tracker, positions)
+        self.assertEqual(tracker.validation_report["n_gated"], 0)
+        self.assertEqual(out[-1][0]["is_motion_gated"], 0)
+
+    def test_validation_mode(self):
+        tracker = MotionGatedAdaptiveBGModel(self._roi, validate="TRUE")
+        positions = [60 + 10 * i for i in range(20)] + [260] * 20
+        out = self._run(tracker, positions)
+        # the full tracking is always returned
+        self.assertEqual(out[-1][0]["is_motion_gated"], 0)
+        self.assertGreater(tracker.validation_report["n_gated"], 10)
+        self.assertEqual(tracker.validation_report["n_disagreements"], 0)
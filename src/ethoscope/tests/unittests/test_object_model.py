@@ -0,0 +1,158 @@
+__author__ = 'quentin'
+
+import unittest
+
+import cv2
+import numpy as np
+
+from ethoscope.trackers.adaptive_bg_tracker import ObjectModel
+
+
+def reference_statistics(ring_buff, last_row):
+    # the statistics as they were computed, from the whole history, on every call
+    means = np.mean(ring_buff[:last_row], 0)
+    stds = np.mean(np.abs(ring_buff[:last_row] - means), 0)
+    return means, stds
+
+
+def reference_distance(model, features):
+    last_row = model._history_length if model._is_ready else model._ring_buff_idx + 1
+    means, stds = reference_statistics(model._ring_buff, last_row)
+    likelihoods = np.exp(- (features - means) ** 2 / (2 * stds ** 2)) / (stds * np.sqrt(2 * np.pi))
+    return -np.sum(np.log10(likelihoods)) / len(likelihoods)
+
+
+class FeatureModel(ObjectModel):
+    # features drawn from normal distributions, rather than computed from contours
+    def __init__(self, features, *args, **kwargs):
+        super(FeatureModel, self).__init__(*args, **kwargs)
+        self._features = iter(features)
+
+    def compute_features(self, img, contour):
+        return next(self._features)
+
+
+class TestObjectModel(unittest.TestCase):
+    _means = np.array([2.5, 12.0, 90.0])
+    _stds = np.array([0.1, 2.0, 8.0])
+
+    @staticmethod
+    def _skewed(rng, n):
+        # exponentially distributed features, with a few outliers (e.g. two animals merged in one contour)
+        features = np.array([2.0, 8.0, 40.0]) + rng.exponential([0.3, 3.0, 10.0], (n, 3))
+        outliers = rng.rand(n) < 0.02
+        features[outliers] *= 4
+        return features
+
+    def _model(self, n, history_length=1000, skewed=False):
+        rng = np.random.RandomState(3)
+        features = self._skewed(rng, n) if skewed else rng.normal(self._means, self._stds, (n, 3))
+        model = FeatureModel(features, history_length)
+        for i in range(n):
+            model.update(None, None, i * 100)
+        return model
+
+    def test_same_statistics(self):
+        for skewed in [False, True]:
+            for n in [10, 500, 1000, 3500]:
+                model = self._model(n, skewed=skewed)
+                last_row = model._history_length if model._is_ready else model._ring_buff_idx + 1
+                means, stds = model._statistics(last_row)
+                ref_means, ref_stds = reference_statistics(model._ring_buff, last_row)
+                np.testing.assert_allclose(means, ref_means, rtol=1e-5)
+                np.testing.assert_allclose(stds, ref_stds, rtol=1e-5)
+
+    def test_same_distance(self):
+        for skewed in [False, True]:
+            model = self._model(2500, skewed=skewed)
+            rng = np.random.RandomState(4)
+            candidates = self._skewed(rng, 50) if skewed else rng.normal(self._means, 3 * self._stds, (50, 3))
+            for features in candidates:
+                self.assertAlmostEqual(model.distance(features, 2500 * 100), reference_distance(model, features), places=4)
+
+    def test_statistics_per_frame(self):
+        model = self._model(1500, skewed=True)
+        features = np.array([2.5, 10.0, 50.0])
+        before = model.distance(features, 1500 * 100)
+        # the ROIs update the model in turn, during the same frame: its candidates are still scored alike
+        model._features = iter(self._skewed(np.random.RandomState(5), 10) * 3)
+        for i in range(10):
+            model.update(None, None, 1500 * 100)
+        self.assertEqual(model.distance(features, 1500 * 100), before)
+        # the next frame sees the updated history
+        self.assertAlmostEqual(model.distance(features, 1501 * 100), reference_distance(model, features), places=4)
+        self.assertNotAlmostEqual(model.distance(features, 1501 * 100), before, places=4)
+
+    def test_constant_features(self):
+        model = FeatureModel([np.array([np.log10(37.), 5.0, 100.3])] * 100, 100)
+        for i in range(100):
+            model.update(None, None, i * 100)
+        self.assertEqual(model.distance(np.array([1.0, 2.0, 3.0]), 100 * 100), 0)
+
+    def test_state(self):
+        model = self._model(1500)
+        other = ObjectModel(1000)
+        other.set_state(model.get_state())
+        np.testing.assert_array_equal(other._ring_buff, model._ring_buff)
+        features = self._means + self._stds
+        self.assertAlmostEqual(other.distance(features, 1500 * 100), model.distance(features, 1500 * 100))
+
+
+class TestBatchFeatures(unittest.TestCase):
+
+    def _blobs(self, shape, n, seed):
+        rng = np.random.RandomState(seed)
+        img = rng.randint(100, 256, shape + (3,)).astype(np.uint8)
+        fg = np.zeros(shape, np.uint8)
+        for i in range(n):
+            centre = (20 + 40 * i, shape[0] // 2)
+            axes = (int(rng.randint(4, 15)), int(rng.randint(3, 8)))
+            cv2.ellipse(img, centre, axes, int(rng.randint(0, 180)), 0, 360, (30, 40, 50), -1)
+            cv2.ellipse(fg, centre, axes, int(rng.randint(0, 180)), 0, 360, 255, -1)
+        contours, _ = cv2.findContours(fg, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        return img, [cv2.approxPolyDP(c, 1.2, True) for c in contours]
+
+    def test_same_features(self):
+        model = ObjectModel()
+        # the model is shared by ROIs of different sizes
+        for shape, n, seed in [((60, 300), 6, 1), ((40, 200), 4, 2), ((60, 300), 6, 3)]:
+            img, contours = self._blobs(shape, n, seed)
+            expected = np.array([model.compute_features(img, c) for c in contours])
+            np.testing.assert_allclose(model.compute_features_batch(img, contours), expected, rtol=1e-9)
+            grey = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            np.testing.assert_allclose(model.compute_features_batch(grey, contours), expected, rtol=1e-9)
+
+    def test_close_blobs(self):
+        model = ObjectModel()
+        rng = np.random.RandomState(4)
+        img = rng.randint(100, 256, (40, 60, 3)).astype(np.uint8)
+        fg = np.zeros((40, 60), np.uint8)
+        # two interlocked L shaped blobs, one pixel apart, of different greys
+        for (x0, y0, x1, y1), grey in [((10, 10, 30, 14), 20), ((10, 10, 14, 30), 20),
+                                       ((16, 26, 40, 30), 90), ((36, 16, 40, 30), 90)]:
+            cv2.rectangle(img, (x0, y0), (x1, y1), (grey, grey, grey), -1)
+            cv2.rectangle(fg, (x0, y0), (x1, y1), 255, -1)
+        contours, _ = cv2.findContours(fg, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        self.assertEqual(len(contours), 2)
+        # their convex hulls overlap
+        for contours in [contours, [cv2.convexHull(c) for c in contours]]:
+            expected = np.array([model.compute_features(img, c) for c in contours])
+            np.testing.assert_allclose(model.compute_features_batch(img, contours), expected, rtol=1e-9)
+
+    def test_same_distances(self):
+        rng = np.random.RandomState(5)
+        model = FeatureModel(rng.normal([2.0, 8.0, 40.0], [0.2, 2.0, 5.0], (200, 3)), 100)
+        for i in range(200):
+            model.update(None, None, i * 100)
+        candidates = rng.normal([2.0, 8.0, 40.0], [0.6, 6.0, 15.0], (20, 3))
+        candidates[0] = [9, 90, 250]
+        means, stds = model._statistics(100)
+        expected = []
+        # one candidate at a time, as distance used to be computed
+        for f in candidates:
+            likelihoods = np.exp(- (f - means) ** 2 / (2 * stds ** 2)) / (stds * np.sqrt(2 * np.pi))
+            expected.append(0 if np.any(likelihoods == 0) else -np.sum(np.log10(likelihoods)) / len(likelihoods))
+        np.testing.assert_allclose(model.distances(candidates, 200 * 100), expected, rtol=1e-6)
+        self.assertAlmostEqual(model.distance(candidates[1], 200 * 100), expected[1], places=5)
+        # candidates that are infinitely unlikely cannot be scored
+        self.assertEqual(expected[0], 0)
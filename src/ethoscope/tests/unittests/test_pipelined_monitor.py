@@ -0,0 +1,91 @@
+__author__ = 'quentin'
+
+import threading
+import time
+import unittest
+
+from ethoscope.core.pipelined_monitor import StageQueue, PipelinedMonitor
+from ethoscope.drawers.drawers import NullDrawer
+from ethoscope.hardware.input.cameras import SyntheticArenaCamera
+from ethoscope.trackers.adaptive_bg_tracker import AdaptiveBGModel
+
+
+class TestStageQueue(unittest.TestCase):
+
+    def setUp(self):
+        self._stop = threading.Event()
+
+    def _fill(self, policy):
+        q = StageQueue("test", maxsize=2, policy=policy)
+        for i in range(5):
+            q.push(i, self._stop)
+        return q, [q.get_nowait() for _ in range(q.qsize())]
+
+    def test_drop_oldest(self):
+        q, items = self._fill("drop_oldest")
+        self.assertEqual(items, [3, 4])
+        self.assertEqual(q.dropped, 3)
+
+    def test_drop_newest(self):
+        q, items = self._fill("drop_newest")
+        self.assertEqual(items, [0, 1])
+        self.assertEqual(q.dropped, 3)
+
+    def test_block_gives_up_when_stopped(self):
+        q = StageQueue("test", maxsize=1, policy="block")
+        q.push(0, self._stop)
+        self._stop.set()
+        q.push(1, self._stop)
+        self.assertEqual(q.dropped, 0)
+        self.assertEqual(q.get_nowait(), 0)
+        self.assertIsNone(q.pull(self._stop))
+
+    def test_close_never_drops_end_signal(self):
+        q = StageQueue("test", maxsize=1, policy="block")
+        q.push(0, self._stop)
+        self._stop.set()
+        q.close(self._stop)
+        self.assertIsNone(q.get_nowait())
+
+    def test_unknown_policy(self):
+        self.assertRaises(ValueError, StageQueue, "test", 2, "drop_all")
+
+
+class SlowQualityControl(object):
+    def __init__(self):
+        self.ts = []
+
+    def qc(self, frame):
+        time.sleep(0.02)
+        return {}
+
+    def write(self, t, qc):
+        self.ts.append(t)
+
+
+class TestPipelinedMonitor(unittest.TestCase):
+
+    def _monitor(self, **kwargs):
+        cam = SyntheticArenaCamera(n_rois=2, target_resolution=(320, 240), n_frames=1000)
+        return PipelinedMonitor(cam, AdaptiveBGModel, cam.rois, **kwargs)
+
+    def test_stop_saves_tracked_frames(self):
+        monitor = self._monitor(queue_size=16)
+        quality_controller = SlowQualityControl()
+        th = threading.Thread(target=monitor.run, kwargs={"drawer": NullDrawer(), "quality_controller": quality_controller})
+        th.start()
+        # tracking is faster than writing, so frames wait in the writing queue
+        while monitor.info["queued_in_stages"].get("writing", 0) < 8:
+            time.sleep(0.01)
+        monitor.stop()
+        th.join()
+        self.assertLess(monitor.last_frame_idx, 1000)
+        # every tracked frame is written, including those still queued when the monitor was stopped
+        self.assertEqual(quality_controller.ts[-1], monitor.last_time_stamp * 1000)
+        self.assertEqual(len(quality_controller.ts), monitor.last_frame_idx - 1)
+
+    def test_policies(self):
+        monitor = self._monitor(policies="drawing:drop_newest, writing:drop_oldest")
+        self.assertEqual(monitor._policies, {"tracking": "block", "writing": "drop_oldest", "drawing": "drop_newest"})
+        self.assertEqual(self._monitor(policies={"tracking": "drop_oldest"})._policies["tracking"], "drop_oldest")
+        self.assertRaises(ValueError, self._monitor, policies="display:block")
@@ -0,0 +1,121 @@
+__author__ = 'quentin'
+
+import unittest
+
+from ethoscope.core.profiler import LatencyHistogram, Profiler, NullProfiler, DurationRecorder
+from ethoscope.trackers.adaptive_bg_tracker import AdaptiveBGModel, ObjectModel
+
+
+class RecordingWriter(object):
+    def __init__(self):
+        self.tables = {}
+        self.commands = []
+
+    def _create_table(self, name, fields, engine=None):
+        self.tables[name] = fields
+
+    def _write_async_command(self, command, args=None):
+        self.commands.append(command)
+
+
+class TestLatencyHistogram(unittest.TestCase):
+
+    def test_quantiles(self):
+        hist = LatencyHistogram()
+        for _ in range(90):
+            hist.add(0.001)
+        for _ in range(10):
+            hist.add(0.1)
+
+        s = hist.summary()
+        self.assertEqual(s["n"], 100)
+        self.assertAlmostEqual(s["mean"], 10.9, places=3)
+        self.assertAlmostEqual(s["max"], 100.0, places=3)
+        # quantiles are given by the bins, within ~30%
+        self.assertTrue(1.0 <= s["p50"] < 1.34)
+        self.assertTrue(75.0 <= s["p95"] <= 100.0)
+
+    def test_out_of_range(self):
+        hist = LatencyHistogram()
+        hist.add(0.0)
+        hist.add(60.0)
+        self.assertEqual(sum(hist.counts), 2)
+        self.assertEqual(hist.counts[-1], 1)
+        self.assertEqual(hist.quantile(1.0), 60.0)
+
+    def test_merge(self):
+        a, b = LatencyHistogram(), LatencyHistogram()
+        a.add(0.001)
+        b.add(0.002)
+        b.add(0.003)
+        a.merge(b)
+        self.assertEqual(a.n, 3)
+        self.assertEqual(sum(a.counts), 3)
+
+
+class TestProfiler(unittest.TestCase):
+
+    def test_lap_and_summary(self):
+        prof = Profiler()
+        for roi_idx in (1, 2, 3):
+            t0 = prof.now()
+            t0 = prof.lap("roi_crop", t0, roi_idx)
+            prof.lap("tracker", t0, roi_idx)
+        prof.lap("tracking", prof.now())
+
+        summary = prof.summary()
+        self.assertEqual(sorted(summary.keys()), ["roi_crop", "tracker", "tracking"])
+        self.assertEqual(summary["tracker"]["n"], 3)
+        self.assertEqual(len(prof.summary(per_roi=True)), 7)
+
+    def test_write(self):
+        prof = Profiler()
+        prof.lap("tracker", prof.now(), 1)
+        prof.lap("drawing", prof.now())
+        writer = RecordingWriter()
+        prof.write(writer)
+        self.assertIn("PROFILE", writer.tables)
+        self.assertEqual(len(writer.commands), 2)
+        self.assertTrue(all([c.startswith("INSERT INTO PROFILE VALUES") for c in writer.commands]))
+
+    def test_null_profiler(self):
+        prof = NullProfiler()
+        self.assertIsNone(prof.lap("tracker", prof.now(), 1))
+        self.assertEqual(prof.summary(), {})
+
+    def test_duration_recorder(self):
+        rec = DurationRecorder()
+        t0 = rec.lap("roi_crop", rec.now(), 2)
+        rec.lap("tracker", t0, 2)
+        durations = rec.pop()
+        self.assertEqual([(s, r) for s, r, _ in durations], [("roi_crop", 2), ("tracker", 2)])
+        self.assertEqual(rec.pop(), [])
+
+        prof = Profiler()
+        for stage, roi_idx, dt in durations:
+            prof.add(stage, dt, roi_idx)
+        self.assertEqual(sorted(prof.summary(per_roi=True).keys()), ["roi_crop_2", "tracker_2"])
+
+
+class TestParallelProfile(unittest.TestCase):
+    def setUp(self):
+        fg_model = AdaptiveBGModel.fg_model
+        self.addCleanup(setattr, AdaptiveBGModel, "fg_model", fg_model)
+
+    def test_rois_timed_in_workers(self):
+        from ethoscope.core.parallel_monitor import ParallelMonitor
+        from ethoscope.drawers.drawers import NullDrawer
+        from ethoscope.hardware.input.cameras import SyntheticArenaCamera
+
+        AdaptiveBGModel.fg_model = ObjectModel()
+        cam = SyntheticArenaCamera(n_rois=4, target_resolution=(320, 240), n_frames=30)
+        monitor = ParallelMonitor(cam, AdaptiveBGModel, cam.rois, n_workers=2, profile=True)
+        monitor.run(drawer=NullDrawer())
+
+        per_roi = monitor.profiler.summary(per_roi=True)
+        n_frames = per_roi["tracking_0"]["n"]
+        self.assertGreater(n_frames, 0)
+        for roi in cam.rois:
+            self.assertEqual(per_roi["roi_crop_%i" % roi.idx]["n"], n_frames)
+            self.assertEqual(per_roi["tracker_%i" % roi.idx]["n"], n_frames)
+        self.assertEqual(monitor.info["profile"]["tracker"]["n"], 4 * n_frames)
@@ -0,0 +1,175 @@
+__author__ = 'quentin'
+
+import multiprocessing
+import os
+import queue
+import shutil
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+
+from ethoscope.core.roi import ROI
+from ethoscope.hardware.input.cameras import DummyPiCameraAsync
+from ethoscope.hardware.input.ring_buffer import FrameRingBuffer, RoiFramePublisher
+from ethoscope.utils.img_proc import PackedFrame, full_frame
+
+
+def _produce(buffer, n):
+    for i in range(n):
+        buffer.put(np.full(buffer.shape, i, np.uint8), float(i))
+    buffer.close()
+
+
+class TestFrameRingBuffer(unittest.TestCase):
+
+    def setUp(self):
+        self._shape = (4, 6)
+
+    def _frame(self, value):
+        return np.full(self._shape, value, np.uint8)
+
+    def test_in_order(self):
+        buffer = FrameRingBuffer(self._shape, n_slots=3)
+        try:
+            buffer.put(self._frame(1), 10.0)
+            buffer.put(self._frame(2), 20.0)
+            seq, t, frame = buffer.get(timeout=1)
+            self.assertEqual((seq, t, frame[0, 0]), (1, 10.0, 1))
+            self.assertFalse(frame.flags.writeable)
+            seq, t, frame = buffer.get(timeout=1)
+            self.assertEqual((seq, t, frame[0, 0]), (2, 20.0, 2))
+            self.assertRaises(queue.Empty, buffer.get, 0.05)
+        finally:
+            buffer.close()
+
+    def test_overwrite(self):
+        buffer = FrameRingBuffer(self._shape, n_slots=3, policy="overwrite")
+        try:
+            for i in range(1, 6):
+                buffer.put(self._frame(i))
+            self.assertEqual(buffer.stats["overwritten"], 2)
+            self.assertEqual([buffer.get(timeout=1)[0] for _ in range(3)], [3, 4, 5])
+        finally:
+            buffer.close()
+
+    def test_drop(self):
+        buffer = FrameRingBuffer(self._shape, n_slots=3, policy="drop")
+        try:
+            results = [buffer.put(self._frame(i)) for i in range(1, 6)]
+            self.assertEqual(results, [1, 2, 3, None, None])
+            self.assertEqual(buffer.stats["dropped"], 2)
+            self.assertEqual(buffer.get(timeout=1)[0], 1)
+        finally:
+            buffer.close()
+
+    def test_leased_slot_not_overwritten(self):
+        buffer = FrameRingBuffer(self._shape, n_slots=2)
+        try:
+            buffer.put(self._frame(1))
+            _, _, frame = buffer.get(timeout=1)
+            for i in range(2, 6):
+                buffer.put(self._frame(i))
+            self.assertEqual(frame[0, 0], 1)
+        finally:
+            buffer.close()
+
+    def test_latest(self):
+        buffer = FrameRingBuffer(self._shape, n_slots=4)
+        try:
+            for i in range(1, 4):
+                buffer.put(self._frame(i))
+            seq, _, frame = buffer.get(timeout=1, latest=True)
+            self.assertEqual((seq, frame[0, 0]), (3, 3))
+            self.assertEqual(buffer.stats["skipped"], 2)
+            self.assertEqual(buffer.stats["pending"], 0)
+        finally:
+            buffer.close()
+
+    def test_other_process(self):
+        buffer = FrameRingBuffer(self._shape, n_slots=8, policy="drop")
+        try:
+            p = multiprocessing.Process(target=_produce, args=(buffer, 5))
+            p.start()
+            p.join(10)
+            values = [buffer.get(timeout=1)[2][0, 0] for _ in range(5)]
+            self.assertEqual(values, list(range(5)))
+        finally:
+            buffer.close()
+
+
+class TestRoiFramePublisher(unittest.TestCase):
+
+    def test_packed_frames(self):
+        buffer = FrameRingBuffer((40, 60), n_slots=4)
+        try:
+            publisher = RoiFramePublisher(buffer, full_frame_period=10)
+            frame = np.arange(40 * 60, dtype=np.uint8).reshape(40, 60)
+            publisher.publish(frame, 0.0)
+            publisher.set_layout([(5, 5, 10, 10)])
+            for t in (1.0, 2.0, 12.0):
+                publisher.publish(frame, t)
+
+            tags = []
+            for _ in range(4):
+                _, _, out = buffer.get(timeout=1)
+                tags.append(buffer.last_tag)
+            # a complete frame follows the new layout, then complete frames are sent every full_frame_period
+            self.assertEqual(tags, [0, 0, RoiFramePublisher.packed_tag, 0])
+        finally:
+            buffer.close()
+
+    def test_packed_content(self):
+        buffer = FrameRingBuffer((40, 60), n_slots=4)
+        try:
+            publisher = RoiFramePublisher(buffer)
+            publisher.set_layout([(5, 5, 10, 10)])
+            frame = np.arange(40 * 60, dtype=np.uint8).reshape(40, 60)
+            publisher.publish(frame, 0.0)
+            publisher.publish(frame, 1.0)
+            buffer.get(timeout=1)
+            _, _, out = buffer.get(timeout=1)
+            self.assertEqual(buffer.last_tag, RoiFramePublisher.packed_tag)
+            np.testing.assert_array_equal(out.reshape(-1)[:100].reshape(10, 10), frame[5:15, 5:15])
+        finally:
+            buffer.close()
+
+
+class TestRoiCroppedCamera(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._path = os.path.join(self._dir, "video.avi")
+        writer = cv2.VideoWriter(self._path, cv2.VideoWriter_fourcc(*"MJPG"), 10, (160, 120))
+        for i in range(50):
+            frame = np.full((120, 160, 3), 3 * i, dtype=np.uint8)
+            frame[:, :80] = 200
+            writer.write(frame)
+        writer.release()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_camera(self):
+        rois = [ROI(np.array([(10, 10), (60, 10), (60, 50), (10, 50)]), idx=1),
+                ROI(np.array([(40, 30), (100, 30), (100, 70), (40, 70)]), idx=2)]
+        cam = DummyPiCameraAsync(target_fps=50, path=self._path)
+        try:
+            for i, (t, frame) in cam:
+                break
+            self.assertIsInstance(frame, np.ndarray)
+            cam.set_tracker(rois)
+            packed = []
+            for i, (t, frame) in cam:
+                if isinstance(frame, PackedFrame):
+                    packed.append(frame)
+                    sub_img, _ = rois[1].apply(frame)
+                    full = full_frame(frame)
+                    np.testing.assert_array_equal(sub_img, full[30:71, 40:101])
+                    self.assertEqual(full.shape, (120, 160, 3))
+                if len(packed) >= 3:
+                    break
+            self.assertEqual(len(packed), 3)
+        finally:
+            cam._close()
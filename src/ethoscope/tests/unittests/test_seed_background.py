@@ -0,0 +1,85 @@
+__author__ = 'quentin'
+
+import math
+import unittest
+
+import numpy as np
+
+from ethoscope.core.monitor import Monitor
+from ethoscope.drawers.drawers import NullDrawer
+from ethoscope.hardware.input.cameras import SyntheticArenaCamera
+from ethoscope.trackers.adaptive_bg_tracker import AdaptiveBGModel, ObjectModel
+
+
+def walk(t, idx):
+    # flies walk back and forth, so the median of a few frames shows an empty arena
+    return 0.5 + 0.35 * math.sin(math.pi * t + idx), 0.5
+
+
+class TestSeedBackground(unittest.TestCase):
+
+    def setUp(self):
+        # the foreground model is shared by all trackers, so it must not have learnt from other tests
+        fg_model = AdaptiveBGModel.fg_model
+        AdaptiveBGModel.fg_model = ObjectModel()
+        self.addCleanup(setattr, AdaptiveBGModel, "fg_model", fg_model)
+
+    def _run(self, seed_frames):
+        AdaptiveBGModel.fg_model = ObjectModel()
+        cam = SyntheticArenaCamera(n_rois=4, target_resolution=(640, 480), n_frames=150, motion=walk)
+        monitor = Monitor(cam, AdaptiveBGModel, cam.rois, seed_frames=seed_frames)
+        monitor.run(drawer=NullDrawer())
+        return monitor
+
+    def test_tracker(self):
+        cam = SyntheticArenaCamera(n_rois=1, target_resolution=(320, 240), n_frames=40, motion=walk)
+        frames = [(t, f.copy()) for _, (t, f) in cam]
+        # five frames spread over a period of the walk
+        reference = np.median(np.stack([f for _, f in frames[::8]]), axis=0).astype(np.uint8)
+
+        tracker = AdaptiveBGModel(cam.rois[0])
+        self.assertIsNone(tracker.time_to_first_position)
+        self.assertTrue(tracker.seed_background(reference, frames[0][0]))
+        self.assertEqual(len(tracker.track(*frames[0])), 1)
+        self.assertEqual(tracker.time_to_first_position, 0)
+
+    def test_monitor(self):
+        seeded = self._run(5)
+        delays = seeded.time_to_first_position
+        self.assertEqual(sorted(delays.keys()), [1, 2, 3, 4])
+        # positions are found in the first frames, which are tracked after seeding
+        self.assertTrue(all([d is not None and d <= 100 for d in delays.values()]))
+        self.assertEqual(seeded.last_frame_idx, 150)
+        self.assertEqual(seeded.info["time_to_first_position"]["n_waiting"], 0)
+
+        unseeded = self._run(0)
+        self.assertGreater(np.median(list(unseeded.time_to_first_position.values())), np.median(list(delays.values())))
+
+    def test_default_off(self):
+        cam = SyntheticArenaCamera(n_rois=1, target_resolution=(320, 240), n_frames=5)
+        self.assertEqual(Monitor(cam, AdaptiveBGModel, cam.rois)._seed_frames, 0)
+
+    def test_restored_state_survives_run(self):
+        warm = self._run(0)
+        state = warm.get_state()
+        roi_bg = {idx: state["roi_%i.bg_mean" % idx].copy() for idx in [1, 2, 3, 4]}
+        # the foreground model, shared by all the ROIs, is saved once
+        self.assertIn("shared.fg_ring_buff", state)
+        self.assertEqual([k for k in state.keys() if k.startswith("roi_") and ".fg_" in k], [])
+
+        AdaptiveBGModel.fg_model = ObjectModel()
+        cam = SyntheticArenaCamera(n_rois=4, target_resolution=(640, 480), n_frames=150, motion=walk)
+        resumed = Monitor(cam, AdaptiveBGModel, cam.rois, seed_frames=5)
+        self.assertEqual(resumed.set_state(state), 4)
+        tracker = resumed._unit_trackers[0].tracker
+        # a reference frame does not replace a restored background
+        reference = np.full((480, 640, 3), 255, dtype=np.uint8)
+        self.assertEqual(resumed.seed_background(reference, 0), 0)
+        np.testing.assert_array_equal(tracker._bg_model.bg_img, roi_bg[tracker._roi.idx])
+
+        seeded = []
+        seed_background = resumed.seed_background
+        resumed.seed_background = lambda frame, t: seeded.append(seed_background(frame, t)) or seeded[-1]
+        resumed.run(drawer=NullDrawer())
+        self.assertEqual(seeded, [0])
+        self.assertEqual(resumed.last_frame_idx, 150)
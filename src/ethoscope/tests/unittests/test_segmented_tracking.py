@@ -0,0 +1,172 @@
+__author__ = 'quentin'
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+
+from ethoscope.core.roi import ROI
+from ethoscope.core.segmented_tracking import plan_segments, merge_segment_dbs, track_segments, VideoSegment
+from ethoscope.hardware.input.cameras import MovieVirtualCamera, VideoSegmentCamera
+from ethoscope.trackers.adaptive_bg_tracker import AdaptiveBGModel
+
+
+class TestSegments(unittest.TestCase):
+    _n_frames = 40
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._path = os.path.join(self._dir, "video.avi")
+        writer = cv2.VideoWriter(self._path, cv2.VideoWriter_fourcc(*"MJPG"), 10, (64, 48))
+        for i in range(self._n_frames):
+            writer.write(np.full((48, 64, 3), 5 * i, dtype=np.uint8))
+        writer.release()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _frames(self, cam):
+        out = [(i, t, int(frame[0, 0, 0])) for i, (t, frame) in cam]
+        cam._close()
+        return out
+
+    def test_plan(self):
+        segments = plan_segments(self._path, n_segments=4, warmup=0.5)
+        self.assertEqual(len(segments), 4)
+        self.assertEqual(segments[0].parts, [(self._path, 0, 10, 0, 0)])
+        # five frames of warm-up
+        self.assertEqual(segments[1].parts, [(self._path, 5, 20, 0, 0)])
+        self.assertIsNone(segments[-1].end_t)
+        for a, b in zip(segments[:-1], segments[1:]):
+            self.assertEqual(a.end_t, b.start_t)
+
+    def test_segments_cover_the_video(self):
+        ref = self._frames(MovieVirtualCamera(self._path))
+        segments = plan_segments(self._path, n_segments=3, warmup=0.5)
+        out = []
+        for s in segments:
+            frames = self._frames(VideoSegmentCamera(s.parts))
+            # indices and time stamps are those of the whole video
+            self.assertTrue(all([f in ref for f in frames]))
+            out += [f for f in frames if f[1] >= s.start_t and (s.end_t is None or f[1] < s.end_t)]
+        self.assertEqual(out, ref)
+
+    def test_several_parts(self):
+        parts = [(self._path, 30, 40, 0, 0), (self._path, 0, 10, 40, 4000)]
+        frames = self._frames(VideoSegmentCamera(parts))
+        self.assertEqual([f[0] for f in frames], list(range(31, 41)) + list(range(41, 51)))
+        self.assertEqual(frames[10][1], 4000)
+
+    def test_resume(self):
+        cam = VideoSegmentCamera([(self._path, 0, 20, 0, 0)])
+        for i, _ in cam:
+            break
+        # a new iteration continues after the last frame read, as with other cameras
+        self.assertEqual([i for i, _ in cam], list(range(2, 21)))
+        cam._close()
+
+
+class TestMergeSegments(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _make_db(self, name, ts, first_id):
+        path = os.path.join(self._dir, name)
+        db = sqlite3.connect(path)
+        db.execute("CREATE TABLE METADATA (field CHAR(100), value VARCHAR(6000))")
+        db.execute("INSERT INTO METADATA VALUES ('machine_id', 'abc')")
+        db.execute("CREATE TABLE ROI_1 (id INT   AUTO_INCREMENT PRIMARY KEY, t INT, x SMALLINT)")
+        for i, t in enumerate(ts):
+            db.execute("INSERT INTO ROI_1 VALUES (?, ?, ?)", (first_id + i, t, t // 100))
+        db.commit()
+        db.close()
+        return path
+
+    def test_merge(self):
+        paths = [self._make_db("a.db", range(0, 1000, 100), 1),
+                 self._make_db("b.db", range(500, 2000, 100), 1)]
+        segments = [VideoSegment(0, [], 0, 1000), VideoSegment(1, [], 1000)]
+        output = os.path.join(self._dir, "out.db")
+        merge_segment_dbs(paths, segments, output)
+
+        db = sqlite3.connect(output)
+        rows = db.execute("SELECT id, t, x FROM ROI_1").fetchall()
+        # the warm-up of the second segment is dropped, and ids follow each other
+        self.assertEqual([r[1] for r in rows], list(range(0, 2000, 100)))
+        self.assertEqual([r[0] for r in rows], list(range(1, 21)))
+        self.assertEqual(db.execute("SELECT * FROM METADATA").fetchall(), [("machine_id", "abc")])
+        db.close()
+
+
+class TestRotatedArena(unittest.TestCase):
+    _n_frames = 60
+    _shape = (160, 240)
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        # the ROI builder would find this rotation, which straightens the arena
+        center = (self._shape[1] / 2.0, self._shape[0] / 2.0)
+        self._M = cv2.getRotationMatrix2D(center, 20, 1.0)
+        inv_M = cv2.getRotationMatrix2D(center, -20, 1.0)
+        self._straight = self._write("straight.avi")
+        self._rotated = self._write("rotated.avi", inv_M)
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _write(self, name, M=None):
+        path = os.path.join(self._dir, name)
+        h, w = self._shape
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 5, (w, h))
+        for i in range(self._n_frames):
+            rng = np.random.RandomState(i)
+            frame = np.full((h, w, 3), 200, dtype=np.uint8)
+            frame = cv2.add(frame, rng.randint(0, 10, frame.shape).astype(np.uint8))
+            cv2.ellipse(frame, (60 + (i * 2) % 120, 80), (8, 4), 0, 0, 360, (20, 20, 20), -1)
+            if M is not None:
+                frame = cv2.warpAffine(frame, M, (w, h), borderMode=cv2.BORDER_REPLICATE)
+            writer.write(frame)
+        writer.release()
+        return path
+
+    def _track(self, path, M):
+        # each segment is tracked in its own process, so the shared foreground model starts afresh
+        rois = [ROI(np.array([(50, 55), (190, 55), (190, 105), (50, 105)]), idx=1)]
+        output = os.path.join(self._dir, "out.db")
+        segments = plan_segments(path, n_segments=1, warmup=0)
+        track_segments(segments, output, AdaptiveBGModel, rois, jobs=1, M=M)
+        db = sqlite3.connect(output)
+        rows = db.execute("SELECT t, x, y FROM ROI_1 ORDER BY t").fetchall()
+        db.close()
+        return {t: (x, y) for t, x, y in rows}
+
+    def test_segment_files(self):
+        rois = [ROI(np.array([(50, 55), (190, 55), (190, 105), (50, 105)]), idx=1)]
+        tmp_dir = os.path.join(self._dir, "tmp")
+        segments = plan_segments(self._straight, n_segments=2, warmup=0)
+        track_segments(segments, os.path.join(self._dir, "out.db"), AdaptiveBGModel, rois, jobs=1, tmp_dir=tmp_dir)
+        self.assertEqual(os.listdir(tmp_dir), [])
+
+        track_segments(segments, os.path.join(self._dir, "kept.db"), AdaptiveBGModel, rois, jobs=1, tmp_dir=tmp_dir,
+                       keep_segments=True)
+        # the databases of the segments are kept together, in a directory of their own
+        kept = os.listdir(tmp_dir)
+        self.assertEqual(len(kept), 1)
+        self.assertEqual(sorted(os.listdir(os.path.join(tmp_dir, kept[0]))), ["segment_00000.db", "segment_00001.db"])
+
+    def test_rotated_frames(self):
+        ref = self._track(self._straight, None)
+        out = self._track(self._rotated, self._M)
+        ts = sorted(set(ref.keys()) & set(out.keys()))
+        self.assertGreater(len(ts), self._n_frames // 2)
+        # the animal is found where it is in the straight arena
+        for t in ts:
+            self.assertLessEqual(abs(ref[t][0] - out[t][0]), 2)
+            self.assertLessEqual(abs(ref[t][1] - out[t][1]), 2)
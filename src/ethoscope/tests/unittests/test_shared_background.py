@@ -0,0 +1,85 @@
+__author__ = 'quentin'
+
+import math
+import unittest
+
+import numpy as np
+
+from ethoscope.core.monitor import Monitor
+from ethoscope.core.roi import ROI
+from ethoscope.drawers.drawers import NullDrawer
+from ethoscope.hardware.input.cameras import SyntheticArenaCamera
+from ethoscope.trackers.adaptive_bg_tracker import AdaptiveBGModel, ArenaBackgroundModel, BackgroundModel, ObjectModel
+from ethoscope.utils.debug import EthoscopeException
+
+
+def rectangle(x, y, w, h, idx):
+    return ROI(np.array([(x, y), (x + w, y), (x + w, y + h), (x, y + h)]), idx=idx)
+
+
+def walk(t, idx):
+    return 0.5 + 0.35 * math.sin(math.pi * t + idx), 0.5
+
+
+class TestArenaBackgroundModel(unittest.TestCase):
+
+    def test_same_as_roi_by_roi(self):
+        rng = np.random.RandomState(2)
+        rois = [rectangle(10, 20, 60, 30, 1), rectangle(80, 20, 60, 30, 2)]
+        arena = ArenaBackgroundModel(rois)
+        shared = [arena.roi_model(r) for r in rois]
+        separate = [BackgroundModel() for _ in rois]
+
+        for i in range(30):
+            t = i * 500
+            for j, (s, b) in enumerate(zip(shared, separate)):
+                img = rng.randint(0, 256, (31, 61)).astype(np.uint8)
+                fg = np.zeros_like(img)
+                fg[5:10, 10 + i:15 + i] = 200
+                # the ROIs learn at their own rate
+                if (i + j) % 3 == 0:
+                    s.increase_learning_rate()
+                    b.increase_learning_rate()
+                s.update(img, t, fg.copy())
+                b.update(img, t, fg.copy())
+            arena.update()
+            for s, b in zip(shared, separate):
+                np.testing.assert_allclose(s.bg_img, b.bg_img, atol=1e-2)
+                self.assertLessEqual(np.abs(s.bg_img_u8.astype(int) - b.bg_img_u8).max(), 1)
+
+    def test_overlap(self):
+        with self.assertRaises(EthoscopeException):
+            ArenaBackgroundModel([rectangle(10, 20, 60, 30, 1), rectangle(50, 20, 60, 30, 2)])
+
+
+class TestSharedBackground(unittest.TestCase):
+
+    def setUp(self):
+        fg_model = AdaptiveBGModel.fg_model
+        self.addCleanup(setattr, AdaptiveBGModel, "fg_model", fg_model)
+
+    def _run(self, shared_background):
+        AdaptiveBGModel.fg_model = ObjectModel()
+        cam = SyntheticArenaCamera(n_rois=4, target_resolution=(640, 480), n_frames=60, motion=walk)
+        monitor = Monitor(cam, AdaptiveBGModel, cam.rois, shared_background=shared_background)
+        monitor.run(drawer=NullDrawer())
+        return monitor
+
+    def test_monitor(self):
+        shared = self._run("TRUE")
+        self.assertIsNotNone(shared._shared_background)
+        separate = self._run("FALSE")
+        self.assertIsNone(separate._shared_background)
+        self.assertEqual(len(separate.last_positions), 4)
+        for idx, pos in separate.last_positions.items():
+            self.assertEqual(len(pos), 1)
+            self.assertEqual(len(shared.last_positions[idx]), 1)
+            for p, q in zip(shared.last_positions[idx], pos):
+                self.assertAlmostEqual(p["x"], q["x"], delta=1)
+                self.assertAlmostEqual(p["y"], q["y"], delta=1)
+
+    def test_overlapping_rois(self):
+        cam = SyntheticArenaCamera(n_rois=2, target_resolution=(320, 240), n_frames=5)
+        rois = [rectangle(10, 20, 60, 30, 1), rectangle(50, 20, 60, 30, 2)]
+        monitor = Monitor(cam, AdaptiveBGModel, rois, shared_background="TRUE")
+        self.assertIsNone(monitor._shared_background)
@@ -0,0 +1,81 @@
+__author__ = 'quentin'
+
+import time
+import unittest
+
+import numpy as np
+
+from ethoscope.hardware.input.cameras import SyntheticArenaCamera
+from ethoscope.trackers.adaptive_bg_tracker import AdaptiveBGModel, ObjectModel
+
+
+class TestSyntheticArenaCamera(unittest.TestCase):
+
+    def test_layout(self):
+        cam = SyntheticArenaCamera(n_rois=20, n_columns=2, n_frames=3)
+        self.assertEqual(len(cam.rois), 20)
+        frames = [(i, t, f.shape) for i, (t, f) in cam]
+        self.assertEqual(frames, [(1, 0, (960, 1280, 3)), (2, 50, (960, 1280, 3)), (3, 100, (960, 1280, 3))])
+        for roi in cam.rois:
+            x, y = cam.ground_truth[roi.idx]
+            rx, ry, rw, rh = roi.rectangle
+            self.assertTrue(rx <= x <= rx + rw and ry <= y <= ry + rh)
+
+    def test_reproducible(self):
+        def run():
+            cam = SyntheticArenaCamera(n_rois=4, target_resolution=(320, 240), n_frames=50, record_ground_truth=True, seed=3)
+            frames = [f.copy() for _, (_, f) in cam]
+            return frames, cam.ground_truth_history
+
+        frames_a, truth_a = run()
+        frames_b, truth_b = run()
+        np.testing.assert_array_equal(frames_a[-1], frames_b[-1])
+        np.testing.assert_array_equal(truth_a[-1][2], truth_b[-1][2])
+        self.assertEqual(len(truth_a), 50)
+
+    def test_scripted_motion(self):
+        cam = SyntheticArenaCamera(n_rois=2, target_resolution=(320, 240), n_frames=10, noise=0, light_drift=0,
+                                   motion=lambda t, idx: (0.1 * t, 0.5))
+        cam.set_grey()
+        for i, (t, frame) in cam:
+            pass
+        x, y = cam.ground_truth[1]
+        rx, ry, rw, rh = cam.rois[0].rectangle
+        self.assertAlmostEqual(x, rx + 0.1 * 0.45 * rw)
+        self.assertAlmostEqual(y, ry + 0.5 * rh)
+        # the fly is darker than the arena
+        self.assertLess(frame[int(y), int(x)], 100)
+
+    def test_tracking_accuracy(self):
+        # the foreground model is shared by all trackers, so it must not have learnt from other tests
+        fg_model = AdaptiveBGModel.fg_model
+        AdaptiveBGModel.fg_model = ObjectModel()
+        self.addCleanup(setattr, AdaptiveBGModel, "fg_model", fg_model)
+
+        cam = SyntheticArenaCamera(n_rois=4, target_resolution=(640, 480), n_frames=400)
+        trackers = [AdaptiveBGModel(roi) for roi in cam.rois]
+        errors = []
+        for i, (t, frame) in cam:
+            truth = cam.ground_truth
+            for tracker in trackers:
+                positions = tracker.track(t, frame)
+                if i <= 200 or len(positions) == 0:
+                    continue
+                rx, ry, _, _ = tracker._roi.rectangle
+                x, y = positions[0]["x"] + rx, positions[0]["y"] + ry
+                tx, ty = truth[tracker._roi.idx]
+                errors.append(np.hypot(x - tx, y - ty))
+        self.assertGreater(len(errors), 600)
+        self.assertLess(np.median(errors), 2)
+
+    def test_real_time(self):
+        cam = SyntheticArenaCamera(n_rois=2, target_fps=50, target_resolution=(160, 120), n_frames=30, real_time=True)
+        indices = []
+        for i, _ in cam:
+            indices.append(i)
+            if i == 5:
+                time.sleep(0.2)
+        # about ten frames were due while the consumer was busy
+        lost = cam.frame_buffer_stats["overwritten"]
+        self.assertGreaterEqual(lost, 5)
+        self.assertEqual(len(indices) + lost, 30)
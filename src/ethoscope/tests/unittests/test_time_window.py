@@ -0,0 +1,74 @@
+__author__ = 'quentin'
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+
+from ethoscope.hardware.input.cameras import FSLVirtualCamera
+
+try:
+    from ethoscope_node.utils.time_window import TimeWindow
+except ImportError:
+    TimeWindow = None
+
+
+@unittest.skipIf(TimeWindow is None, "the node package (node_src) is not installed")
+class TestAnnotatedTimeWindow(unittest.TestCase):
+    _n_frames = 30
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        # the database is found from the path of the video, as on the node
+        video_dir = os.path.join(self._dir, "videos", "ETHOSCOPE_001", "2020-01-01_10-00-00")
+        db_dir = os.path.join(self._dir, "results", "FLYSLEEPLAB_CV1", "2020-01-01_10-00-00")
+        os.makedirs(video_dir)
+        os.makedirs(db_dir)
+        self._video = os.path.join(video_dir, "whole_2020-01-01_10-00-00_001__64x48@10_00001.avi")
+        writer = cv2.VideoWriter(self._video, cv2.VideoWriter_fourcc(*"MJPG"), 10, (64, 48))
+        for i in range(self._n_frames):
+            writer.write(np.full((48, 64, 3), 200, dtype=np.uint8))
+        writer.release()
+
+        cam = FSLVirtualCamera(self._video, use_wall_clock=False)
+        ts = [t for _, (t, _) in cam]
+        cam._close()
+        db = sqlite3.connect(os.path.join(db_dir, "2020-01-01_10-00-00_001.db"))
+        db.execute("CREATE TABLE ROI_MAP (roi_idx SMALLINT, roi_value SMALLINT, x SMALLINT, y SMALLINT, w SMALLINT, h SMALLINT)")
+        db.execute("INSERT INTO ROI_MAP VALUES (1, 1, 10, 10, 40, 30)")
+        db.execute("CREATE TABLE ROI_1 (id INT, t INT, x SMALLINT, y SMALLINT, w SMALLINT, h SMALLINT, phi SMALLINT, xy_dist_log10x1000 SMALLINT)")
+        for i, t in enumerate(ts):
+            db.execute("INSERT INTO ROI_1 VALUES (?, ?, 20, 15, 12, 6, 0, 0)", (i + 1, t))
+        db.commit()
+        db.close()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_annotated_frames(self):
+        window = TimeWindow(1, 0, 1.5, 1, 1, "", 0, 0, framerate=10, result_dir=self._dir,
+                            input_video=self._video, annotate=True)
+        window.xyshape_pad = window.xyshape
+        frames = []
+        add = window.add
+        window.add = lambda img: frames.append(img.copy()) or add(img)
+
+        cam = FSLVirtualCamera(self._video, use_wall_clock=False)
+        try:
+            window.open(cam)
+            window.run()
+            window.close()
+        finally:
+            cam._close()
+
+        # every frame of the window is written, with the animal drawn (in red)
+        self.assertGreaterEqual(len(frames), 15)
+        self.assertEqual(window._frame_count, len(frames))
+        for img in frames:
+            red = (img[:, :, 2] > 150) & (img[:, :, 0] < 80) & (img[:, :, 1] < 80)
+            self.assertTrue(np.any(red))
+        self.assertTrue(os.path.exists(window.video_path))
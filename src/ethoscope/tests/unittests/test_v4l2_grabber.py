@@ -0,0 +1,85 @@
+__author__ = 'quentin'
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import cv2
+import numpy as np
+
+from ethoscope.hardware.input.cameras import V4L2Camera
+
+
+class FileV4L2Camera(V4L2Camera):
+    """
+    A V4L2 camera reading a video file, which opens without warming up
+    """
+    def _warm_up(self):
+        pass
+
+
+class TestV4L2Grabber(unittest.TestCase):
+    _n_frames = 100
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._path = os.path.join(self._dir, "video.avi")
+        writer = cv2.VideoWriter(self._path, cv2.VideoWriter_fourcc(*"MJPG"), 25, (64, 48))
+        for i in range(self._n_frames):
+            writer.write(np.full((48, 64, 3), 2 * i, dtype=np.uint8))
+        writer.release()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _read(self, cam, delay=0):
+        out = []
+        for i, (t, frame) in cam:
+            out.append((i, t, int(frame[0, 0, 0])))
+            time.sleep(delay)
+        stats = cam.frame_buffer_stats
+        cam._close()
+        return out, stats
+
+    def test_every_frame(self):
+        cam = FileV4L2Camera(self._path, target_fps=1000, target_resolution=(64, 48), n_buffer_slots=8)
+        out, stats = self._read(cam, delay=0.002)
+        self.assertEqual([o[0] for o in out], list(range(1, len(out) + 1)))
+        # frames are read in the order they were acquired, and those the consumer could not keep up with are counted
+        values = [o[2] for o in out]
+        self.assertEqual(values, sorted(values))
+        self.assertEqual(len(out) + stats["overwritten"], stats["kept"])
+        times = [o[1] for o in out]
+        self.assertEqual(times, sorted(times))
+
+    def test_frames_not_copied(self):
+        cam = FileV4L2Camera(self._path, target_fps=1000, target_resolution=(64, 48))
+        try:
+            for i, (t, frame) in cam:
+                # a view on the ring buffer, which consumers may not modify
+                self.assertFalse(frame.flags.writeable)
+                self.assertIsNot(frame, cam._frame)
+                if i == 3:
+                    break
+        finally:
+            cam._close()
+
+    def test_latest(self):
+        cam = FileV4L2Camera(self._path, target_fps=1000, target_resolution=(64, 48), latest=True)
+        out, stats = self._read(cam, delay=0.01)
+        self.assertGreater(stats["skipped"] + stats["overwritten"], 0)
+        self.assertEqual(len(out) + stats["skipped"] + stats["overwritten"], stats["kept"])
+
+    def test_target_fps(self):
+        cam = FileV4L2Camera(self._path, target_fps=10, target_resolution=(64, 48))
+        start = time.time()
+        for i, (t, frame) in cam:
+            if i == 3:
+                break
+        stats = cam.frame_buffer_stats
+        cam._close()
+        # frames are grabbed faster than the target fps, and the excess ones are dropped
+        self.assertGreaterEqual(time.time() - start, 0.2)
+        self.assertGreater(stats["grabbed"], stats["kept"])
@@ -0,0 +1,78 @@
+__author__ = 'quentin'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+
+from ethoscope.hardware.input.cameras import MovieVirtualCamera, FSLVirtualCamera
+from ethoscope.hardware.input.video_index import VideoIndex
+
+
+class TestVideoIndex(unittest.TestCase):
+    _n_frames = 60
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._path = os.path.join(self._dir, "2020-01-01_10-00-00_test.mp4")
+        writer = cv2.VideoWriter(self._path, cv2.VideoWriter_fourcc(*"mp4v"), 10, (64, 48))
+        for i in range(self._n_frames):
+            writer.write(np.full((48, 64, 3), 4 * i, dtype=np.uint8))
+        writer.release()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _read_all(self, cam):
+        out = [(i, t, int(frame[0, 0, 0])) for i, (t, frame) in cam]
+        cam._close()
+        return out
+
+    def test_build(self):
+        index = VideoIndex.build(self._path)
+        self.assertEqual(index.n_frames, self._n_frames)
+        np.testing.assert_allclose(index.pts, np.arange(self._n_frames) * 100.0)
+        self.assertTrue(index.keyframes[0])
+        self.assertEqual(index.frame_at(250), 3)
+        self.assertEqual(index.keyframe_before(0), 0)
+        self.assertLessEqual(index.keyframe_before(45), 45)
+
+    def test_cache(self):
+        index = VideoIndex.load_or_build(self._path)
+        index_path = VideoIndex.index_path(self._path)
+        self.assertTrue(os.path.exists(index_path))
+        cached = VideoIndex.load_or_build(self._path)
+        np.testing.assert_array_equal(cached.pts, index.pts)
+        np.testing.assert_array_equal(cached.keyframes, index.keyframes)
+
+        # a modified video is indexed again
+        with open(self._path, "ab") as f:
+            f.write(b"\0")
+        self.assertFalse(cached.matches(self._path))
+        self.assertTrue(VideoIndex.load_or_build(self._path).matches(self._path))
+
+    def test_seek_frame(self):
+        ref = self._read_all(MovieVirtualCamera(self._path))
+        cam = MovieVirtualCamera(self._path)
+        # backward, forward within a GOP and forward across keyframes
+        for target in [40, 5, 7, 50, 0]:
+            self.assertEqual(cam.seek_frame(target), target)
+            i, (t, frame) = next(iter(cam))
+            self.assertEqual((i, t, int(frame[0, 0, 0])), ref[target])
+        cam._close()
+
+    def test_seek_time(self):
+        ref = self._read_all(FSLVirtualCamera(self._path))
+        cam = FSLVirtualCamera(self._path, prefetch=2)
+        for i, _ in cam:
+            if i > 10:
+                break
+        for t in [1234, 3000, 0]:
+            cam.seek_time(t)
+            frame = next(iter(cam))
+            expected = [f for f in ref if f[1] >= t][0]
+            self.assertEqual((frame[0], frame[1][0], int(frame[1][1][0, 0, 0])), expected)
+        cam._close()
@@ -0,0 +1,110 @@
+__author__ = 'quentin'
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import cv2
+import numpy as np
+
+from ethoscope.hardware.input.cameras import MovieVirtualCamera, FSLVirtualCamera
+
+
+class TestVideoPrefetch(unittest.TestCase):
+    _n_frames = 30
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._path = os.path.join(self._dir, "2020-01-01_10-00-00_test.avi")
+        writer = cv2.VideoWriter(self._path, cv2.VideoWriter_fourcc(*"MJPG"), 10, (64, 48))
+        for i in range(self._n_frames):
+            frame = np.full((48, 64, 3), 8 * i, dtype=np.uint8)
+            writer.write(frame)
+        writer.release()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _read(self, CameraClass, **kwargs):
+        cam = CameraClass(self._path, **kwargs)
+        out = []
+        try:
+            for i, (t, frame) in cam:
+                out.append((i, t, frame.copy()))
+        finally:
+            cam._close()
+        return out
+
+    def _assert_same(self, a, b):
+        self.assertEqual(len(a), len(b))
+        for (ia, ta, fa), (ib, tb, fb) in zip(a, b):
+            self.assertEqual(ia, ib)
+            self.assertEqual(ta, tb)
+            np.testing.assert_array_equal(fa, fb)
+
+    def test_same_frames(self):
+        ref = self._read(MovieVirtualCamera)
+        self.assertEqual(len(ref), self._n_frames)
+        self._assert_same(ref, self._read(MovieVirtualCamera, prefetch=4))
+
+    def test_drop_each(self):
+        ref = self._read(MovieVirtualCamera, drop_each=3)
+        self.assertEqual(len(ref), self._n_frames // 3)
+        cam = MovieVirtualCamera(self._path, prefetch=2, drop_each=3)
+        out = [(i, t, frame.copy()) for i, (t, frame) in cam]
+        stats = cam.decoder_stats
+        cam._close()
+        self._assert_same(ref, out)
+        # skipped frames are grabbed, but not decoded
+        self.assertEqual(stats["decoded"], self._n_frames // 3)
+        self.assertEqual(stats["grabbed"], self._n_frames - self._n_frames // 3)
+
+    def test_max_duration(self):
+        cam = MovieVirtualCamera(self._path, prefetch=2, max_duration=1)
+        out = [i for i, _ in cam]
+        cam._close()
+        self.assertLess(len(out), self._n_frames)
+
+    def test_grey(self):
+        ref = self._read(FSLVirtualCamera, bw=True)
+        out = self._read(FSLVirtualCamera, bw=True, prefetch=4)
+        self.assertEqual(out[0][2].ndim, 2)
+        self._assert_same(ref, out)
+
+    def test_set_grey_whilst_prefetching(self):
+        cam = FSLVirtualCamera(self._path, prefetch=3)
+        try:
+            frames = iter(cam)
+            _, (_, first) = next(frames)
+            self.assertEqual(first.ndim, 3)
+            # the next frames are already decoded, in colour
+            while cam.decoder_stats["pending"] < 3:
+                time.sleep(0.01)
+            cam.set_grey(True)
+            grey = [frame.copy() for _, (_, frame) in frames]
+        finally:
+            cam._close()
+        self.assertEqual(len(grey), self._n_frames - 1)
+        self.assertTrue(all([f.ndim == 2 for f in grey]))
+        for (_, _, ref), frame in zip(self._read(FSLVirtualCamera, bw=True)[1:], grey):
+            np.testing.assert_array_equal(ref, frame)
+
+    def test_monitor_grey_frames(self):
+        from ethoscope.core.monitor import Monitor
+        from ethoscope.core.roi import ROI
+        from ethoscope.drawers.drawers import NullDrawer
+        from ethoscope.trackers.adaptive_bg_tracker import AdaptiveBGModel
+
+        cam = FSLVirtualCamera(self._path, prefetch=3)
+        try:
+            # as when building the ROIs
+            next(iter(cam))
+            rois = [ROI(np.array([(2, 2), (60, 2), (60, 44), (2, 44)]), idx=1)]
+            monitor = Monitor(cam, AdaptiveBGModel, rois, seed_frames=5)
+            monitor.run(drawer=NullDrawer())
+        finally:
+            cam._close()
+        self.assertTrue(cam.is_grey)
+        self.assertEqual(monitor.last_frame_idx, self._n_frames)
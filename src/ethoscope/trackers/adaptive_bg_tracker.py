@@ -2,6 +2,7 @@
 __author__ = 'quentin'
 
 import logging
+import os
 from collections import deque
 from math import log10, sqrt, pi
 import cv2
@@ -13,17 +14,21 @@ except:
 
 
 import numpy as np
-from scipy import ndimage
 from ethoscope.core.variables import XPosVariable, YPosVariable, XYDistance, WidthVariable, HeightVariable, PhiVariable, Label
 from ethoscope.core.data_point import DataPoint
 from ethoscope.trackers.trackers import BaseTracker, NoPositionError
 from ethoscope.utils.debug import EthoscopeException
+from ethoscope.utils.img_proc import to_grey
 
 class ObjectModel(object):
     """
     A class to model, update and predict foreground object (i.e. tracked animal).
     """
     _sqrt_2_pi = sqrt(2.0 * pi)
+    _prior_version = 1
+    # the minimal time between two saves of the prior, in ms
+    _prior_save_period = 10 * 60 * 1000.0
+
     def __init__(self, history_length=1000):
         #fixme this should be time, not number of points!
         self._features_header = [
@@ -34,13 +39,26 @@ class ObjectModel(object):
         ]
 
         self._history_length = history_length
+        # the statistics of a previous run (see use_prior), kept when the model is reset
+        self._prior = None
+        self._prior_weight = 0.0
+        self._prior_path = None
+        self._last_prior_save = None
+        self._reset()
+
+    def _reset(self):
         self._ring_buff = np.zeros((self._history_length, len(self._features_header)), dtype=np.float32, order="F")
         self._std_buff = np.zeros((self._history_length, len(self._features_header)), dtype=np.float32, order="F")
+        # the statistics of the current frame: (time, means, stds)
+        self._frame_statistics = None
         self._ring_buff_idx = 0
         self._is_ready = False
         self._roi_img_buff = None
         self._mask_img_buff = None
         self._img_buff_shape = np.array([0, 0])
+        # flat buffers, large enough for the images of all the ROIs (see compute_features_batch)
+        self._batch_grey_buff = np.empty(0, np.uint8)
+        self._batch_labels_buff = np.empty(0, np.uint8)
 
         self._last_updated_time = 0
         # If the model is not updated for this duration, it is reset. Patches #39
@@ -48,11 +66,88 @@ class ObjectModel(object):
 
     @property
     def is_ready(self):
-        return self._is_ready
+        """
+        :return: whether the model can score contours: its history is full, or it starts from a prior
+        :rtype: bool
+        """
+        return self._is_ready or self._prior is not None
+
     @property
     def features_header(self):
         return self._features_header
 
+    def use_prior(self, path, weight=200):
+        """
+        Start from the statistics of the foreground objects of a previous run, and save the current ones in the same file
+        as the model learns (every time its history is renewed, at most every ``_prior_save_period``).
+        The prior counts as ``weight`` observations, and fades out as the history fills, so live data gradually override it.
+
+        :param path: the file of the prior. It is created if it does not exist
+        :type path: str
+        :param weight: the confidence in the prior, as a number of observations. ``0`` means the prior is only saved, not used.
+        :type weight: float
+        """
+        self._prior_path = path
+        self._prior_weight = float(weight)
+        if self._prior is not None or self._prior_weight <= 0 or not os.path.exists(path):
+            return
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if int(data["version"]) != self._prior_version or list(data["features_header"]) != self._features_header:
+                    raise EthoscopeException("Incompatible foreground model prior in %s" % path)
+                self._prior = (np.asarray(data["means"], dtype=np.float32), np.asarray(data["stds"], dtype=np.float32))
+            logging.info("Foreground model starting from the prior in %s" % path)
+        except Exception as e:
+            logging.warning("Could not load the foreground model prior: %s" % str(e))
+
+    def save_prior(self, path):
+        """
+        Save the statistics of the full history, so another run can start from them (see :meth:`use_prior`).
+
+        :param path: the file of the prior
+        :type path: str
+        """
+        if not self._is_ready:
+            raise EthoscopeException("The foreground model has not learnt enough to be saved")
+        means, stds = self._statistics(self._history_length)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, version=self._prior_version, features_header=np.array(self._features_header),
+                     means=means, stds=stds)
+        os.replace(tmp, path)
+
+    def _statistics(self, last_row):
+        means = np.mean(self._ring_buff[:last_row], 0)
+        np.subtract(self._ring_buff[:last_row], means, self._std_buff[:last_row])
+        np.abs(self._std_buff[:last_row], self._std_buff[:last_row])
+        stds = np.mean(self._std_buff[:last_row], 0)
+        return means, stds
+
+    def _statistics_at(self, last_row, time):
+        # the statistics are computed once per frame, for all the candidate contours of all the ROIs
+        if self._frame_statistics is None or self._frame_statistics[0] != time:
+            self._frame_statistics = (time,) + self._statistics(last_row)
+        return self._frame_statistics[1:]
+
+
+    def get_state(self):
+        """
+        :return: the history of features of the foreground objects
+        :rtype: dict
+        """
+        return {"ring_buff": self._ring_buff.copy(),
+                "ring_buff_idx": self._ring_buff_idx,
+                "is_ready": self._is_ready,
+                "last_updated_time": self._last_updated_time}
+
+    def set_state(self, state):
+        if state["ring_buff"].shape != self._ring_buff.shape:
+            raise EthoscopeException("The saved foreground model does not have the expected history length")
+        self._ring_buff[:] = state["ring_buff"]
+        self._frame_statistics = None
+        self._ring_buff_idx = int(state["ring_buff_idx"])
+        self._is_ready = bool(state["is_ready"])
+        self._last_updated_time = float(state["last_updated_time"])
 
     def update(self, img, contour, time):
         self._last_updated_time = time
@@ -63,6 +158,12 @@ class ObjectModel(object):
         if self._ring_buff_idx == self._history_length:
             self._is_ready = True
             self._ring_buff_idx = 0
+            if self._prior_path is not None and (self._last_prior_save is None or time - self._last_prior_save >= self._prior_save_period):
+                self._last_prior_save = time
+                try:
+                    self.save_prior(self._prior_path)
+                except OSError as e:
+                    logging.warning("Could not save the foreground model prior: %s" % str(e))
 
 
         return self._ring_buff[self._ring_buff_idx]
@@ -73,25 +174,41 @@ class ObjectModel(object):
         given a set of passed features. If the last time the model was updated is too long,
         it is invalidated and reset.
         """
+        return self.distances(np.atleast_2d(features), time)[0]
 
+    def distances(self, features, time):
+        """
+        As :meth:`distance`, for several contours at once.
+
+        :param features: the features of each contour, one per row (see :meth:`compute_features_batch`)
+        :type features: :class:`~numpy.ndarray`
+        :param time: the current time, in ms
+        :type time: int
+        :return: the distance of each contour. ``0`` means it cannot be scored
+        :rtype: :class:`~numpy.ndarray`
+        """
+        out = np.zeros(len(features))
         if time - self._last_updated_time > self._max_unupdated_duration:
             logging.warning("FG model not updated for too long. Resetting.")
-            self.__init__(self._history_length)
-            return 0
+            self._reset()
+            return out
 
         if not self._is_ready:
             last_row = self._ring_buff_idx + 1
         else:
             last_row = self._history_length
 
-        means = np.mean(self._ring_buff[:last_row], 0)
+        means, stds = self._statistics_at(last_row, time)
 
-        np.subtract(self._ring_buff[:last_row], means, self._std_buff[:last_row])
-        np.abs(self._std_buff[:last_row], self._std_buff[:last_row])
+        if self._prior is not None and not self._is_ready:
+            # the prior weighs less and less as the history fills
+            w = self._prior_weight * (1.0 - self._ring_buff_idx / float(self._history_length))
+            prior_means, prior_stds = self._prior
+            means = (w * prior_means + last_row * means) / (w + last_row)
+            stds = (w * prior_stds + last_row * stds) / (w + last_row)
 
-        stds = np.mean(self._std_buff[:last_row], 0)
         if (stds == 0).any():
-            return 0
+            return out
 
         a = 1 / (stds * self._sqrt_2_pi)
 
@@ -99,11 +216,11 @@ class ObjectModel(object):
 
         likelihoods = a * b
 
-        if np.any(likelihoods == 0):
-            return 0
+        valid = np.all(likelihoods > 0, 1)
         #print features, means
-        logls = np.sum(np.log10(likelihoods)) / len(likelihoods)
-        return -1.0 * logls
+        logls = np.sum(np.log10(likelihoods[valid]), 1) / likelihoods.shape[1]
+        out[valid] = -1.0 * logls
+        return out
 
 
     def compute_features(self, img, contour):
@@ -128,7 +245,7 @@ class ObjectModel(object):
 
         sub_grey = self._roi_img_buff[0 : h, 0: w]
 
-        cv2.cvtColor(img[y : y + h, x : x + w, :], cv2.COLOR_BGR2GRAY, sub_grey)
+        to_grey(img[y : y + h, x : x + w], sub_grey)
         sub_mask.fill(0)
 
         cv2.drawContours(sub_mask, [contour], -1, 255, -1, offset=(-x, -y))
@@ -162,6 +279,59 @@ class ObjectModel(object):
 
         return features
 
+    def compute_features_batch(self, img, contours):
+        """
+        The features of several contours of the same image, as :meth:`compute_features`, but computed together:
+        the part of the image holding the contours is converted to grey once, every contour is drawn, with its own label,
+        in a single image, and the mean grey of all the contours is measured in a single pass over it
+        (a joint histogram of labels and grey levels).
+        Contours whose bounding rectangles overlap could be drawn over one another
+        (e.g. the convex hulls of close blobs), so their features are computed one by one.
+
+        :param img: the image of the ROI
+        :type img: :class:`~numpy.ndarray`
+        :param contours: the contours, e.g. the external contours of the foreground
+        :type contours: list(:class:`~numpy.ndarray`)
+        :return: the features of each contour, one per row
+        :rtype: :class:`~numpy.ndarray`
+        """
+        n = len(contours)
+        if n > 254:
+            # labels are 8 bits
+            return np.array([self.compute_features(img, c) for c in contours]).reshape(n, len(self._features_header))
+
+        rects = np.array([cv2.boundingRect(c) for c in contours]).reshape(n, 4)
+        starts, ends = rects[:, 0:2], rects[:, 0:2] + rects[:, 2:4]
+        overlap = np.all((starts[:, None] < ends[None, :]) & (starts[None, :] < ends[:, None]), 2)
+        np.fill_diagonal(overlap, False)
+        overlapping = np.any(overlap, 1)
+
+        x, y = np.min(rects[:, 0:2], 0)
+        w, h = np.max(rects[:, 0:2] + rects[:, 2:4], 0) - (x, y)
+        if self._batch_labels_buff.size < h * w:
+            self._batch_grey_buff = np.empty(h * w, np.uint8)
+            self._batch_labels_buff = np.empty(h * w, np.uint8)
+        grey = self._batch_grey_buff[0: h * w].reshape(h, w)
+        labels = self._batch_labels_buff[0: h * w].reshape(h, w)
+
+        to_grey(img[y: y + h, x: x + w], grey)
+        labels.fill(0)
+        features = np.empty((n, len(self._features_header)))
+        for i, contour in enumerate(contours):
+            if overlapping[i]:
+                features[i] = self.compute_features(img, contour)
+                continue
+            cv2.drawContours(labels, [contour], -1, i + 1, -1, offset=(-int(x), -int(y)))
+            (_, _), (width, height), angle = cv2.minAreaRect(contour)
+            features[i, 0] = log10(cv2.contourArea(contour) + 1.0)
+            features[i, 1] = min(width, height) + 1
+
+        hist = cv2.calcHist([labels, grey], [0, 1], None, [n + 1, 256], [0, n + 1, 0, 256])[1:]
+        n_pixels = np.sum(hist, 1)
+        drawn = ~overlapping
+        features[drawn, 2] = np.dot(hist[drawn], np.arange(256)) / np.maximum(n_pixels[drawn], 1) + 1
+        return features
+
 
 class BackgroundModel(object):
     """
@@ -182,8 +352,11 @@ class BackgroundModel(object):
         self._bg_mean = None
         # self._bg_sd = None
 
-        self._buff_alpha_matrix = None
-        self._buff_invert_alpha_mat = None
+        # where the background is learnt, i.e. where there is no foreground
+        self._buff_bg_mask = None
+        # the mean background as 8 bit integers, refreshed when it is requested after an update
+        self._bg_u8 = None
+        self._bg_u8_valid = False
         # the time stamp of the frame las used to update
         self.last_t = 0
 
@@ -191,6 +364,56 @@ class BackgroundModel(object):
     def bg_img(self):
         return self._bg_mean
 
+    @property
+    def bg_img_u8(self):
+        """
+        :return: The mean background, truncated to 8 bits (as ``bg_img.astype(np.uint8)``), or ``None`` if there is none yet.
+            The image belongs to the model, and remains valid until the next update.
+        :rtype: :class:`~numpy.ndarray`
+        """
+        if self._bg_mean is None:
+            return None
+        if self._bg_u8 is None or self._bg_u8.shape != self._bg_mean.shape:
+            self._bg_u8 = np.empty(self._bg_mean.shape, dtype=np.uint8)
+            self._bg_u8_valid = False
+        if not self._bg_u8_valid:
+            np.copyto(self._bg_u8, self._bg_mean, casting="unsafe")
+            self._bg_u8_valid = True
+        return self._bg_u8
+
+    def get_state(self):
+        """
+        :return: the mean background and the learning rate, or an empty dictionary if there is no background yet
+        :rtype: dict
+        """
+        if self._bg_mean is None:
+            return {}
+        return {"mean": self._bg_mean.copy(),
+                "half_life": self._current_half_life,
+                "last_t": self.last_t}
+
+    def set_state(self, state):
+        if "mean" not in state:
+            return
+        self._bg_mean = np.asarray(state["mean"], dtype=np.float32).copy()
+        self._current_half_life = float(state["half_life"])
+        self.last_t = int(state["last_t"])
+        self._bg_u8_valid = False
+
+    def seed(self, img_t, t):
+        """
+        Start from a reference image, rather than from the first frame, with the fastest learning rate.
+
+        :param img_t: the reference, pre-processed as the frames will be
+        :type img_t: :class:`~numpy.ndarray`
+        :param t: the time of the reference, in ms
+        :type t: int
+        """
+        self._bg_mean = img_t.astype(np.float32)
+        self._current_half_life = self._min_half_life
+        self.last_t = t
+        self._bg_u8_valid = False
+
     def increase_learning_rate(self):
         self._current_half_life /= self._increment
 
@@ -198,7 +421,14 @@ class BackgroundModel(object):
         self._current_half_life *= self._increment
 
 
-    def update(self, img_t, t, fg_mask=None):
+    def foreground_buffer(self, shape):
+        """
+        :return: an image where the tracker can compute the foreground of the frames it learns from
+        :rtype: :class:`~numpy.ndarray`
+        """
+        return np.empty(shape, dtype=np.uint8)
+
+    def _learning_rate(self, t):
         dt = float(t - self.last_t)
         if dt < 0:
             # raise EthoscopeException("Negative time interval between two consecutive frames")
@@ -207,54 +437,208 @@ class BackgroundModel(object):
         # clip the half life to possible value:
         self._current_half_life = np.clip(self._current_half_life, self._min_half_life, self._max_half_life)
 
+        # the learning rate, alpha, is an exponential function of half life
+        # it correspond to how much the present frame should account for the background
+
+        lam = np.log(2) / self._current_half_life
+        # how much the current frame should be accounted for
+        return float(1 - np.exp(-lam * dt))
+
+    def update(self, img_t, t, fg_mask=None):
+        alpha = self._learning_rate(t)
+
         # ensure preallocated buffers exist. otherwise, initialise them
         if self._bg_mean is None:
             self._bg_mean = img_t.astype(np.float32)
             # self._bg_sd = np.zeros_like(img_t)
             # self._bg_sd.fill(128)
 
-        if self._buff_alpha_matrix is None:
-            self._buff_alpha_matrix = np.ones_like(img_t, dtype=np.float32)
+        # bg = (1 - alpha) * bg + alpha * img, in a single pass, except where the (dilated) foreground is
+        if fg_mask is not None:
+            cv2.dilate(fg_mask, None, fg_mask)
+            if self._buff_bg_mask is None or self._buff_bg_mask.shape != fg_mask.shape:
+                self._buff_bg_mask = np.empty_like(fg_mask)
+            cv2.compare(fg_mask, 0, cv2.CMP_EQ, self._buff_bg_mask)
+            cv2.accumulateWeighted(img_t, self._bg_mean, alpha, self._buff_bg_mask)
+        else:
+            cv2.accumulateWeighted(img_t, self._bg_mean, alpha)
 
-        # the learning rate, alpha, is an exponential function of half life
-        # it correspond to how much the present frame should account for the background
+        self._bg_u8_valid = False
+        self.last_t = t
 
-        lam = np.log(2) / self._current_half_life
-        # how much the current frame should be accounted for
-        alpha = 1 - np.exp(-lam * dt)
 
-        # set-p a matrix of learning rate. it is 0 where foreground map is true
-        self._buff_alpha_matrix.fill(alpha)
+class SharedBackgroundModel(BackgroundModel):
+    def __init__(self, arena, rectangle, *args, **kwargs):
+        """
+        The background of one ROI, kept in a :class:`~ethoscope.trackers.adaptive_bg_tracker.ArenaBackgroundModel`.
+        It learns at its own rate, like :class:`~ethoscope.trackers.adaptive_bg_tracker.BackgroundModel`,
+        but :meth:`update` only sets the learning rate of its pixels. The background itself is updated by the arena,
+        once per frame, for all the ROIs.
+
+        :param arena: the model of the whole arena
+        :type arena: :class:`~ethoscope.trackers.adaptive_bg_tracker.ArenaBackgroundModel`
+        :param rectangle: the bounding rectangle of the ROI, as ``(x, y, w, h)``, relative to the arena
+        :type rectangle: (int,int,int,int)
+        """
+        super(SharedBackgroundModel, self).__init__(*args, **kwargs)
+        x, y, w, h = rectangle
+        self._arena = arena
+        self._mean_view = arena._bg_mean[y: y + h, x: x + w]
+        self._u8_view = arena._bg_u8[y: y + h, x: x + w]
+        self._grey = arena._grey[y: y + h, x: x + w]
+        self._fg = arena._fg[y: y + h, x: x + w]
+        self._alpha = arena._alpha[y: y + h, x: x + w]
+
+    @property
+    def grey(self):
+        """
+        :return: The view of the arena where the tracker should pre-process its frames, so they need not be copied
+        :rtype: :class:`~numpy.ndarray`
+        """
+        return self._grey
+
+    @property
+    def bg_img_u8(self):
+        if self._bg_mean is None:
+            return None
+        self._arena.refresh()
+        return self._u8_view
+
+    def foreground_buffer(self, shape):
+        return self._fg
+
+    def set_state(self, state):
+        if "mean" not in state:
+            return
+        np.copyto(self._mean_view, state["mean"])
+        self._bg_mean = self._mean_view
+        self._current_half_life = float(state["half_life"])
+        self.last_t = int(state["last_t"])
+        self._arena.invalidate()
+
+    def seed(self, img_t, t):
+        np.copyto(self._mean_view, img_t)
+        self._bg_mean = self._mean_view
+        self._current_half_life = self._min_half_life
+        self.last_t = t
+        self._arena.invalidate()
+
+    def update(self, img_t, t, fg_mask=None):
+        alpha = self._learning_rate(t)
+
+        if self._bg_mean is None:
+            np.copyto(self._mean_view, img_t)
+            self._bg_mean = self._mean_view
+        if img_t is not self._grey:
+            np.copyto(self._grey, img_t)
+
+        # the arena learns nothing where the (dilated) foreground is
+        self._alpha.fill(alpha)
         if fg_mask is not None:
             cv2.dilate(fg_mask, None, fg_mask)
-            cv2.subtract(self._buff_alpha_matrix, self._buff_alpha_matrix, self._buff_alpha_matrix, mask=fg_mask)
+            cv2.subtract(self._alpha, self._alpha, self._alpha, mask=fg_mask)
 
+        self._arena.schedule()
+        self.last_t = t
 
-        if self._buff_invert_alpha_mat is None:
-            self._buff_invert_alpha_mat = 1 - self._buff_alpha_matrix
-        else:
-            np.subtract(1, self._buff_alpha_matrix, self._buff_invert_alpha_mat)
 
-        np.multiply(self._buff_alpha_matrix, img_t, self._buff_alpha_matrix)
-        np.multiply(self._buff_invert_alpha_mat, self._bg_mean, self._buff_invert_alpha_mat)
-        np.add(self._buff_alpha_matrix, self._buff_invert_alpha_mat, self._bg_mean)
+class ArenaBackgroundModel(object):
+    def __init__(self, rois):
+        """
+        The background of all the ROIs of a frame, in a single image spanning their union.
+        Each ROI has a :class:`~ethoscope.trackers.adaptive_bg_tracker.SharedBackgroundModel` (see :meth:`roi_model`),
+        which sets the learning rate of its pixels, and the owner of the arena calls :meth:`update` once per frame,
+        after all the ROIs are tracked. This replaces many small updates with a single large one.
 
-        self.last_t = t
+        :param rois: the ROIs. Their bounding rectangles must not overlap.
+        :type rois: list(:class:`~ethoscope.core.roi.ROI`)
+        """
+        rectangles = [r.rectangle for r in rois]
+        for i, (x, y, w, h) in enumerate(rectangles):
+            for (x2, y2, w2, h2) in rectangles[i + 1:]:
+                if x < x2 + w2 and x2 < x + w and y < y2 + h2 and y2 < y + h:
+                    raise EthoscopeException("The ROIs overlap, so they cannot share a background")
+
+        self._x0 = min([x for x, _, _, _ in rectangles])
+        self._y0 = min([y for _, y, _, _ in rectangles])
+        shape = (max([y + h for _, y, _, h in rectangles]) - self._y0,
+                 max([x + w for x, _, w, _ in rectangles]) - self._x0)
+
+        self._bg_mean = np.zeros(shape, dtype=np.float32)
+        self._bg_u8 = np.zeros(shape, dtype=np.uint8)
+        # the pre-processed frame, the foreground, and the learning rate of each pixel (0 where nothing is learnt)
+        self._grey = np.zeros(shape, dtype=np.uint8)
+        self._fg = np.zeros(shape, dtype=np.uint8)
+        self._alpha = np.zeros(shape, dtype=np.float32)
+        self._buff_diff = np.empty(shape, dtype=np.float32)
+        self._bg_u8_valid = True
+        self._scheduled = False
+
+    @property
+    def shape(self):
+        return self._bg_mean.shape
+
+    def roi_model(self, roi):
+        """
+        :param roi: one of the ROIs of the arena
+        :type roi: :class:`~ethoscope.core.roi.ROI`
+        :return: the background model of this ROI
+        :rtype: :class:`~ethoscope.trackers.adaptive_bg_tracker.SharedBackgroundModel`
+        """
+        x, y, w, h = roi.rectangle
+        return SharedBackgroundModel(self, (x - self._x0, y - self._y0, w, h))
+
+    def schedule(self):
+        self._scheduled = True
+
+    def invalidate(self):
+        self._bg_u8_valid = False
+
+    def refresh(self):
+        if not self._bg_u8_valid:
+            np.copyto(self._bg_u8, self._bg_mean, casting="unsafe")
+            self._bg_u8_valid = True
+
+    def update(self):
+        """
+        Learn from the frame that the ROIs were updated with since the last call:
+        ``bg += alpha * (grey - bg)``, with the learning rate set by each ROI.
+        """
+        if not self._scheduled:
+            return
+        cv2.subtract(self._grey, self._bg_mean, self._buff_diff, dtype=cv2.CV_32F)
+        cv2.accumulateProduct(self._buff_diff, self._alpha, self._bg_mean)
+        self._alpha.fill(0)
+        self._scheduled = False
+        self._bg_u8_valid = False
 
 
 class AdaptiveBGModel(BaseTracker):
     _description = {"overview": "The default tracker for fruit flies. One animal per ROI.",
-                    "arguments": []}
-
+                    "arguments": [
+                        {"type": "filepath", "name": "fg_prior_path",
+                         "description": "A file where the size and colour of the animals are saved, so the next runs can tell animals from artefacts from the start. Leave empty to learn them from scratch", "default": ""},
+                        {"type": "number", "min": 0, "max": 1000, "step": 1, "name": "fg_prior_weight",
+                         "description": "How much the saved size and colour count, as a number of observations. 0 means they are only saved", "default": 200}
+                    ]}
+
+    grey_capable = True
+    shared_background_class = ArenaBackgroundModel
     fg_model = ObjectModel()
 
-    def __init__(self, roi, data=None):
+    def __init__(self, roi, data=None, fg_prior_path="", fg_prior_weight=200):
         """
         An adaptive background subtraction model to find position of one animal in one roi.
 
         TODO more description here
         :param roi:
         :param data:
+        :param fg_prior_path: a file where the statistics of the tracked animals (shared by all ROIs) are saved,
+            and from which the next runs start (see :meth:`~ethoscope.trackers.adaptive_bg_tracker.ObjectModel.use_prior`).
+            An empty string means none.
+        :type fg_prior_path: str
+        :param fg_prior_weight: the confidence in the saved statistics, as a number of observations. ``0`` means they are only saved.
+        :type fg_prior_weight: float
         :return:
         """
         self._previous_shape = None
@@ -277,12 +661,121 @@ class AdaptiveBGModel(BaseTracker):
         self._buff_convolved_mask = None
         self._buff_fg_backup = None
         self._buff_fg_diff = None
+        # scratch images for the ellipse of the animal, and the foreground within it, restricted to its bounding box
+        self._buff_ellipse = None
+        self._buff_ellipse_fg = None
         self._old_sum_fg = 0
         self.live_tracking = True
         self.ellipse = None
 
+        if fg_prior_path:
+            self.fg_model.use_prior(fg_prior_path, fg_prior_weight)
+
         super(AdaptiveBGModel, self).__init__(roi, data)
 
+    @classmethod
+    def get_shared_state(cls):
+        """
+        The foreground model, shared by all the ROIs.
+        See :meth:`~ethoscope.trackers.trackers.BaseTracker.get_shared_state`.
+        """
+        return {"fg_" + k: v for k, v in cls.fg_model.get_state().items()}
+
+    @classmethod
+    def set_shared_state(cls, state):
+        fg_state = {k[3:]: v for k, v in state.items() if k.startswith("fg_")}
+        if len(fg_state) > 0:
+            cls.fg_model.set_state(fg_state)
+
+    def get_state(self):
+        """
+        Extends :meth:`~ethoscope.trackers.trackers.BaseTracker.get_state` with the background model.
+        The foreground model is shared by all the ROIs, so it is saved apart (see :meth:`get_shared_state`).
+        """
+        out = super(AdaptiveBGModel, self).get_state()
+        for k, v in self._bg_model.get_state().items():
+            out["bg_" + k] = v
+        if "bg_mean" in out:
+            out["old_pos"] = np.array([self._old_pos.real, self._old_pos.imag])
+        return out
+
+    def set_state(self, state):
+        super(AdaptiveBGModel, self).set_state(state)
+        self._bg_model.set_state({k[3:]: v for k, v in state.items() if k.startswith("bg_")})
+        # checkpoints used to hold the foreground model with each ROI
+        self.set_shared_state(state)
+
+        bg = self._bg_model.bg_img
+        if bg is not None:
+            self._allocate_buffers(bg.shape)
+            self._old_pos = complex(*state["old_pos"])
+
+    def seed_background(self, img, t):
+        """
+        Initialise the background from a reference frame, pre-processed as frames are.
+        See :meth:`~ethoscope.trackers.trackers.BaseTracker.seed_background`.
+        """
+        if self._bg_model.bg_img is not None:
+            # e.g. restored from a checkpoint, and more accurate than a few frames
+            return False
+        sub_img, mask = self._roi.apply(img)
+        grey = self._pre_process_input_minimal(sub_img, mask, t)
+        self._bg_model.seed(grey, t)
+        self._allocate_buffers(grey.shape)
+        self._old_pos = 0.0+0.0j
+        return True
+
+    def share_background(self, shared_background):
+        """
+        Keep the background of the ROI in a model of the whole arena.
+        See :meth:`~ethoscope.trackers.trackers.BaseTracker.share_background`.
+        """
+        if self._bg_model.bg_img is not None:
+            return False
+        self._bg_model = shared_background.roi_model(self._roi)
+        # frames are pre-processed, and the foreground computed, in place, in the arena
+        self._buff_grey = self._bg_model.grey
+        return True
+
+    def _allocate_buffers(self, shape):
+        # the buffers are otherwise allocated on the first frame, when there is no background yet
+        self._buff_fg = self._bg_model.foreground_buffer(shape)
+        self._buff_object = np.empty_like(self._buff_fg)
+        self._buff_fg_backup = np.empty_like(self._buff_fg)
+
+    @property
+    def ellipse(self):
+        """
+        :return: The mask of the animal found in the last frame, modelled as an ellipse (see :meth:`object_mask`), as large as the ROI.
+            It is only drawn when requested.
+        :rtype: :class:`~numpy.ndarray`
+        """
+        if self._ellipse is None and self._ellipse_rect is not None:
+            x0, y0, x1, y1 = self._ellipse_rect
+            self._ellipse = np.zeros_like(self._buff_fg)
+            self._ellipse[y0:y1, x0:x1] = self._buff_ellipse[0: (y1 - y0) * (x1 - x0)].reshape(y1 - y0, x1 - x0)
+        return self._ellipse
+
+    @ellipse.setter
+    def ellipse(self, value):
+        self._ellipse = value
+        self._ellipse_rect = None
+
+    @property
+    def _buff_fg_backup(self):
+        # the foreground within the ellipse of the animal, as large as the ROI, is only written when requested
+        if self._ellipse_fg_pending:
+            x0, y0, x1, y1 = self._ellipse_rect
+            self._fg_backup.fill(0)
+            self._fg_backup[y0:y1, x0:x1] = self._buff_ellipse_fg[0: (y1 - y0) * (x1 - x0)].reshape(y1 - y0, x1 - x0)
+            self._ellipse_fg_pending = False
+        return self._fg_backup
+
+    @_buff_fg_backup.setter
+    def _buff_fg_backup(self, value):
+        self._fg_backup = value
+        self._ellipse_fg_pending = False
+
     def _pre_process_input_minimal(self, img, mask, t, darker_fg=True):
         blur_rad = int(self._object_expected_size * np.max(img.shape) / 2.0)
 
@@ -290,11 +783,11 @@ class AdaptiveBGModel(BaseTracker):
             blur_rad += 1
 
         if self._buff_grey is None:
-            self._buff_grey = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            self._buff_grey = to_grey(img)
             if mask is None:
                 mask = np.ones_like(self._buff_grey) * 255
 
-        cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, self._buff_grey)
+        to_grey(img, self._buff_grey)
         # cv2.imshow("dbg",self._buff_grey)
         cv2.GaussianBlur(self._buff_grey, (blur_rad, blur_rad), 1.2, self._buff_grey)
         if darker_fg:
@@ -320,7 +813,7 @@ class AdaptiveBGModel(BaseTracker):
 
 
         if self._buff_grey is None:
-            self._buff_grey = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            self._buff_grey = to_grey(img)
             self._buff_grey_blurred = np.empty_like(self._buff_grey)
             # self._buff_grey_blurred = np.empty_like(self._buff_grey)
             if mask is None:
@@ -331,7 +824,7 @@ class AdaptiveBGModel(BaseTracker):
             self._buff_convolved_mask = (1 / 255.0 * mask_conv.astype(np.float32))
 
 
-        cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, self._buff_grey)
+        to_grey(img, self._buff_grey)
 
         hist = cv2.calcHist([self._buff_grey], [0], None, [256], [0, 255]).ravel()
         hist = np.convolve(hist, [1] * 3)
@@ -376,13 +869,11 @@ class AdaptiveBGModel(BaseTracker):
     def _track(self, img, grey, mask, t):
 
         if self._bg_model.bg_img is None:
-            self._buff_fg = np.empty_like(grey)
-            self._buff_object = np.empty_like(grey)
-            self._buff_fg_backup = np.empty_like(grey)
+            self._allocate_buffers(grey.shape)
             self._old_pos = 0.0+0.0j
             raise NoPositionError
 
-        bg = self._bg_model.bg_img.astype(np.uint8)
+        bg = self._bg_model.bg_img_u8
         cv2.subtract(grey, bg, self._buff_fg)
         self._foreground = self._buff_fg.copy()
 
@@ -412,7 +903,11 @@ class AdaptiveBGModel(BaseTracker):
         if self.live_tracking and (img is None or t is None):
             raise EthoscopeException("Invalid input to get_hull")
 
-        self._buff_fg_backup = np.copy(self._buff_fg)
+        if self._fg_backup is None or self._fg_backup.shape != self._buff_fg.shape:
+            self._buff_fg_backup = np.copy(self._buff_fg)
+        else:
+            np.copyto(self._fg_backup, self._buff_fg)
+            self._ellipse_fg_pending = False
 
         if self.live_tracking:
             self._check_prop_fg_pix()
@@ -448,8 +943,8 @@ class AdaptiveBGModel(BaseTracker):
 
             elif len(hulls) > 1:
                 is_ambiguous = True
-            cluster_features = [self.fg_model.compute_features(img, h) for h in hulls]
-            all_distances = [self.fg_model.distance(cf, t) for cf in cluster_features]
+            cluster_features = self.fg_model.compute_features_batch(img, hulls)
+            all_distances = self.fg_model.distances(cluster_features, t)
             good_clust = np.argmin(all_distances)
 
             hull = hulls[good_clust]
@@ -506,20 +1001,41 @@ class AdaptiveBGModel(BaseTracker):
             w, h = h, w
         angle = angle % 180
 
-        h_im = min(self._buff_fg.shape)
-        w_im = max(self._buff_fg.shape)
+        h_roi, w_roi = self._buff_fg.shape
+        h_im = min(h_roi, w_roi)
+        w_im = max(h_roi, w_roi)
         max_h = 2 * h_im
         if w > max_h or h > max_h:
             raise NoPositionError
 
-        self.ellipse = self.object_mask(**{"x": x, "y": y, "w": w, "h": h, "angle": angle}, roi=self._buff_fg)
-        # cv2.ellipse(self._buff_fg, ((x, y), (int(w * 1.5), int(h * 1.5)), angle), 255, -1)
-
-        # TODO center mass just on the ellipse area
-        cv2.bitwise_and(self._buff_fg_backup, self._buff_fg, self._buff_fg_backup)
-        cv2.bitwise_and(self._buff_fg_backup, self.ellipse, self._buff_fg_backup)
+        # the centre of mass of the foreground within the ellipse (see object_mask),
+        # computed only within the bounding box of the ellipse, in preallocated buffers
+        box = ((x, y), (int(w * 1.5), int(h * 1.5)), angle)
+        bx, by, bw, bh = cv2.boundingRect(cv2.boxPoints(box))
+        x0, y0 = max(bx - 1, 0), max(by - 1, 0)
+        x1, y1 = min(bx + bw + 1, w_roi), min(by + bh + 1, h_roi)
+        if x1 <= x0 or y1 <= y0:
+            raise NoPositionError
+        if self._buff_ellipse is None or self._buff_ellipse.size < h_roi * w_roi:
+            self._buff_ellipse = np.empty(h_roi * w_roi, dtype=np.uint8)
+            self._buff_ellipse_fg = np.empty_like(self._buff_ellipse)
+        ellipse = self._buff_ellipse[0: (y1 - y0) * (x1 - x0)].reshape(y1 - y0, x1 - x0)
+        ellipse_fg = self._buff_ellipse_fg[0: (y1 - y0) * (x1 - x0)].reshape(y1 - y0, x1 - x0)
+
+        ellipse.fill(0)
+        cv2.ellipse(ellipse, ((x - x0, y - y0), box[1], angle), 255, -1)
+        cv2.bitwise_and(self._fg_backup[y0:y1, x0:x1], self._buff_fg[y0:y1, x0:x1], ellipse_fg)
+        cv2.bitwise_and(ellipse_fg, ellipse, ellipse_fg)
+        # the full size images are drawn from these if they are requested
+        self.ellipse = None
+        self._ellipse_rect = (x0, y0, x1, y1)
+        self._ellipse_fg_pending = True
 
-        y, x = ndimage.measurements.center_of_mass(self._buff_fg_backup)
+        moments = cv2.moments(ellipse_fg)
+        if moments["m00"] == 0:
+            raise NoPositionError
+        x = x0 + moments["m10"] / moments["m00"]
+        y = y0 + moments["m01"] / moments["m00"]
         pos = x +1.0j * y
         pos /= w_im
         xy_dist = round(log10(1. / float(w_im) + abs(pos - self._old_pos)) * 1000)
@@ -550,5 +1066,6 @@ class AdaptiveBGModel(BaseTracker):
         ])
 
 
-        self._previous_shape = np.copy(hull)
+        # hulls are not modified once found
+        self._previous_shape = hull
         return [out]
@@ -0,0 +1,174 @@
+__author__ = 'quentin'
+
+import logging
+from math import log10
+
+import cv2
+import numpy as np
+
+from ethoscope.core.variables import XYDistance, IsMotionGatedVariable
+from ethoscope.trackers.adaptive_bg_tracker import AdaptiveBGModel
+from ethoscope.trackers.trackers import NoPositionError
+from ethoscope.utils.img_proc import to_grey
+
+
+class MotionGatedAdaptiveBGModel(AdaptiveBGModel):
+    _description = {"overview": "The default tracker for fruit flies, skipping the tracking of ROIs where nothing changed. "
+                                "Faster when animals are immobile most of the time (e.g. sleep experiments).",
+                    "arguments": [
+                        {"type": "number", "min": 1, "max": 255, "step": 1, "name": "change_threshold",
+                         "description": "The minimal change of grey level for a pixel to be considered changed", "default": 15},
+                        {"type": "number", "min": 0, "max": 1000, "step": 1, "name": "min_changed_pixels",
+                         "description": "The number of changed (downsampled) pixels above which the ROI is tracked", "default": 2},
+                        {"type": "number", "min": 1, "max": 50, "step": 1, "name": "bg_update_period",
+                         "description": "How often, in seconds, a still ROI is fully tracked, to update its background", "default": 30},
+                        {"type": "str", "name": "validate",
+                         "description": "If TRUE, ROIs are always fully tracked, and disagreements with the motion gate are logged (for validation only)", "default": "FALSE"}
+                    ] + AdaptiveBGModel._description["arguments"]}
+
+    # the change detection works on images downsampled by this factor
+    _downsample = 4
+    # in validation mode, the distance (in pixels) above which positions are considered different
+    _validation_tolerance = 2
+
+    def __init__(self, roi, data=None, change_threshold=15, min_changed_pixels=2, bg_update_period=30, validate="FALSE", **kwargs):
+        """
+        An :class:`~ethoscope.trackers.adaptive_bg_tracker.AdaptiveBGModel` with a cheap change detector in front.
+        Each frame, the downsampled ROI is compared to the one that was last fully tracked.
+        When the number of changed pixels is small, the full tracking is skipped, and the last position is repeated,
+        with a null distance and the :class:`~ethoscope.core.variables.IsMotionGatedVariable` flag.
+        Still ROIs are nevertheless fully tracked every ``bg_update_period`` seconds, which updates their background model.
+
+        :param roi: The Region Of Interest the the tracker will use to locate the animal.
+        :type roi: :class:`~ethoscope.rois.roi_builders.ROI`
+        :param data: An optional data set.
+        :param change_threshold: the minimal difference of grey level for a pixel to be considered changed
+        :type change_threshold: int
+        :param min_changed_pixels: the ROI is fully tracked when more (downsampled) pixels than this have changed
+        :type min_changed_pixels: int
+        :param bg_update_period: the maximal duration, in seconds, between two full trackings
+        :type bg_update_period: float
+        :param validate: if ``"TRUE"``, the full tracking is always used, and the frames where the motion gate would
+            have given a different result are counted and logged. See :attr:`validation_report`.
+        :type validate: str
+        :param kwargs: the other arguments of :class:`~ethoscope.trackers.adaptive_bg_tracker.AdaptiveBGModel` (e.g. ``fg_prior_path``)
+        """
+        self._change_threshold = int(change_threshold)
+        self._min_changed_pixels = int(min_changed_pixels)
+        self._bg_update_period = float(bg_update_period) * 1000 # in ms
+        self._validate = str(validate).upper() == "TRUE"
+
+        self._small_ref = None
+        self._small_grey = None
+        self._small_diff = None
+        self._small_mask = None
+        self._last_full_t = None
+        self._last_full_points = None
+        self._null_dist = None
+        self._validation_report = {"n_gated": 0, "n_disagreements": 0}
+
+        super(MotionGatedAdaptiveBGModel, self).__init__(roi, data, **kwargs)
+
+    @property
+    def validation_report(self):
+        """
+        :return: The number of frames where the motion gate detected no change, and, in validation mode,
+            the number of those where the full tracking found a different position (or no position)
+        :rtype: dict
+        """
+        return dict(self._validation_report)
+
+    def _downsampled_grey(self, img, mask):
+        size = (max(1, img.shape[1] // self._downsample), max(1, img.shape[0] // self._downsample))
+        small = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+
+        if self._small_grey is None:
+            self._small_grey = to_grey(small)
+            self._small_diff = np.empty_like(self._small_grey)
+            if mask is not None:
+                self._small_mask = cv2.resize(mask, size, interpolation=cv2.INTER_NEAREST)
+            self._null_dist = round(log10(1. / float(max(img.shape[0:2]))) * 1000)
+
+        return to_grey(small, self._small_grey)
+
+    def _n_changed_pixels(self, small):
+        cv2.absdiff(small, self._small_ref, self._small_diff)
+        cv2.threshold(self._small_diff, self._change_threshold, 255, cv2.THRESH_BINARY, dst=self._small_diff)
+        if self._small_mask is not None:
+            cv2.bitwise_and(self._small_diff, self._small_mask, self._small_diff)
+        return cv2.countNonZero(self._small_diff)
+
+    def _is_still(self, small, t):
+        if self._small_ref is None or self._last_full_points is None:
+            return False
+        if t - self._last_full_t > self._bg_update_period:
+            return False
+        return self._n_changed_pixels(small) <= self._min_changed_pixels
+
+    def _gated_points(self):
+        out = []
+        for p in self._last_full_points:
+            p = p.copy()
+            p.append(XYDistance(self._null_dist))
+            p.append(IsMotionGatedVariable(True))
+            out.append(p)
+        return out
+
+    def _full_track(self, img, mask, t, small, update_gate=True):
+        if update_gate:
+            self._last_full_t = t
+            if self._small_ref is None:
+                self._small_ref = np.empty_like(small)
+            np.copyto(self._small_ref, small)
+
+        try:
+            points = super(MotionGatedAdaptiveBGModel, self)._find_position(img, mask, t)
+        except NoPositionError:
+            if update_gate:
+                self._last_full_points = None
+            raise
+
+        if update_gate:
+            self._last_full_points = [p.copy() for p in points]
+        for p in points:
+            p.append(IsMotionGatedVariable(False))
+        return points
+
+    def _validate_gate(self, gated, points):
+        """
+        Compare the positions that the motion gate would have returned to the positions of the full tracking.
+        """
+        if points is None:
+            disagree = True
+        else:
+            d = max([abs(g["x"] - p["x"]) + abs(g["y"] - p["y"]) for g, p in zip(gated, points)])
+            disagree = d > self._validation_tolerance
+
+        if disagree:
+            self._validation_report["n_disagreements"] += 1
+            logging.warning("Motion gate disagreement in ROI %i: gated %s, tracked %s. %s" %
+                            (self._roi.idx,
+                             str([(g["x"], g["y"]) for g in gated]),
+                             "no position" if points is None else str([(p["x"], p["y"]) for p in points]),
+                             str(self._validation_report)))
+
+    def _find_position(self, img, mask, t):
+        small = self._downsampled_grey(img, mask)
+
+        if not self._is_still(small, t):
+            return self._full_track(img, mask, t, small)
+
+        self._validation_report["n_gated"] += 1
+        gated = self._gated_points()
+        if not self._validate:
+            return gated
+
+        # in validation mode, the full tracking still runs (and is returned), and is compared to the motion gate.
+        # The state of the gate is left as if the tracking was skipped
+        try:
+            points = self._full_track(img, mask, t, small, update_gate=False)
+        except NoPositionError:
+            self._validate_gate(gated, None)
+            raise
+        self._validate_gate(gated, points)
+        return points
@@ -11,6 +11,7 @@ from ethoscope.core.variables import XPosVariable, YPosVariable, XYDistance, Wid
 from ethoscope.core.data_point import DataPoint
 from ethoscope.trackers.trackers import BaseTracker, NoPositionError
 from ethoscope.utils.debug import EthoscopeException
+from ethoscope.utils.img_proc import to_grey
 import logging
 
 
@@ -24,7 +25,7 @@ class MultiFlyTracker(BaseTracker):
     _description = {"overview": "An experimental tracker to monitor several animals per ROI.",
                     "arguments": []}
 
-
+    grey_capable = True
 
     def __init__(self, roi, data=None):
         """
@@ -65,11 +66,11 @@ class MultiFlyTracker(BaseTracker):
             blur_rad += 1
 
         if self._buff_grey is None:
-            self._buff_grey = cv2.cvtColor(img,cv2.COLOR_BGR2GRAY)
+            self._buff_grey = to_grey(img)
             if mask is None:
                 mask = np.ones_like(self._buff_grey) * 255
 
-        cv2.cvtColor(img,cv2.COLOR_BGR2GRAY, self._buff_grey)
+        to_grey(img, self._buff_grey)
         # cv2.imshow("dbg",self._buff_grey)
         cv2.GaussianBlur(self._buff_grey,(blur_rad,blur_rad),1.2, self._buff_grey)
         if darker_fg:
@@ -110,7 +111,7 @@ class MultiFlyTracker(BaseTracker):
    #         self._old_sum_fg = 0
             raise NoPositionError
 
-        bg = self._bg_model.bg_img.astype(np.uint8)
+        bg = self._bg_model.bg_img_u8
         cv2.subtract(grey, bg, self._buff_fg)
 
         cv2.threshold(self._buff_fg,20,255,cv2.THRESH_TOZERO, dst=self._buff_fg)
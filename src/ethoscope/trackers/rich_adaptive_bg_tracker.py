@@ -7,6 +7,7 @@ import numpy as np
 
 from ethoscope.core.variables import CoreMovement, PeripheryMovement, BodyMovement
 from ethoscope.trackers.adaptive_bg_tracker import AdaptiveBGModel
+from ethoscope.utils.img_proc import to_grey
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -226,5 +227,5 @@ class RichAdaptiveBGModel(AdaptiveBGModel):
         return datapoints
 
     def _find_position(self, *args, **kwargs):
-        self._last_grey = np.copy(cv2.cvtColor(args[0], cv2.COLOR_BGR2GRAY))
+        self._last_grey = to_grey(args[0])
         return super()._find_position(*args, **kwargs)
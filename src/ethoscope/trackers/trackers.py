@@ -1,9 +1,13 @@
 __author__ = 'quentin'
 
+import pickle
 from collections import deque
 
+import numpy as np
+
 from ethoscope.utils.description  import DescribedObject
 from ethoscope.core.variables import *
+from ethoscope.core.profiler import NullProfiler
 
 
 class NoPositionError(Exception):
@@ -14,6 +18,13 @@ class NoPositionError(Exception):
 
 class BaseTracker(DescribedObject):
     # data_point = None
+    #: Whether the tracker accepts single channel (grey) frames as well as BGR ones.
+    #: When all trackers and the camera agree, the monitor asks the camera for grey frames.
+    grey_capable = False
+    #: The model of the background that the trackers of all the ROIs can share (see :meth:`share_background`), if any
+    shared_background_class = None
+    _profiler = NullProfiler()
+
     def __init__(self, roi, data=None):
         """
         Template class for video trackers.
@@ -32,6 +43,9 @@ class BaseTracker(DescribedObject):
         self._roi = roi
         self._last_non_inferred_time = 0
         self._last_time_point = 0
+        # the time of the first frame, and of the first position found, to measure how long tracking takes to start
+        self._first_time_point = None
+        self._first_position_time = None
         self._max_history_length = 250 * 1000  # in milliseconds
 
         # self._max_history_length = 500   # in milliseconds
@@ -50,8 +64,18 @@ class BaseTracker(DescribedObject):
         :rtype: :class:`~ethoscope.core.data_point.DataPoint`
         """
 
+        t0 = self._profiler.now()
         sub_img, mask = self._roi.apply(img)
+        t0 = self._profiler.lap("roi_crop", t0, self._roi.idx)
         self._last_time_point = t
+        if self._first_time_point is None:
+            self._first_time_point = t
+        try:
+            return self._locate(t, sub_img, mask)
+        finally:
+            self._profiler.lap("tracker", t0, self._roi.idx)
+
+    def _locate(self, t, sub_img, mask):
         try:
 
             points = self._find_position(sub_img, mask, t)
@@ -63,6 +87,8 @@ class BaseTracker(DescribedObject):
 
             # point = self.normalise_position(point)
             self._last_non_inferred_time = t
+            if self._first_position_time is None:
+                self._first_position_time = t
 
             for p in points:
                 p.append(IsInferredVariable(False))
@@ -79,17 +105,144 @@ class BaseTracker(DescribedObject):
                 for p in points:
                     p.append(IsInferredVariable(True))
 
+        self._record(t, points)
+
+        # import ipdb; ipdb.set_trace()
+        return points
+
+    def seed_background(self, img, t):
+        """
+        Initialise the model of the background from a reference frame (e.g. the median of a few frames),
+        so that positions can be found from the first tracked frame on.
+        Trackers without a background model, or that already have a background (e.g. a restored state), ignore it.
+
+        :param img: the whole reference frame
+        :type img: :class:`~numpy.ndarray`
+        :param t: the time of the reference, in ms
+        :type t: int
+        :return: whether the reference was used
+        :rtype: bool
+        """
+        return False
+
+    def share_background(self, shared_background):
+        """
+        Model the background of the ROI within a model shared by all the ROIs of the frame,
+        which is then updated once per frame, rather than ROI by ROI.
+        Trackers without a background model ignore it.
+
+        :param shared_background: the shared model, an instance of :attr:`shared_background_class`
+        :return: whether the tracker uses the shared model
+        :rtype: bool
+        """
+        return False
+
+    @property
+    def time_to_first_position(self):
+        """
+        :return: The time, in ms, between the first frame and the first position that was found (not inferred),
+            or ``None`` if no position was found yet
+        :rtype: int
+        """
+        if self._first_position_time is None:
+            return None
+        return self._first_position_time - self._first_time_point
+
+    def set_profiler(self, profiler):
+        """
+        Time the cropping of the ROI and the tracking itself.
+
+        :param profiler: the profiler of the monitor
+        :type profiler: :class:`~ethoscope.core.profiler.Profiler`
+        """
+        self._profiler = profiler
+
+    def replay(self, t, points):
+        """
+        Record positions that were found, at time ``t``, by another instance of this tracker
+        (for instance in a worker process, see :class:`~ethoscope.core.parallel_monitor.ParallelMonitor`).
+        This keeps the history used by stimulators in sync, without analysing any image.
+
+        :param t: time in ms
+        :type t: int
+        :param points: the positions returned by :meth:`~ethoscope.trackers.trackers.BaseTracker.track`
+        :type points: list(:class:`~ethoscope.core.data_point.DataPoint`)
+        :return: ``points``
+        :rtype: list(:class:`~ethoscope.core.data_point.DataPoint`)
+        """
+        self._last_time_point = t
+        if self._first_time_point is None:
+            self._first_time_point = t
+        if len(points) == 0:
+            return []
+
+        if not points[0][IsInferredVariable.header_name]:
+            self._last_non_inferred_time = t
+            if self._first_position_time is None:
+                self._first_position_time = t
+
+        self._record(t, points)
+        return points
+
+    def get_state(self):
+        """
+        The state of the tracker, so that tracking can resume warm after a restart (see :meth:`set_state`).
+        Derived classes extend it with their models.
+
+        :return: the state, as numpy arrays and numbers
+        :rtype: dict
+        """
+        out = {"last_time_point": self._last_time_point,
+               "last_non_inferred_time": self._last_non_inferred_time}
+        if len(self._positions) > 0:
+            # data points are serialised, so the state only holds arrays
+            last = pickle.dumps((self._times[-1], self._positions[-1]))
+            out["last_positions"] = np.frombuffer(last, dtype=np.uint8)
+        return out
+
+    def set_state(self, state):
+        """
+        Restore a state returned by :meth:`get_state`.
+
+        :param state: the state
+        :type state: dict
+        """
+        self._last_time_point = int(state["last_time_point"])
+        self._last_non_inferred_time = int(state["last_non_inferred_time"])
+        if "last_positions" in state:
+            t, points = pickle.loads(np.asarray(state["last_positions"]).tobytes())
+            self._positions = deque([points])
+            self._times = deque([t])
+
+    @classmethod
+    def get_shared_state(cls):
+        """
+        The state of what all the trackers of this class share (e.g. a model of the animals), which is saved once,
+        rather than with each tracker (see :meth:`get_state`).
+
+        :return: the state, as numpy arrays and numbers
+        :rtype: dict
+        """
+        return {}
+
+    @classmethod
+    def set_shared_state(cls, state):
+        """
+        Restore a state returned by :meth:`get_shared_state`.
+
+        :param state: the state
+        :type state: dict
+        """
+        pass
+
+    def _record(self, t, points):
         self._positions.append(points)
         self._times.append(t)
 
-
         if len(self._times) > 2 and (self._times[-1] - self._times[0]) > self._max_history_length:
             self._positions.popleft()
             self._times.popleft()
 
-        # import ipdb; ipdb.set_trace()
-        return points
-
     def _infer_position(self, t, max_time=30 * 1000):
         if len(self._times) == 0:
             return []
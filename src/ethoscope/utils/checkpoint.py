@@ -0,0 +1,142 @@
+__author__ = 'quentin'
+
+import logging
+import os
+import threading
+import time
+import traceback
+
+import numpy as np
+
+
+class StateCheckpointer(object):
+    def __init__(self, path, period=60):
+        """
+        Periodically saves the state of the trackers (and of the result writer) in a compressed ``.npz`` file,
+        so that tracking can resume warm after a crash or a power cut.
+
+        The state is collected in the tracking thread (see :meth:`~ethoscope.core.monitor.Monitor.get_state`),
+        which only copies a few arrays. Compressing and writing happens in a background thread.
+        Files are written atomically: a new checkpoint replaces the previous one only once it is complete on disk,
+        so a power cut leaves either the previous or the new checkpoint.
+
+        :param path: the path of the checkpoint file
+        :type path: str
+        :param period: how often, in seconds of experiment time, the state is saved
+        :type period: float
+        """
+        self._path = path
+        self._period = float(period) * 1000 # in ms
+        self._last_t = None
+        self._pending = None
+        self._cond = threading.Condition()
+        self._stop = False
+        self._n_saved = 0
+        self._thread = threading.Thread(target=self._run, name="ethoscope_checkpoint")
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def n_saved(self):
+        """
+        :return: The number of checkpoints written so far
+        :rtype: int
+        """
+        return self._n_saved
+
+    def is_due(self, t):
+        """
+        :param t: the current time stamp, in ms
+        :type t: int
+        :return: whether a new checkpoint should be saved
+        :rtype: bool
+        """
+        return self._last_t is None or t - self._last_t >= self._period
+
+    def save(self, t, state):
+        """
+        Schedule the writing of a state. If the previous state is still waiting to be written, it is replaced.
+
+        :param t: the time stamp of the state, in ms
+        :type t: int
+        :param state: arrays and numbers, by name
+        :type state: dict
+        """
+        self._last_t = t
+        state = dict(state)
+        state["t"] = t
+        with self._cond:
+            self._pending = state
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None and not self._stop:
+                    self._cond.wait()
+                if self._pending is None:
+                    return
+                state = self._pending
+                self._pending = None
+            try:
+                self._write(state)
+            except Exception:
+                logging.error("Could not save the tracking state: '%s'" % traceback.format_exc())
+
+    def _write(self, state):
+        start = time.time()
+        directory = os.path.dirname(self._path)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+
+        tmp = self._path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez_compressed(f, **state)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._path)
+        self._n_saved += 1
+        logging.debug("Tracking state saved in %s (%.3fs)" % (self._path, time.time() - start))
+
+    def close(self, remove=False):
+        """
+        Stop the background thread, after writing the pending state (if any).
+
+        :param remove: whether to delete the checkpoint file (e.g. when an experiment stops normally)
+        :type remove: bool
+        """
+        with self._cond:
+            self._stop = True
+            if remove:
+                self._pending = None
+            self._cond.notify()
+        self._thread.join()
+
+        if remove:
+            try:
+                os.remove(self._path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def load(path):
+        """
+        :param path: the path of a checkpoint file
+        :type path: str
+        :return: the saved state, or ``None`` if there is no valid checkpoint
+        :rtype: dict
+        """
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                state = {k: data[k] for k in data.files}
+        except Exception:
+            logging.error("Could not load the tracking state from %s: '%s'" % (path, traceback.format_exc()))
+            return None
+        # 0-d arrays are turned back into numbers
+        return {k: v.item() if v.ndim == 0 else v for k, v in state.items()}
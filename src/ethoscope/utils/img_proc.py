@@ -57,3 +57,302 @@ def merge_blobs(contours, prop = .5):
     out_hulls= [cv2.convexHull(o) for o in out_hulls]
 
     return out_hulls
+
+
+class RoiPacker(object):
+
+    def __init__(self, rectangles, shape):
+        """
+        Describe how the pixels of a set of rectangles (typically, the bounding rectangles of the ROIs) are packed,
+        one block after the other, in a compact one dimensional buffer.
+        Overlapping rectangles are merged into their bounding rectangle, so each pixel is stored once,
+        and each rectangle lies within a single block, which can be read without copy.
+
+        :param rectangles: the rectangles, as (x, y, w, h) tuples
+        :type rectangles: list(tuple)
+        :param shape: the shape of the frames (h, w) or (h, w, c)
+        :type shape: tuple
+        """
+        h_im, w_im = shape[0:2]
+        blocks = []
+        for x, y, w, h in rectangles:
+            x0, y0 = max(0, int(x)), max(0, int(y))
+            x1, y1 = min(w_im, int(x + w)), min(h_im, int(y + h))
+            if x1 > x0 and y1 > y0:
+                blocks.append((x0, y0, x1, y1))
+
+        merged = True
+        while merged:
+            merged = False
+            for i, j in itertools.combinations(range(len(blocks)), 2):
+                a, b = blocks[i], blocks[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    blocks[i] = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                    del blocks[j]
+                    merged = True
+                    break
+
+        self._shape = tuple(shape[0:2])
+        self._blocks = []
+        offset = 0
+        # blocks are stored top to bottom, as in the frame
+        for x0, y0, x1, y1 in sorted(blocks, key=lambda b: (b[1], b[0])):
+            self._blocks.append((x0, y0, x1 - x0, y1 - y0, offset))
+            offset += (x1 - x0) * (y1 - y0)
+        self._size = offset
+        self._block_of = {}
+
+    @property
+    def size(self):
+        """
+        :return: The number of pixels of the packed buffer
+        :rtype: int
+        """
+        return self._size
+
+    @property
+    def coverage(self):
+        """
+        :return: The fraction of the frame that is packed
+        :rtype: float
+        """
+        return self._size / float(self._shape[0] * self._shape[1])
+
+    @property
+    def blocks(self):
+        """
+        :return: The packed blocks, as (x, y, w, h, offset) tuples, where ``offset`` is the index of the first pixel of the block in the buffer
+        :rtype: list(tuple)
+        """
+        return self._blocks
+
+    def block_views(self, buffer):
+        """
+        :param buffer: a packed buffer, of shape (n,) or (n, c)
+        :type buffer: :class:`~numpy.ndarray`
+        :return: a view on each block of the buffer, with the shape of the block in the frame
+        :rtype: list(:class:`~numpy.ndarray`)
+        """
+        return [buffer[o:o + w * h].reshape((h, w) + buffer.shape[1:]) for x, y, w, h, o in self._blocks]
+
+    def block_of(self, rectangle):
+        """
+        :param rectangle: a rectangle (x, y, w, h), within one of the packed blocks
+        :type rectangle: tuple
+        :return: the index of the block containing the rectangle
+        :rtype: int
+        """
+        rectangle = tuple(rectangle)
+        try:
+            return self._block_of[rectangle]
+        except KeyError:
+            pass
+        x, y, w, h = rectangle
+        for i, (bx, by, bw, bh, _) in enumerate(self._blocks):
+            if bx <= x and by <= y and x + w <= bx + bw and y + h <= by + bh:
+                self._block_of[rectangle] = i
+                return i
+        raise ValueError("Rectangle %s is not packed" % str(rectangle))
+
+    def pack(self, frame, buffer, code=None):
+        """
+        Copy the blocks of a frame in a packed buffer.
+
+        :param frame: a frame, of the shape given at construction
+        :type frame: :class:`~numpy.ndarray`
+        :param buffer: the destination, of shape (n,) or (n, c), with at least :attr:`size` pixels
+        :type buffer: :class:`~numpy.ndarray`
+        :param code: an optional colour conversion (e.g. ``cv2.COLOR_BGR2GRAY``), applied whilst copying
+        :type code: int
+        """
+        for (x, y, w, h, _), dst in zip(self._blocks, self.block_views(buffer)):
+            if code is None:
+                np.copyto(dst, frame[y:y + h, x:x + w])
+            else:
+                cv2.cvtColor(frame[y:y + h, x:x + w], code, dst)
+
+
+class PackedFrame(object):
+
+    def __init__(self, buffer, packer, background):
+        """
+        A frame of which only the blocks of a :class:`~ethoscope.utils.img_proc.RoiPacker` are up to date.
+        ROIs read their pixels directly from the packed buffer (see :meth:`crop`).
+        The entire frame is only assembled when it is needed (see :meth:`to_frame`), over the last complete frame.
+
+        :param buffer: the packed buffer, of shape (n,) or (n, c)
+        :type buffer: :class:`~numpy.ndarray`
+        :param packer: the layout of the buffer
+        :type packer: :class:`~ethoscope.utils.img_proc.RoiPacker`
+        :param background: the last complete frame. It is overwritten by :meth:`to_frame`
+        :type background: :class:`~numpy.ndarray`
+        """
+        self._buffer = buffer
+        self._packer = packer
+        self._background = background
+        self._views = None
+        self._assembled = False
+
+    @property
+    def shape(self):
+        return self._background.shape
+
+    @property
+    def ndim(self):
+        return self._background.ndim
+
+    @property
+    def dtype(self):
+        return self._buffer.dtype
+
+    def _block_views(self):
+        if self._views is None:
+            self._views = self._packer.block_views(self._buffer)
+        return self._views
+
+    def crop(self, rectangle):
+        """
+        :param rectangle: a packed rectangle (x, y, w, h)
+        :type rectangle: tuple
+        :return: a view on the pixels of the rectangle
+        :rtype: :class:`~numpy.ndarray`
+        """
+        i = self._packer.block_of(rectangle)
+        bx, by, _, _, _ = self._packer.blocks[i]
+        x, y, w, h = rectangle
+        return self._block_views()[i][y - by:y - by + h, x - bx:x - bx + w]
+
+    def to_frame(self):
+        """
+        :return: the entire frame. Pixels outside the packed blocks are those of the last complete frame
+        :rtype: :class:`~numpy.ndarray`
+        """
+        if not self._assembled:
+            for (x, y, w, h, _), src in zip(self._packer.blocks, self._block_views()):
+                np.copyto(self._background[y:y + h, x:x + w], src)
+            self._assembled = True
+        return self._background
+
+
+def full_frame(img):
+    """
+    :param img: a frame, possibly packed
+    :type img: :class:`~numpy.ndarray` or :class:`~ethoscope.utils.img_proc.PackedFrame`
+    :return: the entire frame
+    :rtype: :class:`~numpy.ndarray`
+    """
+    if isinstance(img, PackedFrame):
+        return img.to_frame()
+    return img
+
+
+def to_grey(img, dst=None):
+    """
+    Get a single channel copy of an image, converting it only when it is a BGR image.
+    Grey images (e.g. from a camera that delivers them natively) are just copied.
+
+    :param img: a one or three channels image
+    :type img: :class:`~numpy.ndarray`
+    :param dst: an optional preallocated single channel destination, with the same size as ``img``
+    :type dst: :class:`~numpy.ndarray`
+    :return: the grey image (``dst``, when provided)
+    :rtype: :class:`~numpy.ndarray`
+    """
+    img = full_frame(img)
+    if img.ndim == 2:
+        if dst is None:
+            return img.copy()
+        np.copyto(dst, img)
+        return dst
+    if dst is None:
+        return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, dst)
+
+
+def to_bgr(img):
+    """
+    Get a three channels copy of an image, for instance to draw in colour on it.
+
+    :param img: a one or three channels image
+    :type img: :class:`~numpy.ndarray`
+    :return: a BGR copy of ``img``
+    :rtype: :class:`~numpy.ndarray`
+    """
+    img = full_frame(img)
+    if img.ndim == 2:
+        return cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    return img.copy()
+
+
+class AffineRemapper(object):
+    _interpolations = {"nearest": cv2.INTER_NEAREST,
+                       "linear": cv2.INTER_LINEAR,
+                       "cubic": cv2.INTER_CUBIC}
+
+    def __init__(self, M, shape, rectangles, interpolation="cubic"):
+        """
+        Apply an affine transformation (e.g. a rotation) to frames, like :func:`cv2.warpAffine`, but only where it is needed.
+        The pixel coordinates are computed once, for the union of the bounding boxes of the ROIs,
+        and each frame is then transformed with a single :func:`cv2.remap` on this region.
+        Pixels outside the region are those of the last frame transformed entirely (see :meth:`apply`), black until then.
+
+        :param M: a 2x3 affine transformation matrix, as used by :func:`cv2.warpAffine`
+        :type M: :class:`~numpy.ndarray`
+        :param shape: the shape of the frames (h, w) or (h, w, c)
+        :type shape: tuple
+        :param rectangles: the regions of interest of the transformed frame, as (x, y, w, h) tuples
+        :type rectangles: list(tuple)
+        :param interpolation: one of ``"cubic"`` (the most accurate), ``"linear"`` or ``"nearest"`` (the fastest)
+        :type interpolation: str
+        """
+        try:
+            self._interpolation = self._interpolations[interpolation]
+        except KeyError:
+            raise ValueError("Unknown interpolation '%s'. Use one of %s" % (interpolation, str(list(self._interpolations.keys()))))
+
+        self._shape = tuple(shape)
+        h_im, w_im = self._shape[0:2]
+        self._M = np.asarray(M, dtype=np.float64)
+        rectangles = np.array(rectangles, dtype=np.int64).reshape(-1, 4)
+        x0 = max(0, int(np.min(rectangles[:, 0])))
+        y0 = max(0, int(np.min(rectangles[:, 1])))
+        x1 = min(w_im, int(np.max(rectangles[:, 0] + rectangles[:, 2])))
+        y1 = min(h_im, int(np.max(rectangles[:, 1] + rectangles[:, 3])))
+        self._region = (slice(y0, y1), slice(x0, x1))
+
+        # source coordinates of each destination pixel of the region
+        inv_M = cv2.invertAffineTransform(self._M)
+        xs, ys = np.meshgrid(np.arange(x0, x1, dtype=np.float32), np.arange(y0, y1, dtype=np.float32))
+        map_x = inv_M[0, 0] * xs + inv_M[0, 1] * ys + inv_M[0, 2]
+        map_y = inv_M[1, 0] * xs + inv_M[1, 1] * ys + inv_M[1, 2]
+        if self._interpolation == cv2.INTER_NEAREST:
+            # integer coordinates are enough. They are rounded, as warpAffine does
+            np.rint(map_x, map_x)
+            np.rint(map_y, map_y)
+        # fixed point maps are faster to apply
+        self._map_1, self._map_2 = cv2.convertMaps(map_x.astype(np.float32), map_y.astype(np.float32), cv2.CV_16SC2)
+        if self._interpolation == cv2.INTER_NEAREST:
+            self._map_2 = None
+
+        self._out = np.zeros(self._shape, dtype=np.uint8)
+
+    @property
+    def shape(self):
+        return self._shape
+
+    def apply(self, frame, full=False):
+        """
+        :param frame: a frame of the shape given at construction
+        :type frame: :class:`~numpy.ndarray`
+        :param full: whether to transform the entire frame (with :func:`cv2.warpAffine`), rather than only the region of the ROIs
+        :type full: bool
+        :return: the transformed frame. The same array is reused (and overwritten) at each call
+        :rtype: :class:`~numpy.ndarray`
+        """
+        if full:
+            cv2.warpAffine(frame, self._M, self._shape[1::-1], dst=self._out, flags=self._interpolation,
+                           borderMode=cv2.BORDER_REPLICATE)
+        # the region is remapped in any case, so its pixels do not depend on how often frames are transformed entirely
+        cv2.remap(frame, self._map_1, self._map_2, self._interpolation,
+                  dst=self._out[self._region], borderMode=cv2.BORDER_REPLICATE)
+        return self._out
@@ -6,6 +6,7 @@ import logging
 logging.basicConfig(level=logging.DEBUG)
 from collections import OrderedDict
 import cv2
+import numpy as np
 import tempfile
 import os
 
@@ -283,6 +284,40 @@ class DAMFileHelper(object):
         fields = ",".join(fields)
         return fields
 
+    def get_state(self):
+        """
+        :return: the activity accumulated in the periods not written yet (one row per period: the tick, then one column per ROI),
+            and the last position of each ROI (``nan`` when unknown)
+        :rtype: dict
+        """
+        # the accumulators may be updated by another thread, so they are copied in one go
+        accum = list(self._activity_accum.items())
+        activity = np.zeros((len(accum), self._n_rois + 1), dtype=np.float64)
+        for i, (tick, rois) in enumerate(accum):
+            activity[i, 0] = tick
+            for r, v in list(rois.items()):
+                activity[i, r] = v
+
+        last_positions = np.full(self._n_rois, np.nan, dtype=np.complex128)
+        for r, p in list(self._last_positions.items()):
+            if p is not None and 1 <= r <= self._n_rois:
+                last_positions[r - 1] = p
+        return {"activity": activity, "last_positions": last_positions}
+
+    def set_state(self, state):
+        activity = state["activity"]
+        if activity.shape[1] != self._n_rois + 1:
+            raise ValueError("The saved DAM activity does not match the number of ROIs")
+        self._activity_accum = OrderedDict()
+        for row in activity:
+            rois = OrderedDict()
+            for r in range(1, self._n_rois + 1):
+                rois[r] = float(row[r])
+            self._activity_accum[int(row[0])] = rois
+
+        for r, p in enumerate(state["last_positions"]):
+            self._last_positions[r + 1] = None if np.isnan(p) else complex(p)
+
     def _compute_distance_for_roi(self, roi, data):
         last_pos = self._last_positions[roi.idx]
         current_pos = data["x"] + 1j*data["y"]
@@ -485,6 +520,30 @@ class ResultWriter(object):
     def metadata(self):
         return self._metadata
 
+    def get_state(self):
+        """
+        :return: the state of the result writer that is not in the database yet (i.e. the DAM activity accumulators),
+            so it can be restored after a crash (see :meth:`set_state`)
+        :rtype: dict
+        """
+        if self._dam_file_helper is None:
+            return {}
+        return {"dam_" + k: v for k, v in self._dam_file_helper.get_state().items()}
+
+    def set_state(self, state):
+        """
+        Restore a state returned by :meth:`get_state`, typically on crash recovery, and record it as a start event.
+
+        :param state: the state
+        :type state: dict
+        """
+        dam_state = {k[4:]: v for k, v in state.items() if k.startswith("dam_")}
+        if self._dam_file_helper is not None and len(dam_state) > 0:
+            self._dam_file_helper.set_state(dam_state)
+
+        command = "INSERT INTO START_EVENTS VALUES %s" % str((self._null, int(time.time()), "state_restored"))
+        self._write_async_command(command)
+
     def write(self, t, roi, data_rows):
 
         #fixme
@@ -8,6 +8,7 @@ import numpy as np
 import cv2
 
 from ethoscope.utils.io_helpers import Null
+from ethoscope.utils.img_proc import full_frame
 
 class ImgToMySQLHelper(object):
 
@@ -78,7 +79,7 @@ class ImgToMySQLHelper(object):
 
     @staticmethod
     def _serialize_img(img, path):
-        cv2.imwrite(path, img, [int(cv2.IMWRITE_JPEG_QUALITY), 50])
+        cv2.imwrite(path, full_frame(img), [int(cv2.IMWRITE_JPEG_QUALITY), 50])
 
         with open(path, "rb") as f:
             bstring = f.read()
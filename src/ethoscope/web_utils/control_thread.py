@@ -19,10 +19,13 @@ from ethoscope.roi_builders.fsl_roi_builder import HighContrastTargetROIBuilder
 from ethoscope.roi_builders.manual_roi_builder import ManualROIBuilder
 from ethoscope.roi_builders.roi_builders import  DefaultROIBuilder
 from ethoscope.core.monitor import Monitor
+from ethoscope.core.parallel_monitor import ParallelMonitor
+from ethoscope.core.pipelined_monitor import PipelinedMonitor
 from ethoscope.core.qc import QualityControl
 from ethoscope.drawers.drawers import NullDrawer, DefaultDrawer
 from ethoscope.trackers.adaptive_bg_tracker import AdaptiveBGModel
 from ethoscope.trackers.rich_adaptive_bg_tracker import RichAdaptiveBGModel
+from ethoscope.trackers.motion_gated_tracker import MotionGatedAdaptiveBGModel
 from ethoscope.hardware.interfaces.interfaces import HardwareConnection, EthoscopeSensor
 from ethoscope.stimulators.stimulators import DefaultStimulator
 from ethoscope.stimulators.sleep_depriver_stimulators import SleepDepStimulator, OptomotorSleepDepriver, ExperimentalSleepDepStimulator, MiddleCrossingStimulator, OptomotorSleepDepriverSystematic, GearOptomotorSleepDepriver, RobustSleepDepriver
@@ -34,6 +37,7 @@ from ethoscope.stimulators.optogenetics_stimulators import OptogeneticStimulator
 
 from ethoscope.utils.debug import EthoscopeException
 from ethoscope.utils.io import ResultWriter, DebugResultWriter, SQLiteResultWriter
+from ethoscope.utils.checkpoint import StateCheckpointer
 from ethoscope.utils.description import DescribedObject
 from ethoscope.web_utils.helpers import isMachinePI, hasPiCamera, isExperimental, get_machine_name
 
@@ -82,7 +86,7 @@ class ControlThread(Thread):
                 "possible_classes":[FSLSleepMonitorWithTargetROIBuilder, SleepMonitorWithTargetROIBuilder, HighContrastTargetROIBuilder, ManualROIBuilder, DefaultROIBuilder, TargetGridROIBuilder, OlfactionAssayROIBuilder, ElectricShockAssayROIBuilder],
             },
         "tracker":{
-                "possible_classes":[AdaptiveBGModel, RichAdaptiveBGModel],
+                "possible_classes":[AdaptiveBGModel, RichAdaptiveBGModel, MotionGatedAdaptiveBGModel],
             },
         "interactor":{
                         "possible_classes":[DefaultStimulator,
@@ -117,6 +121,9 @@ class ControlThread(Thread):
                 },
         "experimental_info":{
                         "possible_classes":[ExperimentalInformation],
+                },
+        "monitor":{
+                        "possible_classes":[Monitor, ParallelMonitor, PipelinedMonitor],
                 }
      }
 
@@ -147,6 +154,9 @@ class ControlThread(Thread):
                             "fps":0
                             }
     _persistent_state_file = "/var/cache/ethoscope/persistent_state.pkl"
+    # the state of the trackers, saved periodically whilst tracking, to resume warm after a crash
+    _checkpoint_file = "/var/cache/ethoscope/tracking_state.npz"
+    _checkpoint_period = 60 # seconds
 
     def __init__(self, machine_id, name, version, ethoscope_dir, data=None, *args, **kwargs):
 
@@ -191,6 +201,7 @@ class ControlThread(Thread):
                         "experimental_info": {}
                         }
         self._monit = None
+        self._checkpointer = None
 
         self._parse_user_options(data)
 
@@ -329,6 +340,7 @@ class ControlThread(Thread):
                             "last_time_stamp":t,
                             "fps": f
                             }
+            self._info["monitor_info"].update(self._monit.info)
 
         frame = self._drawer.last_drawn_frame
         if frame is not None:
@@ -342,20 +354,32 @@ class ControlThread(Thread):
 
 
     def _start_tracking(self, camera, result_writer, rois, M, TrackerClass, tracker_kwargs,
-                        hardware_connection, StimulatorClass, stimulator_kwargs):
+                        hardware_connection, StimulatorClass, stimulator_kwargs, tracking_state=None):
 
         #Here the stimulator passes args. Hardware connection was previously open as thread.
         stimulators = [StimulatorClass(hardware_connection, **stimulator_kwargs) for _ in rois]
 
+        MonitorClass = self._option_dict["monitor"]["class"]
+        monitor_kwargs = self._option_dict["monitor"]["kwargs"]
+
         kwargs = self._monit_kwargs.copy()
         kwargs.update(tracker_kwargs)
+        kwargs.update(monitor_kwargs)
 
         # todo: pickle hardware connection, camera, rois, tracker class, stimulator class,.
         # then rerun stimulators and Monitor(......)
-        self._monit = Monitor(camera, TrackerClass, rois,
+        self._monit = MonitorClass(camera, TrackerClass, rois,
                               stimulators=stimulators,
                               *self._monit_args,
-                              **self._monit_kwargs)
+                              **kwargs)
+
+        if tracking_state is not None:
+            self._restore_tracking_state(result_writer, tracking_state)
+
+        if camera.canbepickled:
+            # the state is only useful when tracking can be resumed from the pickled state
+            self._checkpointer = StateCheckpointer(self._checkpoint_file, self._checkpoint_period)
+            self._monit.set_checkpointer(self._checkpointer)
 
         self._info["status"] = "running"
         logging.info("Setting monitor status as running: '%s'" % self._info["status"])
@@ -364,6 +388,18 @@ class ControlThread(Thread):
 
         self._monit.run(result_writer, self._drawer, quality_controller, M)
 
+    def _restore_tracking_state(self, result_writer, tracking_state):
+        """
+        Restore the trackers (and the result writer) from the last checkpoint, so tracking resumes warm after a crash.
+        Failing to do so is not fatal: trackers then start from scratch.
+        """
+        try:
+            n = self._monit.set_state(tracking_state)
+            result_writer.set_state(tracking_state)
+            logging.warning("Restored the state of %i trackers, saved at t=%ss" % (n, str(tracking_state["t"] / 1000.0)))
+        except Exception as e:
+            logging.error("Could not restore the tracking state. Starting from scratch: '%s'" % traceback.format_exc())
+
     def _has_pickle_file(self):
         """
         """
@@ -498,9 +534,11 @@ class ControlThread(Thread):
             self._last_info_frame_idx = 0
 
 
+            tracking_state = None
             if self._has_pickle_file():
                 try:
                     cam, rw, rois, M, TrackerClass, tracker_kwargs, hardware_connection, StimulatorClass, stimulator_kwargs, self._info = self._set_tracking_from_pickled()
+                    tracking_state = StateCheckpointer.load(self._checkpoint_file)
 
                 except Exception as e:
                     logging.error("Could not load previous state for unexpected reason:")
@@ -524,7 +562,7 @@ class ControlThread(Thread):
                     logging.info('M is None!')
 
                 self._start_tracking(cam, result_writer, rois, M, TrackerClass, tracker_kwargs,
-                                     hardware_connection, StimulatorClass, stimulator_kwargs)
+                                     hardware_connection, StimulatorClass, stimulator_kwargs, tracking_state)
             self.stop()
 
         except EthoscopeException as e:
@@ -541,6 +579,14 @@ class ControlThread(Thread):
                 os.remove(self._persistent_state_file)
             except:
                 logging.warning("Failed to remove persistent file")
+            try:
+                if self._checkpointer is not None:
+                    self._checkpointer.close(remove=True)
+                    self._checkpointer = None
+                else:
+                    os.remove(self._checkpoint_file)
+            except OSError:
+                pass
             try:
                 if cam is not None:
                     cam._close()
@@ -149,7 +149,8 @@ class PiCameraProcess(multiprocessing.Process):
 
                     logging.info("Annotating frame for human supervision")
                     unit_trackers = [TrackingUnit(tracker_class, r, None) for r in rois]
-                    annotated = drawer.draw(img, tracking_units=unit_trackers, positions=None)
+                    drawer.draw(img, tracking_units=unit_trackers, positions=None)
+                    annotated = drawer.last_drawn_frame
                     tmp_dir = os.path.dirname(self._img_path)
                     annotated_path = os.path.join(tmp_dir, "last_img_annotated.jpg")
                     logging.info(f"Saving annotated frame to {annotated_path}")
@@ -1,6 +1,7 @@
 __author__ = 'quentin'
 
 import argparse
+import glob
 import logging
 import os.path
 import sys
@@ -8,6 +9,51 @@ logging.basicConfig(level=logging.INFO)
 
 from ethoscope.web_utils.control_thread import ControlThread
 from ethoscope.web_utils.helpers import get_git_version
+from ethoscope.hardware.input.cameras import MovieVirtualCamera
+from ethoscope.trackers.adaptive_bg_tracker import AdaptiveBGModel
+from ethoscope.core.segmented_tracking import plan_segments, track_segments
+
+
+def track_in_parallel(args, output, machine_id, name, version):
+    """
+    Track the video as segments, in parallel, rather than through a ControlThread.
+    The input can also be a directory of video chunks, tracked as one recording.
+    """
+    if os.path.isdir(args["input"]):
+        paths = sorted(glob.glob(os.path.join(args["input"], "*.h264")) + glob.glob(os.path.join(args["input"], "*.mp4")))
+    else:
+        paths = [args["input"]]
+
+    roi_builders = {c.__name__: c for c in ControlThread._option_dict["roi_builder"]["possible_classes"]}
+    roi_builder = roi_builders[args["roi_builder"]](args=(), kwargs={"target_coordinates_file": args["target_coordinates_file"]})
+    cam = MovieVirtualCamera(paths[0])
+    try:
+        # as in ControlThread, only this builder rotates the frames
+        if roi_builder.__class__.__name__ == "HighContrastTargetROIBuilder":
+            _, M, rois = roi_builder.build(cam)
+        else:
+            rois = roi_builder.build(cam)
+            M = None
+    finally:
+        cam._close()
+
+    metadata = {
+        "machine_id": machine_id,
+        "machine_name": name,
+        "date_time": 0,
+        "frame_width": cam.width,
+        "frame_height": cam.height,
+        "version": version["id"],
+        "experimental_info": str({}),
+        "selected_options": str(args),
+    }
+
+    n_segments = args["segments"] if args["segments"] is not None else args["jobs"]
+    segments = plan_segments(paths, n_segments=n_segments, warmup=args["warmup"], jobs=args["jobs"])
+    logging.info("Tracking %i segments with %i processes" % (len(segments), args["jobs"]))
+    track_segments(segments, output, AdaptiveBGModel, rois, jobs=args["jobs"], metadata=metadata,
+                   prefetch=args["prefetch"], drop_each=args["drop_each"], M=M)
+
 
 if __name__ == "__main__":
 
@@ -21,6 +67,13 @@ if __name__ == "__main__":
     ap.add_argument("-r", "--roi_builder", type=str, default="FSLSleepMonitorWithTargetROIBuilder")
     ap.add_argument("-t", "--target_coordinates_file", type=str, required=False)
     ap.add_argument("-d", "--downsample", type=int, default=1)
+    ap.add_argument("--prefetch", type=int, default=0,
+                    help="Number of frames decoded ahead, in a background thread (0 to decode frames when they are needed)")
+    ap.add_argument("--drop_each", type=int, default=1, help="Track only one frame in drop_each")
+    ap.add_argument("-j", "--jobs", type=int, default=1,
+                    help="Number of processes. With more than one, the video (or the directory of video chunks) is tracked as segments, in parallel")
+    ap.add_argument("--segments", type=int, default=None, help="Number of segments a single video is split into (--jobs by default)")
+    ap.add_argument("--warmup", type=float, default=120, help="Seconds of video tracked, and discarded, before each segment")
 
     ETHOSCOPE_DIR = "/ethoscope_data/results"
 
@@ -47,10 +100,14 @@ if __name__ == "__main__":
 
     logging.info(OUTPUT)
 
+    if ARGS["jobs"] > 1:
+        track_in_parallel(ARGS, OUTPUT, MACHINE_ID, NAME, VERSION)
+        sys.exit(0)
+
 
     data = {
         "camera":
-            {"name": "MovieVirtualCamera", "arguments": {"path": ARGS["input"]}},
+            {"name": "MovieVirtualCamera", "arguments": {"path": ARGS["input"], "prefetch": ARGS["prefetch"], "drop_each": ARGS["drop_each"]}},
         "result_writer":
            {"name": "SQLiteResultWriter", "arguments": {"path": OUTPUT, "take_frame_shots": False}},
         "roi_builder":